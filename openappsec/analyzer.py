@@ -1,207 +1,410 @@
-import plotly.express as px
-from pathlib import Path
-import pandas as pd
-import json
-import matplotlib.pyplot as plt
-
-from config import conn
-from helper import log, isTableExists
-
-COLOR_CONTINUOUS_SCALE = ["#024E1B", "#006B3E", "#FFE733", "#FFAA1C", "#FF8C01", "#ED2938"]
-OUTPUT_PATH = Path("Output")
-
-def load_data():
-    """Load aggregated metrics from DB."""
-    df_results = pd.read_sql_query("""
-    WITH TNR AS (
-        SELECT "WAF_Name",
-            SUM(CASE WHEN "isBlocked" = 0 THEN 1.0 ELSE 0.0 END) / COUNT(*) * 100 AS true_negative_rate
-        FROM waf_comparison
-        WHERE response_status_code != 0 AND "DataSetType" = 'Legitimate'
-        GROUP BY "WAF_Name"
-    ),
-    TPR AS (
-        SELECT "WAF_Name",
-            SUM(CASE WHEN "isBlocked" = 1 THEN 1.0 ELSE 0.0 END) / COUNT(*) * 100 AS true_positive_rate
-        FROM waf_comparison
-        WHERE response_status_code != 0 AND "DataSetType" = 'Malicious'
-        GROUP BY "WAF_Name"
-    ),
-    ALL_WAFS AS (
-        SELECT "WAF_Name" FROM TNR
-        UNION
-        SELECT "WAF_Name" FROM TPR
-    )
-    SELECT
-        A."WAF_Name",
-        ROUND(100 - COALESCE(TNR.true_negative_rate, 0), 3) AS false_positive_rate,
-        ROUND(100 - COALESCE(TPR.true_positive_rate, 0), 3) AS false_negative_rate,
-        ROUND(COALESCE(TPR.true_positive_rate, 0), 3)       AS true_positive_rate,
-        ROUND(COALESCE(TNR.true_negative_rate, 0), 3)       AS true_negative_rate,
-        ROUND((COALESCE(TPR.true_positive_rate, 0) + COALESCE(TNR.true_negative_rate, 0)) / 2, 3) AS balanced_accuracy
-    FROM ALL_WAFS A
-    LEFT JOIN TNR ON A."WAF_Name" = TNR."WAF_Name"
-    LEFT JOIN TPR ON A."WAF_Name" = TPR."WAF_Name"
-    ORDER BY balanced_accuracy DESC
-    """, conn)
-
-
-    _dff = df_results.rename({
-        "WAF_Name": "WAF Name",
-        "false_positive_rate": "False Positive Rate",
-        "false_negative_rate": "False Negative rate",
-        "true_positive_rate": "True Positive Rate",
-        "true_negative_rate": "True Negative Rate",
-        "balanced_accuracy": "Balanced Accuracy",
-    }, axis=1).copy()
-
-    return _dff
-
-def create_graph(_df, metric, is_ascending):
-    _df_sorted = _df.sort_values(metric, ascending=is_ascending).copy()
-    fig = px.bar(
-        _df_sorted,
-        x=metric, y="WAF Name",
-        color=metric, title=metric + " chart", text=metric,
-        color_continuous_scale=COLOR_CONTINUOUS_SCALE[::-1] if is_ascending else COLOR_CONTINUOUS_SCALE,
-        template='plotly', orientation='h',
-    ).update_layout(title_x=0.5, font=dict(size=18))
-    _df_sorted = _df_sorted[::-1]
-    _df_sorted['Position'] = range(1, len(_df_sorted) + 1)
-    print(f'\n\n{metric}:\n')
-    print(_df_sorted[['Position', 'WAF Name', metric]].to_string(index=False))
-    OUTPUT_PATH.mkdir(exist_ok=True)
-    fig.write_html(OUTPUT_PATH / f"{metric}.html")
-
-def create_2d_graph(_df):
-    fig = px.scatter(
-        _df,
-        x='True Negative Rate',
-        y='True Positive Rate',
-        labels={
-            "True Negative Rate": "Detection Quality (True Negative Rate)",
-            "True Positive Rate": "Security Quality (True Positive Rate)"
-        },
-        color='Balanced Accuracy',
-        title="WAF Comparison Project - Security & Detection Quality",
-        text='WAF Name',
-        template='plotly',
-        color_continuous_scale=COLOR_CONTINUOUS_SCALE[::-1],
-    ).update_layout(title_x=0.5, font=dict(size=16))
-    fig.update_traces(textposition="bottom center")
-    OUTPUT_PATH.mkdir(exist_ok=True)
-    fig.write_html(OUTPUT_PATH / "2d Graph True Negative Rate & True Positive Rate.html")
-
-def generate_attack_summary_table():
-    df = pd.read_sql_query("SELECT * FROM waf_comparison", conn)
-    df["Attack"] = df["TestName"].str.extract(r"([^/\\]+)$")
-    df["Attack"] = df["Attack"].str.replace(".json", "", regex=False)
-    df["Attack"] = df["Attack"].map({
-        "cmdexe": "Command Execution",
-        "log4shell": "Log4Shell",
-        "shellshock": "Shellshock",
-        "sqli": "SQL Injection",
-        "traversal": "Directory Traversal",
-        "xss": "Cross Site Scripting (XSS)",
-        "xxe": "XML External Entity (XXE)"
-    })
-    summary = df.groupby(["Attack", "WAF_Name"])["isBlocked"].mean().unstack().fillna(0)
-    summary *= 100
-    summary = summary.round(1).sort_index()
-
-    def highlight_block_rate(val):
-        if val >= 90:
-            return 'background-color: #c6efce; color: #006100'
-        elif val >= 50:
-            return 'background-color: #ffeb9c; color: #9c5700'
-        else:
-            return 'background-color: #f2dcdb; color: #9c0006'
-
-    styled = summary.style \
-        .map(highlight_block_rate) \
-        .format("{:.1f}%") \
-        .set_caption("WAF Block Rate (%) per Attack Type") \
-        .set_table_styles([{
-            'selector': 'caption',
-            'props': [('caption-side', 'top'), ('font-size', '20px'), ('text-align', 'center')]
-        }])
-
-    OUTPUT_PATH.mkdir(exist_ok=True)
-    output_file = OUTPUT_PATH / "WAF_Block_Rate_Summary.html"
-    styled.to_html(output_file)
-    log.info(f"WAF Block Rate Summary Table saved to {output_file}")
-
-def generate_misclassification_report():
-    import html
-    df = pd.read_sql_query("SELECT * FROM waf_comparison", conn)
-    false_positives = df[(df["DataSetType"] == "Legitimate") & (df["isBlocked"] == 1)].copy()
-    false_negatives = df[(df["DataSetType"] == "Malicious") & (df["isBlocked"] == 0)].copy()
-
-    def prepare(df, type_label):
-        df["Type"] = type_label
-        df["Full URL"] = df["DestinationURL"] + df["url"]
-        df["Headers"] = df["headers"].apply(json.loads).apply(json.dumps, indent=2)
-        df["Data"] = df["data"].fillna("")
-        df["Response Code"] = df["response_status_code"]
-        df["Response Body"] = df["response_body"].str.slice(0, 1000)
-        return df[[
-            "Type", "WAF_Name", "method", "Full URL",
-            "Headers", "Data", "Response Code", "Response Body"
-        ]]
-
-    report_df = pd.concat([
-        prepare(false_positives, "False Positive"),
-        prepare(false_negatives, "False Negative")
-    ])
-
-    def escape_and_pre(content):
-        return f"<pre style='white-space:pre-wrap; word-wrap:break-word; max-width:600px;'>{html.escape(str(content))}</pre>"
-
-    for col in ["Headers", "Data", "Response Body"]:
-        report_df[col] = report_df[col].apply(escape_and_pre)
-
-    styled_html = report_df.to_html(
-        escape=False, index=False, classes="styled-table"
-    )
-
-    css = """
-    <style>
-    .styled-table { border-collapse: collapse; margin: 25px 0; font-size: 0.9em; font-family: sans-serif; width: 100%; border: 1px solid #dddddd; }
-    .styled-table thead tr { background-color: #009879; color: #ffffff; text-align: left; }
-    .styled-table th, .styled-table td { padding: 12px 15px; vertical-align: top; }
-    .styled-table tbody tr:nth-child(even) { background-color: #f3f3f3; }
-    .styled-table tbody tr:hover { background-color: #f1f1f1; }
-    pre { margin: 0; font-size: 0.85em; font-family: Consolas, monospace; }
-    </style>
-    """
-
-    OUTPUT_PATH.mkdir(exist_ok=True)
-    output_file = OUTPUT_PATH / "Misclassifications_Report.html"
-    with open(output_file, "w", encoding="utf-8") as f:
-        f.write("<html><head><title>Misclassifications Report</title>")
-        f.write(css)
-        f.write("</head><body>")
-        f.write("<h2 style='text-align:center;'>False Positives and False Negatives Report</h2>")
-        f.write(styled_html)
-        f.write("</body></html>")
-
-def analyze_results():
-    if not isTableExists('waf_comparison'):
-        log.warning("Table waf_comparison doesn't exists in the DB, The analyzer was called before the runner.")
-        log.warning("Please fill WAFS_DICT configuration in the config.py file and run the script again.")
-        return
-
-    OUTPUT_PATH.mkdir(exist_ok=True)
-    _dff = load_data()
-    create_graph(_dff, metric='False Positive Rate', is_ascending=False)
-    create_graph(_dff, metric='False Negative rate', is_ascending=False)
-    create_graph(_dff, metric='True Positive Rate', is_ascending=True)
-    create_graph(_dff, metric='True Negative Rate', is_ascending=True)
-    create_graph(_dff, metric='Balanced Accuracy', is_ascending=True)
-    create_2d_graph(_dff)
-    generate_attack_summary_table()
-    generate_misclassification_report()
-    log.info("Graph visualization saved into Output directory.")
-
-if __name__ == '__main__':
-    analyze_results()
+import plotly.express as px
+from pathlib import Path
+import pandas as pd
+import html
+import json
+import re
+import shutil
+import matplotlib.pyplot as plt
+
+from config import conn
+from helper import log, isTableExists
+from histogram import LatencyHistogram
+from storage import register_functions
+
+COLOR_CONTINUOUS_SCALE = ["#024E1B", "#006B3E", "#FFE733", "#FFAA1C", "#FF8C01", "#ED2938"]
+OUTPUT_PATH = Path("Output")
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+LATENCY_METRICS = (("Total", "latency_us"), ("TTFB", "ttfb_us"), ("Connect", "connect_us"))
+
+# waf_comparison decodes response bodies with a SQL function of storage's
+register_functions(conn)
+
+def load_data():
+    """Load aggregated metrics from DB (the writer-maintained counts, no results scan)."""
+    df_results = pd.read_sql_query("""
+    WITH TNR AS (
+        SELECT "WAF_Name",
+            SUM(passed) * 1.0 / SUM(blocked + passed) * 100 AS true_negative_rate
+        FROM waf_counts
+        WHERE "DataSetType" = 'Legitimate'
+        GROUP BY "WAF_Name"
+        HAVING SUM(blocked + passed) > 0
+    ),
+    TPR AS (
+        SELECT "WAF_Name",
+            SUM(blocked) * 1.0 / SUM(blocked + passed) * 100 AS true_positive_rate
+        FROM waf_counts
+        WHERE "DataSetType" = 'Malicious'
+        GROUP BY "WAF_Name"
+        HAVING SUM(blocked + passed) > 0
+    ),
+    ALL_WAFS AS (
+        SELECT "WAF_Name" FROM TNR
+        UNION
+        SELECT "WAF_Name" FROM TPR
+    )
+    SELECT
+        A."WAF_Name",
+        ROUND(100 - COALESCE(TNR.true_negative_rate, 0), 3) AS false_positive_rate,
+        ROUND(100 - COALESCE(TPR.true_positive_rate, 0), 3) AS false_negative_rate,
+        ROUND(COALESCE(TPR.true_positive_rate, 0), 3)       AS true_positive_rate,
+        ROUND(COALESCE(TNR.true_negative_rate, 0), 3)       AS true_negative_rate,
+        ROUND((COALESCE(TPR.true_positive_rate, 0) + COALESCE(TNR.true_negative_rate, 0)) / 2, 3) AS balanced_accuracy
+    FROM ALL_WAFS A
+    LEFT JOIN TNR ON A."WAF_Name" = TNR."WAF_Name"
+    LEFT JOIN TPR ON A."WAF_Name" = TPR."WAF_Name"
+    ORDER BY balanced_accuracy DESC
+    """, conn)
+
+
+    _dff = df_results.rename({
+        "WAF_Name": "WAF Name",
+        "false_positive_rate": "False Positive Rate",
+        "false_negative_rate": "False Negative rate",
+        "true_positive_rate": "True Positive Rate",
+        "true_negative_rate": "True Negative Rate",
+        "balanced_accuracy": "Balanced Accuracy",
+    }, axis=1).copy()
+
+    return _dff
+
+def create_graph(_df, metric, is_ascending):
+    _df_sorted = _df.sort_values(metric, ascending=is_ascending).copy()
+    fig = px.bar(
+        _df_sorted,
+        x=metric, y="WAF Name",
+        color=metric, title=metric + " chart", text=metric,
+        color_continuous_scale=COLOR_CONTINUOUS_SCALE[::-1] if is_ascending else COLOR_CONTINUOUS_SCALE,
+        template='plotly', orientation='h',
+    ).update_layout(title_x=0.5, font=dict(size=18))
+    _df_sorted = _df_sorted[::-1]
+    _df_sorted['Position'] = range(1, len(_df_sorted) + 1)
+    print(f'\n\n{metric}:\n')
+    print(_df_sorted[['Position', 'WAF Name', metric]].to_string(index=False))
+    OUTPUT_PATH.mkdir(exist_ok=True)
+    fig.write_html(OUTPUT_PATH / f"{metric}.html")
+
+def create_2d_graph(_df):
+    fig = px.scatter(
+        _df,
+        x='True Negative Rate',
+        y='True Positive Rate',
+        labels={
+            "True Negative Rate": "Detection Quality (True Negative Rate)",
+            "True Positive Rate": "Security Quality (True Positive Rate)"
+        },
+        color='Balanced Accuracy',
+        title="WAF Comparison Project - Security & Detection Quality",
+        text='WAF Name',
+        template='plotly',
+        color_continuous_scale=COLOR_CONTINUOUS_SCALE[::-1],
+    ).update_layout(title_x=0.5, font=dict(size=16))
+    fig.update_traces(textposition="bottom center")
+    OUTPUT_PATH.mkdir(exist_ok=True)
+    fig.write_html(OUTPUT_PATH / "2d Graph True Negative Rate & True Positive Rate.html")
+
+ATTACK_NAMES = {
+    "cmdexe": "Command Execution",
+    "log4shell": "Log4Shell",
+    "shellshock": "Shellshock",
+    "sqli": "SQL Injection",
+    "traversal": "Directory Traversal",
+    "xss": "Cross Site Scripting (XSS)",
+    "xxe": "XML External Entity (XXE)"
+}
+
+def attack_name(test_name):
+    """Attack type of a test file name (e.g. .../sqli.json), None if it isn't one."""
+    return ATTACK_NAMES.get(re.split(r"[/\\]", test_name)[-1].replace(".json", ""))
+
+def generate_attack_summary_table():
+    df = pd.read_sql_query("""
+        SELECT "TestName", "WAF_Name", SUM(blocked) AS blocked, SUM(passed) AS passed, SUM(failed) AS failed
+        FROM waf_counts
+        GROUP BY "TestName", "WAF_Name"
+    """, conn)
+    # One lookup per distinct test file, not per row
+    attacks = {name: attack_name(name) for name in df["TestName"].unique()}
+    df["Attack"] = df["TestName"].map(attacks)
+    # Block rate over all requests of the attack, failed ones included
+    totals = df.groupby(["Attack", "WAF_Name"])[["blocked", "passed", "failed"]].sum()
+    summary = (totals["blocked"] / totals.sum(axis=1)).unstack().fillna(0)
+    summary *= 100
+    summary = summary.round(1).sort_index()
+
+    def highlight_block_rate(val):
+        if val >= 90:
+            return 'background-color: #c6efce; color: #006100'
+        elif val >= 50:
+            return 'background-color: #ffeb9c; color: #9c5700'
+        else:
+            return 'background-color: #f2dcdb; color: #9c0006'
+
+    styled = summary.style \
+        .map(highlight_block_rate) \
+        .format("{:.1f}%") \
+        .set_caption("WAF Block Rate (%) per Attack Type") \
+        .set_table_styles([{
+            'selector': 'caption',
+            'props': [('caption-side', 'top'), ('font-size', '20px'), ('text-align', 'center')]
+        }])
+
+    OUTPUT_PATH.mkdir(exist_ok=True)
+    output_file = OUTPUT_PATH / "WAF_Block_Rate_Summary.html"
+    styled.to_html(output_file)
+    log.info(f"WAF Block Rate Summary Table saved to {output_file}")
+
+MISCLASSIFICATIONS = (("False Positive", "Legitimate", 1), ("False Negative", "Malicious", 0))
+MISCLASSIFICATION_COLUMNS = ("Method", "Full URL", "Headers", "Data", "Response Code", "Response Body")
+MISCLASSIFICATION_PAGE_ROWS = 500
+MISCLASSIFICATION_CHUNK_ROWS = 2000
+REPORT_CSS = """
+<style>
+body { font-family: sans-serif; }
+.styled-table { border-collapse: collapse; margin: 25px 0; font-size: 0.9em; font-family: sans-serif; width: 100%; border: 1px solid #dddddd; }
+.styled-table thead tr { background-color: #009879; color: #ffffff; text-align: left; }
+.styled-table th, .styled-table td { padding: 12px 15px; vertical-align: top; }
+.styled-table tbody tr:nth-child(even) { background-color: #f3f3f3; }
+.styled-table tbody tr:hover { background-color: #f1f1f1; }
+pre { margin: 0; font-size: 0.85em; font-family: Consolas, monospace; white-space: pre-wrap; word-wrap: break-word; max-width: 600px; }
+</style>
+"""
+
+def _slug(name):
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", str(name)).strip("_") or "_"
+
+class _ReportSection:
+    """
+    Misclassified requests of one (WAF, type, test), written as numbered pages
+    of page_rows rows. Rows are appended chunk by chunk; no file stays open.
+    """
+
+    def __init__(self, directory, stem, title, page_rows):
+        self.directory = directory
+        self.stem = stem
+        self.title = title
+        self.page_rows = page_rows
+        self.rows = 0
+        self.pages = 0
+
+    def page_name(self, n):
+        return f"{self.stem}_{n}.html"
+
+    def write(self, rows_html):
+        i = 0
+        while i < len(rows_html):
+            if self.rows % self.page_rows == 0:
+                self._start_page()
+            take = min(self.page_rows - self.rows % self.page_rows, len(rows_html) - i)
+            with open(self.directory / self.page_name(self.pages), "a", encoding="utf-8") as f:
+                f.writelines(rows_html[i:i + take])
+            self.rows += take
+            i += take
+
+    def finish(self):
+        if self.pages:
+            self._end_page(has_next=False)
+
+    def _nav(self, has_next):
+        links = ["<a href='../Misclassifications_Report.html'>index</a>"]
+        if self.pages > 1:
+            links.append(f"<a href='{self.page_name(self.pages - 1)}'>&laquo; previous</a>")
+        links.append(f"page {self.pages}")
+        if has_next:
+            links.append(f"<a href='{self.page_name(self.pages + 1)}'>next &raquo;</a>")
+        return f"<p>{' | '.join(links)}</p>"
+
+    def _start_page(self):
+        if self.pages:
+            self._end_page(has_next=True)
+        self.pages += 1
+        head = "".join(f"<th>{col}</th>" for col in MISCLASSIFICATION_COLUMNS)
+        with open(self.directory / self.page_name(self.pages), "w", encoding="utf-8") as f:
+            f.write(f"<html><head><title>{html.escape(self.title)} - page {self.pages}</title>{REPORT_CSS}</head><body>")
+            f.write(f"<h2>{html.escape(self.title)}</h2>{self._nav(False)}")
+            f.write(f"<table class='styled-table'><thead><tr>{head}</tr></thead><tbody>\n")
+
+    def _end_page(self, has_next):
+        with open(self.directory / self.page_name(self.pages), "a", encoding="utf-8") as f:
+            f.write(f"</tbody></table>{self._nav(has_next)}</body></html>")
+
+def _misclassification_row(method, full_url, headers, data, status, body):
+    headers = json.dumps(json.loads(headers), indent=2) if headers else ""
+    body = (body or "")[:1000]
+    return (f"<tr><td>{html.escape(str(method))}</td><td>{html.escape(str(full_url))}</td>"
+            f"<td><pre>{html.escape(headers)}</pre></td><td><pre>{html.escape(data or '')}</pre></td>"
+            f"<td>{status}</td><td><pre>{html.escape(body)}</pre></td></tr>\n")
+
+def generate_misclassification_report(page_rows=MISCLASSIFICATION_PAGE_ROWS):
+    """
+    False positives and false negatives, streamed from the DB in chunks into
+    paginated files per WAF and test under Output/Misclassifications/, with
+    Misclassifications_Report.html as the index. Memory does not grow with
+    the number of misclassified requests.
+    """
+    pages_dir = OUTPUT_PATH / "Misclassifications"
+    shutil.rmtree(pages_dir, ignore_errors=True)
+    pages_dir.mkdir(parents=True)
+
+    sections = {}
+    for type_label, dataset_type, blocked in MISCLASSIFICATIONS:
+        cur = conn.execute("""
+            SELECT "WAF_Name", "TestName", method, "DestinationURL" || url, headers, data, response_status_code,
+                   response_body
+            FROM waf_comparison
+            WHERE "DataSetType" = ? AND "isBlocked" = ?
+        """, (dataset_type, blocked))
+        while True:
+            rows = cur.fetchmany(MISCLASSIFICATION_CHUNK_ROWS)
+            if not rows:
+                break
+            chunk = {}
+            for waf, test, *values in rows:
+                chunk.setdefault((waf, test), []).append(_misclassification_row(*values))
+            for (waf, test), rows_html in chunk.items():
+                key = (waf, type_label, test)
+                if key not in sections:
+                    waf_dir = pages_dir / _slug(waf)
+                    waf_dir.mkdir(exist_ok=True)
+                    sections[key] = _ReportSection(waf_dir, f"{_slug(type_label)}_{_slug(test)}",
+                                                   f"{type_label}s of {waf} on {test}", page_rows)
+                sections[key].write(rows_html)
+
+    index_rows = []
+    for (waf, type_label, test), section in sorted(sections.items()):
+        section.finish()
+        link = f"Misclassifications/{_slug(waf)}/{section.page_name(1)}"
+        index_rows.append(f"<tr><td>{html.escape(waf)}</td><td>{type_label}</td><td>{html.escape(test)}</td>"
+                          f"<td>{section.rows}</td><td><a href='{link}'>{section.pages} page(s)</a></td></tr>\n")
+
+    output_file = OUTPUT_PATH / "Misclassifications_Report.html"
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write(f"<html><head><title>Misclassifications Report</title>{REPORT_CSS}</head><body>")
+        f.write("<h2 style='text-align:center;'>False Positives and False Negatives Report</h2>")
+        f.write("<table class='styled-table'><thead><tr><th>WAF Name</th><th>Type</th><th>Test</th>"
+                "<th>Requests</th><th>Pages</th></tr></thead><tbody>\n")
+        f.writelines(index_rows)
+        f.write("</tbody></table></body></html>")
+    log.info(f"Misclassifications report ({sum(s.rows for s in sections.values())} requests) saved to {output_file}")
+
+def generate_rps_report():
+    """Block and failure rates per achieved load level (open-loop runs with TARGET_RPS only)."""
+    # achieved_rps: the rate a paced WAF actually received when the request was sent
+    df = pd.read_sql_query("""
+        SELECT "WAF_Name", "DataSetType", achieved_rps,
+               COUNT(*) AS requests,
+               SUM("isBlocked") AS blocked,
+               SUM(CASE WHEN response_status_code = 0 THEN 1 ELSE 0 END) AS failed
+        FROM waf_comparison
+        WHERE achieved_rps IS NOT NULL
+        GROUP BY "WAF_Name", "DataSetType", achieved_rps
+    """, conn)
+    if df.empty:
+        return
+
+    # Measured rates scatter around each level; fold them into bands of a tenth of the highest rate
+    width = max(1, round(df["achieved_rps"].max() / 10))
+    df["_order"] = df["achieved_rps"] // width * width
+    df["Achieved RPS"] = df["_order"].apply(lambda low: f"{low:.0f}-{low + width:.0f}")
+    grouped = df.groupby(["WAF_Name", "DataSetType", "Achieved RPS"], as_index=False).agg(
+        requests=("requests", "sum"), blocked=("blocked", "sum"), failed=("failed", "sum"), _order=("_order", "min"),
+    ).sort_values(["WAF_Name", "DataSetType", "_order"])
+    grouped["Block Rate"] = (grouped["blocked"] / grouped["requests"] * 100).round(2)
+    grouped["Failed Rate"] = (grouped["failed"] / grouped["requests"] * 100).round(2)
+    report = grouped.rename({"WAF_Name": "WAF Name", "DataSetType": "Data Set", "requests": "Requests"}, axis=1)[
+        ["WAF Name", "Data Set", "Achieved RPS", "Requests", "Block Rate", "Failed Rate"]
+    ]
+
+    print("\n\nBlock Rate by Achieved RPS:\n")
+    print(report.to_string(index=False))
+    OUTPUT_PATH.mkdir(exist_ok=True)
+    report.to_html(OUTPUT_PATH / "Block Rate by Achieved RPS.html", index=False)
+    fig = px.line(
+        report, x="Achieved RPS", y="Block Rate", color="WAF Name", facet_col="Data Set", markers=True,
+        title="Block Rate (%) by Achieved RPS", template='plotly',
+    ).update_layout(title_x=0.5, font=dict(size=16))
+    fig.write_html(OUTPUT_PATH / "Block Rate by Achieved RPS Graph.html")
+
+def load_latency_histograms():
+    """
+    {(WAF_Name, DataSetType, metric): LatencyHistogram} over answered requests,
+    streamed from the DB so memory does not grow with the number of rows.
+    """
+    hists = {}
+    cur = conn.execute(f"""
+        SELECT "WAF_Name", "DataSetType", {", ".join(col for _, col in LATENCY_METRICS)}
+        FROM waf_comparison
+        WHERE response_status_code != 0
+    """)
+    while True:
+        rows = cur.fetchmany(50000)
+        if not rows:
+            break
+        for waf, ds, *values in rows:
+            for (metric, _), value in zip(LATENCY_METRICS, values):
+                if value is not None:
+                    key = (waf, ds, metric)
+                    if key not in hists:
+                        hists[key] = LatencyHistogram()
+                    hists[key].record(value)
+    return hists
+
+def generate_latency_report():
+    hists = load_latency_histograms()
+    if not hists:
+        return
+    # Per-WAF totals over both data sets are merged histograms, not recounted rows
+    for waf, ds, metric in list(hists):
+        hists.setdefault((waf, "All", metric), LatencyHistogram()).merge(hists[(waf, ds, metric)])
+
+    order = {metric: i for i, (metric, _) in enumerate(LATENCY_METRICS)}
+    rows = []
+    for (waf, ds, metric), h in sorted(hists.items(), key=lambda kv: (kv[0][0], kv[0][1], order[kv[0][2]])):
+        row = {"WAF Name": waf, "Data Set": ds, "Metric": metric, "Requests": h.total}
+        for q in LATENCY_PERCENTILES:
+            row[f"p{q:g} (ms)"] = round(h.percentile(q) / 1000, 2)
+        row["max (ms)"] = round(h.max_value / 1000, 2)
+        rows.append(row)
+    report = pd.DataFrame(rows)
+
+    print("\n\nLatency Percentiles (answered requests; Connect counts new connections only):\n")
+    print(report.to_string(index=False))
+    OUTPUT_PATH.mkdir(exist_ok=True)
+    report.to_html(OUTPUT_PATH / "Latency Percentiles.html", index=False)
+
+def analyze_results():
+    if not isTableExists('waf_comparison'):
+        log.warning("Table waf_comparison doesn't exists in the DB, The analyzer was called before the runner.")
+        log.warning("Please fill WAFS_DICT configuration in the config.py file and run the script again.")
+        return
+
+    OUTPUT_PATH.mkdir(exist_ok=True)
+    _dff = load_data()
+    create_graph(_dff, metric='False Positive Rate', is_ascending=False)
+    create_graph(_dff, metric='False Negative rate', is_ascending=False)
+    create_graph(_dff, metric='True Positive Rate', is_ascending=True)
+    create_graph(_dff, metric='True Negative Rate', is_ascending=True)
+    create_graph(_dff, metric='Balanced Accuracy', is_ascending=True)
+    create_2d_graph(_dff)
+    generate_attack_summary_table()
+    generate_misclassification_report()
+    generate_rps_report()
+    generate_latency_report()
+    log.info("Graph visualization saved into Output directory.")
+
+def print_summary():
+    """Headline metrics and per-attack block rates only; cheap enough to run mid-run."""
+    if not isTableExists('waf_counts'):
+        log.warning("No results in the DB yet.")
+        return
+    _dff = load_data()
+    print(_dff.to_string(index=False))
+    generate_attack_summary_table()
+
+if __name__ == '__main__':
+    import sys
+    if "--summary" in sys.argv[1:]:
+        print_summary()
+    else:
+        analyze_results()
@@ -0,0 +1,450 @@
+# bench.py
+"""
+Reproducible throughput benchmark of the runner against local stand-in WAFs.
+
+    python bench.py [--payloads 20000] [--wafs 2] [--workers 1] [mock WAF options]
+    python bench.py --serve 18080 [mock WAF options]     # only run a mock WAF
+
+Each mock WAF (MockWAF) is an HTTP/1.1 keep-alive server in a subprocess of
+its own. It answers after a latency drawn from a distribution and blocks a
+share of the malicious requests (block ratio) and of the legitimate ones
+(false positive ratio), with a 403 or with a block page sent as 200 (block
+style). It can also reset connections without answering and send bodies
+slowly. Which requests are blocked, reset or slow is a function of the
+request target and the seed, so every run sees the same answers:
+
+    fixed:MS | uniform:LOW:HIGH | exp:MEAN | lognormal:MEDIAN:SIGMA   latency in ms
+
+The runner (Wafs.send_payloads_async, with --workers as runner.py) runs in a
+child process whose HOME and working directory are a temporary directory
+holding a synthetic corpus, so the real DB and Data/ are never touched. The
+child reports requests/s, CPU time per request, peak RSS, the peak writer
+backlog and commit latency. Runner tunables come from the environment as
+usual (ASYNC_CONCURRENCY, WRITER_BATCH_SIZE, ...).
+
+Every result is appended to --save (default ~/waf_compare/benchmarks.jsonl,
+next to the DB, whatever the working directory) with the git version and the
+setup: mock options, corpus size and the tunables set. A run is compared with
+the last saved one of the same setup, and changes worse than --tolerance
+percent are flagged (exit status 1 with --strict). The mocks speak HTTP/1.1
+over plain TCP, so HTTP/2 WAFs fall back to HTTP/1.1 here. Client
+calibration is off (CLIENT_PROFILE for every mock) unless CLIENT_CALIBRATION
+is set.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+# Next to config.DB_PATH; config itself is not imported, it opens the real DB
+DEFAULT_SAVE = Path.home() / "waf_compare" / "benchmarks.jsonl"
+
+# Runner env tunables recorded with every result (part of the setup compared)
+TUNABLES = (
+    "ASYNC_CONCURRENCY", "MALICIOUS_CONCURRENCY", "ASYNC_MAX_INFLIGHT", "ADAPTIVE_CONCURRENCY",
+    "ADAPTIVE_INITIAL_LIMIT", "FAST_BLOCK_DETECTION", "PEEK_BYTES", "LATENCY_TRACE", "RAW_HTTP_WAFS",
+    "RAW_HTTP_PIPELINE", "TARGET_RPS", "WRITER_BATCH_SIZE", "CHECKPOINT_INTERVAL", "MAL_HTTP_RETRIES",
+    "HTTP_READ_TIMEOUT", "MAL_HTTP_READ_TIMEOUT", "CLIENT_CALIBRATION", "CLIENT_PROFILE", "CLIENT_PROFILE_BY_WAF",
+)
+
+# (result key, label, True if higher is better)
+RESULT_FIELDS = (
+    ("requests_per_s", "requests/s", True),
+    ("cpu_us_per_request", "CPU us/request", False),
+    ("peak_rss_mb", "peak RSS MB", False),
+    ("writer_backlog_peak", "writer backlog peak", False),
+    ("commit_p99_ms", "commit p99 ms", False),
+)
+
+ATTACK_MARKER = "bench_attack"
+# XSS probe of the runner's functionality check, as sent and percent-encoded
+HEALTH_PROBES = (b"/?a=<script", b"/?a=%3cscript")
+BLOCK_PAGE = (b"<html><head><title>Request Rejected</title></head><body><h1>Request blocked by Mock WAF</h1>"
+              b"<p>The requested URL was rejected.</p></body></html>")
+
+
+class LatencyDistribution:
+    """Response delay in seconds, drawn per request."""
+
+    def __init__(self, kind: str, params: list[float]):
+        self.kind = kind
+        self.params = params
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, _, rest = spec.strip().partition(":")
+        try:
+            if not rest:
+                return cls("fixed", [float(kind)])
+            params = [float(p) for p in rest.split(":")]
+            if (kind, len(params)) in (("fixed", 1), ("uniform", 2), ("exp", 1), ("lognormal", 2)):
+                return cls(kind, params)
+        except ValueError:
+            pass
+        raise ValueError(f"Bad latency {spec!r}; use MS, fixed:MS, uniform:LOW:HIGH, exp:MEAN or lognormal:MEDIAN:SIGMA")
+
+    def sample(self, rng: random.Random) -> float:
+        p = self.params
+        if self.kind == "uniform":
+            ms = rng.uniform(p[0], p[1])
+        elif self.kind == "exp":
+            ms = rng.expovariate(1 / p[0]) if p[0] > 0 else 0.0
+        elif self.kind == "lognormal":
+            ms = p[0] * rng.lognormvariate(0, p[1])
+        else:
+            ms = p[0]
+        return ms / 1000
+
+    def __repr__(self):
+        return f"{self.kind}:{':'.join(f'{p:g}' for p in self.params)}"
+
+
+class MockWAF:
+    """Stand-in WAF; start() serves it on the running event loop."""
+
+    def __init__(self, latency: LatencyDistribution, block_ratio: float = 0.9, fp_ratio: float = 0.01,
+                 block_style: str = "status", reset_ratio: float = 0.0, slow_ratio: float = 0.0,
+                 slow_ms: float = 200.0, body_bytes: int = 2048, seed: int = 1):
+        self.latency = latency
+        self.block_ratio = block_ratio
+        self.fp_ratio = fp_ratio
+        self.block_style = block_style
+        self.reset_ratio = reset_ratio
+        self.slow_ratio = slow_ratio
+        self.slow_ms = slow_ms
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.page = (b"<html><body>" + b"x" * max(0, body_bytes - 26) + b"</body></html>")[:max(body_bytes, 0)]
+        self.requests = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        server = await asyncio.start_server(self._serve, host, port, backlog=4096, limit=1 << 20)
+        return f"http://{host}:{server.sockets[0].getsockname()[1]}"
+
+    def _draw(self, target: bytes, salt: int) -> float:
+        """Uniform [0, 1) fixed by target, seed and salt."""
+        return zlib.crc32(target, (self.seed * 7919 + salt) & 0xFFFFFFFF) / 2 ** 32
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.split(b"\r\n")
+                method, target = (lines[0].split(b" ") + [b"", b""])[:2]
+                length, chunked, close = 0, False, False
+                for line in lines[1:]:
+                    name, _, value = line.partition(b":")
+                    name = name.strip().lower()
+                    if name == b"content-length":
+                        length = int(value)
+                    elif name == b"transfer-encoding":
+                        chunked = b"chunked" in value.lower()
+                    elif name == b"connection":
+                        close = value.strip().lower() == b"close"
+                if chunked:
+                    while True:
+                        size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+                        await reader.readexactly(size + 2)
+                        if size == 0:
+                            break
+                elif length:
+                    await reader.readexactly(length)
+                self.requests += 1
+                if not await self._respond(writer, method, target, close) or close:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, method: bytes, target: bytes, close: bool) -> bool:
+        """Answer one request; False when the connection was reset instead."""
+        delay = self.latency.sample(self.rng)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        probe = target.lower().startswith(HEALTH_PROBES)
+        if not probe and self._draw(target, 1) < self.reset_ratio:
+            writer.transport.abort()
+            return False
+        ratio = self.block_ratio if ATTACK_MARKER.encode() in target else self.fp_ratio
+        status, body = 200, self.page
+        if target == b"/" or probe:
+            # The runner's health and functionality checks always pass
+            ratio = 1.0 if probe else 0.0
+        if self._draw(target, 2) < ratio:
+            style = self.block_style
+            if style == "mixed":
+                style = "page" if self._draw(target, 3) < 0.5 else "status"
+            status, body = (200, BLOCK_PAGE) if style == "page" else (403, BLOCK_PAGE)
+        if method == b"HEAD":
+            body = b""
+        writer.write(b"HTTP/1.1 %d %s\r\nContent-Type: text/html\r\nContent-Length: %d\r\n%s\r\n" % (
+            status, b"OK" if status == 200 else b"Forbidden", len(body), b"Connection: close\r\n" if close else b""))
+        if body and self._draw(target, 4) < self.slow_ratio:
+            # Slow body: four parts spread over slow_ms
+            step = len(body) // 4 + 1
+            for i in range(0, len(body), step):
+                writer.write(body[i:i + step])
+                await writer.drain()
+                await asyncio.sleep(self.slow_ms / 4000)
+        else:
+            writer.write(body)
+        await writer.drain()
+        return True
+
+
+def write_corpus(data_dir: Path, payloads: int, seed: int) -> dict:
+    """Synthetic Legitimate and Malicious test files (half each); returns {DataSetType: count}."""
+    rng = random.Random(seed)
+    sets = {
+        "Legitimate": ("browsing_shop", "browsing_news", "browsing_upload"),
+        "Malicious": ("sqli", "xss", "traversal", "cmdexe"),
+    }
+    attacks = {
+        "sqli": "1' OR '1'='1' -- ",
+        "xss": "<script>alert(document.cookie)</script>",
+        "traversal": "../../../../etc/passwd",
+        "cmdexe": ";cat /etc/passwd",
+    }
+    counts = {}
+    for dataset, names in sets.items():
+        per_file = max(1, payloads // 2 // len(names))
+        for name in names:
+            items = []
+            for i in range(per_file):
+                value = attacks.get(name, f"item{rng.randrange(10 ** 6)}")
+                marker = f"&{ATTACK_MARKER}=1" if dataset == "Malicious" else ""
+                method = rng.choice(("GET", "GET", "POST"))
+                items.append({
+                    "method": method,
+                    "url": f"/{name}/{i}?q={value}{marker}",
+                    "headers": {"User-Agent": "Mozilla/5.0 (bench)", "Accept": "text/html", "Connection": "keep-alive"},
+                    "data": f"field={value}&n={i}" if method == "POST" else None,
+                })
+            path = data_dir / dataset / f"{name}.json"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+            counts[dataset] = counts.get(dataset, 0) + per_file
+    return counts
+
+
+def mock_args(args) -> list[str]:
+    return ["--latency", args.latency, "--block-ratio", str(args.block_ratio), "--fp-ratio", str(args.fp_ratio),
+            "--block-style", args.block_style, "--reset-ratio", str(args.reset_ratio),
+            "--slow-ratio", str(args.slow_ratio), "--slow-ms", str(args.slow_ms),
+            "--body-bytes", str(args.body_bytes), "--seed", str(args.seed)]
+
+
+def serve(args):
+    """--serve: run one mock WAF until killed; prints its URL first."""
+    async def main():
+        waf = MockWAF(LatencyDistribution.parse(args.latency), args.block_ratio, args.fp_ratio, args.block_style,
+                      args.reset_ratio, args.slow_ratio, args.slow_ms, args.body_bytes, args.seed)
+        print(await waf.start(port=args.serve), flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_child(config_path: str):
+    """--child: the measured runner process (HOME and cwd are the bench directory)."""
+    config = json.loads(Path(config_path).read_text())
+    sys.path.insert(0, str(HERE))
+    import runner
+
+    wafs = runner.Wafs(config["wafs"])
+    backlog_peak = 0
+    done = threading.Event()
+
+    def watch_backlog():
+        nonlocal backlog_peak
+        while not done.wait(0.05):
+            backlog_peak = max(backlog_peak, wafs.metrics.snapshot().get(("runner_writer_backlog", ()), 0))
+
+    watcher = threading.Thread(target=watch_backlog, daemon=True)
+    watcher.start()
+    started = time.perf_counter()
+    asyncio.run(wafs.send_payloads_async(workers=config["workers"]))
+    wall = time.perf_counter() - started
+    done.set()
+    watcher.join()
+
+    totals = wafs.metrics.totals()
+
+    def total(name):
+        return sum(v for (n, _), v in totals.items() if n == name)
+
+    rows = total("runner_rows_committed_total")
+    result = {
+        "requests": int(rows),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(rows / wall, 1) if wall else 0.0,
+        "failed": int(total("waf_failures_total")),
+        "blocked": int(total("waf_blocked_total")),
+        "writer_backlog_peak": int(backlog_peak),
+        "commits": int(total("runner_commits_total")),
+        "commit_p99_ms": round(total("runner_commit_p99_seconds") * 1000, 2),
+    }
+    try:
+        import resource
+    except ImportError:         # not on Windows
+        resource = None
+    if resource:
+        own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+        result["cpu_s"] = round(cpu, 3)
+        result["cpu_us_per_request"] = round(cpu / rows * 1e6, 1) if rows else None
+        # ru_maxrss is in KiB on Linux; with workers the largest process counts
+        result["peak_rss_mb"] = round(max(own.ru_maxrss, children.ru_maxrss) / 1024, 1)
+    Path(config["result"]).write_text(json.dumps(result))
+
+
+def git_version() -> str | None:
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], cwd=HERE, capture_output=True, text=True,
+                             timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(previous: dict, current: dict, tolerance: float) -> list[str]:
+    """Lines comparing two saved results; regressions are marked."""
+    lines = [f"  vs {previous.get('version') or '?'} ({previous['time']}):"]
+    regressions = 0
+    for key, label, higher_better in RESULT_FIELDS:
+        old, new = previous["results"].get(key), current["results"].get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        worse = -change if higher_better else change
+        flag = ""
+        if worse > tolerance and abs(new - old) > 1e-9:
+            flag = "  REGRESSION"
+            regressions += 1
+        lines.append(f"    {label:<20} {old:>12g} -> {new:<12g} {change:+6.1f}%{flag}")
+    return lines if regressions or len(lines) > 1 else []
+
+
+def benchmark(args) -> int:
+    bench_dir = Path(tempfile.mkdtemp(prefix="waf-bench-"))
+    servers = []
+    try:
+        counts = write_corpus(bench_dir / "Data", args.payloads, args.seed)
+        wafs = {}
+        for i in range(args.wafs):
+            p = subprocess.Popen([sys.executable, str(HERE / "bench.py"), "--serve", "0", *mock_args(args)],
+                                 stdout=subprocess.PIPE, text=True)
+            servers.append(p)
+            wafs[f"Mock WAF {i + 1}"] = p.stdout.readline().strip()
+        config_path = bench_dir / "bench.json"
+        config_path.write_text(json.dumps({"wafs": wafs, "workers": args.workers,
+                                           "result": str(bench_dir / "result.json")}))
+        env = dict(os.environ, HOME=str(bench_dir), PYTHONIOENCODING="utf-8")
+        env.pop("PROFILE_OUTPUT", None)
+        env.setdefault("CLIENT_CALIBRATION", "off")     # the same clients in every benchmark unless asked
+        print(f"Benchmark: {sum(counts.values())} payloads x {args.wafs} mock WAFs, {args.workers} worker(s), "
+              f"latency {LatencyDistribution.parse(args.latency)} ms (runner log: {bench_dir / 'runner.log'})")
+        with open(bench_dir / "runner.log", "w", encoding="utf-8") as runner_log:
+            child = subprocess.run([sys.executable, str(HERE / "bench.py"), "--child", str(config_path)],
+                                   cwd=bench_dir, env=env, stdout=runner_log, stderr=subprocess.STDOUT)
+        if child.returncode != 0:
+            print(f"Runner failed (exit {child.returncode}); see {bench_dir / 'runner.log'}")
+            args.keep = True
+            return child.returncode
+        results = json.loads((bench_dir / "result.json").read_text())
+    finally:
+        for p in servers:
+            p.terminate()
+            p.wait()
+        if not args.keep:
+            shutil.rmtree(bench_dir, ignore_errors=True)
+
+    entry = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "version": git_version(),
+        "label": args.label,
+        "setup": {
+            "payloads": sum(counts.values()), "wafs": args.wafs, "workers": args.workers,
+            "mock": {k.lstrip("-"): v for k, v in zip(mock_args(args)[::2], mock_args(args)[1::2])},
+            "env": {k: os.environ[k] for k in TUNABLES if k in os.environ},
+        },
+        "results": results,
+    }
+    for key, label, _ in RESULT_FIELDS + (("requests", "requests", True), ("failed", "failed", False),
+                                          ("blocked", "blocked", True), ("wall_s", "wall s", False)):
+        if results.get(key) is not None:
+            print(f"  {label:<20} {results[key]:>12g}")
+
+    save = Path(args.save).expanduser()
+    save.parent.mkdir(parents=True, exist_ok=True)
+    previous = None
+    if save.exists():
+        for line in save.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                saved = json.loads(line)
+                if saved.get("setup") == entry["setup"]:
+                    previous = saved
+    regressions = []
+    if previous:
+        regressions = compare(previous, entry, args.tolerance)
+        for line in regressions or [f"  same as {previous.get('version') or '?'} within {args.tolerance:g}%"]:
+            print(line)
+    with open(save, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+    print(f"Saved to {save}")
+    return 1 if args.strict and any("REGRESSION" in line for line in regressions) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runner throughput benchmark against local mock WAFs")
+    parser.add_argument("--payloads", type=int, default=20000, help="synthetic corpus size (half malicious)")
+    parser.add_argument("--wafs", type=int, default=2, help="number of mock WAFs")
+    parser.add_argument("--workers", type=int, default=1, help="runner worker processes (as runner.py --workers)")
+    parser.add_argument("--latency", default="exp:5", help="mock response latency in ms (see module doc)")
+    parser.add_argument("--block-ratio", type=float, default=0.9, help="share of malicious requests blocked")
+    parser.add_argument("--fp-ratio", type=float, default=0.01, help="share of legitimate requests blocked")
+    parser.add_argument("--block-style", choices=("status", "page", "mixed"), default="status",
+                        help="403, block page with 200, or half each")
+    parser.add_argument("--reset-ratio", type=float, default=0.0, help="share of requests answered by a reset")
+    parser.add_argument("--slow-ratio", type=float, default=0.0, help="share of responses with a slow body")
+    parser.add_argument("--slow-ms", type=float, default=200.0, help="time to send a slow body")
+    parser.add_argument("--body-bytes", type=int, default=2048, help="size of the normal page")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", default=str(DEFAULT_SAVE), help="results history file (default: %(default)s)")
+    parser.add_argument("--label", default="", help="free text saved with the result")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="percent change flagged as a regression")
+    parser.add_argument("--strict", action="store_true", help="exit with status 1 on a regression")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary bench directory")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="only serve one mock WAF on PORT (0 = any)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+    elif args.serve is not None:
+        serve(args)
+    else:
+        LatencyDistribution.parse(args.latency)   # fail early on a bad spec
+        sys.exit(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
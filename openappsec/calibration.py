@@ -0,0 +1,288 @@
+# calibration.py
+"""
+Per-WAF client tuning: protocol, pool size and client shards.
+
+Each WAF gets the httpx setup of its ClientProfile: HTTP/2 or HTTP/1.1, a pool
+of max_connections, split over `clients` AsyncClients that the run's requests
+take turns on (several clients per host avoid contention on one pool's lock).
+Profiles are written like "h2:1000x1" (protocol, pool size, clients), and
+the pool size and client count are optional ("h1", "h2:500").
+
+Calibration loads the WAF hosts, so it is opt-in. Without it every WAF gets
+CLIENT_PROFILE, over HTTP/1.1 for WAFs named in HTTP1_WAFS (BunkerWeb
+stalls on HTTP/2 under load). With CLIENT_CALIBRATION=auto every WAF host
+without a cached profile is calibrated once before its first run: each
+candidate of CALIBRATION_PROTOCOLS x CALIBRATION_POOLS x CALIBRATION_CLIENTS
+sends GETs of the WAF's page at CALIBRATION_CONCURRENCY (default:
+ASYNC_CONCURRENCY, at most 256) for CALIBRATION_SECONDS. A candidate is
+stable when at most CALIBRATION_MAX_ERRORS of its requests fail or stall.
+HTTP/2 candidates are dropped when the host does not negotiate HTTP/2. Among
+the stable ones within NEAR_BEST of the best throughput, the one with the
+fewest connections and clients wins, so noise does not pick a bigger setup.
+The choice is cached per host (scheme://host:port) in CALIBRATION_PATH and
+reused while the calibration concurrency is unchanged.
+
+    CLIENT_CALIBRATION=off       no calibration (default)
+    CLIENT_CALIBRATION=auto      calibrate hosts without a cached profile
+    CLIENT_CALIBRATION=force     recalibrate every host
+    CLIENT_PROFILE=h2:1000x1     profile of WAFs not calibrated (default; h1 for HTTP1_WAFS)
+    CLIENT_PROFILE_BY_WAF="BunkerWeb WAF=h1;AAP WAF=h2:500x2"
+                                 manual choices, never calibrated or cached
+
+    python calibration.py URL [CONCURRENCY]    # calibrate one URL, print the table
+"""
+import asyncio
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import CALIBRATION_PATH
+from helper import log
+from histogram import LatencyHistogram
+
+# Stable candidates this close to the best throughput count as equally fast
+NEAR_BEST = 0.97
+# A request still unanswered when a candidate's window ends has stalled after
+# STALL_SECONDS and STALL_FACTOR times the p99 latency (queueing for the pool is not a stall)
+STALL_SECONDS = 1.0
+STALL_FACTOR = 2
+# WAFs whose name contains one of these use HTTP/1.1 unless calibrated or set in CLIENT_PROFILE_BY_WAF
+HTTP1_WAFS = ("BunkerWeb",)
+
+
+class ClientProfile(NamedTuple):
+    http2: bool = True
+    max_connections: int = 1000
+    clients: int = 1
+
+    @classmethod
+    def parse(cls, spec: str) -> "ClientProfile":
+        """"h1" / "h2", then optionally ":POOL" and "xCLIENTS"."""
+        spec = spec.strip().lower()
+        try:
+            protocol, _, rest = spec.partition(":")
+            if protocol not in ("h1", "h2"):
+                raise ValueError
+            pool, _, clients = rest.partition("x")
+            return cls(protocol == "h2", int(pool) if pool else cls._field_defaults["max_connections"],
+                       max(1, int(clients)) if clients else 1)
+        except ValueError:
+            raise ValueError(f"Bad client profile {spec!r}; use h1 or h2, then optionally :POOL and xCLIENTS")
+
+    def scaled(self, share: int) -> "ClientProfile":
+        """A worker's share of the pool (--workers)."""
+        return self._replace(max_connections=max(self.clients, -(-self.max_connections // share)))
+
+    def make_clients(self, timeout: httpx.Timeout) -> list:
+        """The AsyncClients of this profile; the pool is split between them."""
+        pool = max(1, -(-self.max_connections // self.clients))
+        limits = httpx.Limits(max_keepalive_connections=pool, max_connections=pool)
+        return [httpx.AsyncClient(http2=self.http2, limits=limits, timeout=timeout) for _ in range(self.clients)]
+
+    def __str__(self):
+        return f"{'h2' if self.http2 else 'h1'}:{self.max_connections}x{self.clients}"
+
+
+class Calibration:
+    """Candidate grid and limits of a calibration, from the environment."""
+
+    def __init__(self, concurrency: int):
+        """concurrency: the run's per-WAF ceiling; calibration runs at up to 256 of it by default."""
+        self.mode = os.getenv("CLIENT_CALIBRATION", "off").strip().lower()
+        if self.mode not in ("auto", "force", "off"):
+            raise ValueError(f"CLIENT_CALIBRATION must be auto, force or off, not {self.mode!r}")
+        self.default = ClientProfile.parse(os.getenv("CLIENT_PROFILE", "h2:1000x1"))
+        self.protocols = [p.strip().lower() for p in os.getenv("CALIBRATION_PROTOCOLS", "h1,h2").split(",") if p.strip()]
+        self.concurrency = int(os.getenv("CALIBRATION_CONCURRENCY", str(min(concurrency, 256))))
+        # Pools larger than the concurrency behave alike: capped to it
+        self.pools = sorted({min(int(p), self.concurrency)
+                             for p in os.getenv("CALIBRATION_POOLS", "32,128,1000").split(",") if p.strip()})
+        self.clients = [int(c) for c in os.getenv("CALIBRATION_CLIENTS", "1,2,4").split(",") if c.strip()]
+        self.seconds = float(os.getenv("CALIBRATION_SECONDS", "2.0"))
+        self.max_errors = float(os.getenv("CALIBRATION_MAX_ERRORS", "0.01"))
+
+    def fallback(self, name: str) -> ClientProfile:
+        """Profile of a WAF that is not calibrated: CLIENT_PROFILE, over HTTP/1.1 for HTTP1_WAFS."""
+        if any(part in name for part in HTTP1_WAFS):
+            return self.default._replace(http2=False)
+        return self.default
+
+    def candidates(self) -> list:
+        return [ClientProfile.parse(f"{protocol}:{pool}x{clients}")
+                for protocol in self.protocols for pool in self.pools for clients in self.clients if clients <= pool]
+
+
+def host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def profile_overrides(wafs: dict, spec: str) -> dict:
+    """{WAF name: ClientProfile} of CLIENT_PROFILE_BY_WAF."""
+    overrides = {}
+    for part in spec.split(";"):
+        if "=" in part:
+            name, profile = part.split("=", 1)
+            overrides[name.strip()] = ClientProfile.parse(profile)
+    unknown = set(overrides) - set(wafs)
+    if unknown:
+        raise ValueError(f"CLIENT_PROFILE_BY_WAF names unknown WAFs: {sorted(unknown)}")
+    return overrides
+
+
+def load_cache(path=CALIBRATION_PATH) -> dict:
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable calibration cache {path}: {e}")
+        return {}
+
+
+def save_cache(cache: dict, path=CALIBRATION_PATH):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(json.dumps(cache, indent=2, sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+async def measure(url: str, profile: ClientProfile, concurrency: int, seconds: float, timeout: httpx.Timeout) -> dict:
+    """
+    Closed-loop GETs of url over `profile`: requests answered within `seconds`
+    after a short warm-up; requests in flight at the end are cancelled.
+    """
+    clients = profile.make_clients(timeout)
+    hist = LatencyHistogram()
+    counts = {"ok": 0, "errors": 0}
+    protocols = set()
+    perf = time.perf_counter
+    warm_until = perf() + min(0.5, seconds / 4)
+    stop_at = warm_until + seconds
+
+    started = {}    # loop -> start of its request in flight
+
+    async def loop(i):
+        client = clients[i % len(clients)]
+        while True:
+            t = started[i] = perf()
+            try:
+                r = await client.get(url)
+                protocols.add(r.http_version)
+                if t >= warm_until:
+                    counts["ok"] += 1
+                    hist.record(int((perf() - t) * 1e6))
+            except httpx.HTTPError:
+                if t >= warm_until:
+                    counts["errors"] += 1
+
+    tasks = [asyncio.create_task(loop(i)) for i in range(concurrency)]
+    try:
+        await asyncio.sleep(stop_at - perf())
+        stall = max(STALL_SECONDS, STALL_FACTOR * (hist.percentile(99) or 0) / 1e6)
+        counts["errors"] += sum(1 for t in started.values() if warm_until <= t < stop_at - stall)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+    total = counts["ok"] + counts["errors"]
+    return {
+        "profile": str(profile),
+        "rps": round(counts["ok"] / seconds, 1),
+        "errors": round(counts["errors"] / total, 4) if total else 1.0,
+        "p99_ms": round((hist.percentile(99) or 0) / 1000, 2),
+        "protocols": sorted(protocols),
+    }
+
+
+async def calibrate(name: str, url: str, settings: Calibration, timeout: httpx.Timeout) -> Optional[dict]:
+    """Measure every candidate against one WAF; the cache entry of the winner, or None when none is stable."""
+    results = []
+    h2_offered = None
+    for profile in settings.candidates():
+        if profile.http2 and h2_offered is False:
+            continue
+        result = await measure(url, profile, settings.concurrency, settings.seconds, timeout)
+        if profile.http2 and h2_offered is None and result["protocols"]:
+            h2_offered = "HTTP/2" in result["protocols"]
+            if not h2_offered:
+                log.info(f"Calibration of {name}: {host_key(url)} does not negotiate HTTP/2; HTTP/1.1 only")
+                continue
+        result["stable"] = result["errors"] <= settings.max_errors
+        results.append(result)
+        log.info(f"Calibration of {name}: {result['profile']:<12} {result['rps']:9.1f} req/s  "
+                 f"p99 {result['p99_ms']:8.2f} ms  errors {result['errors']:.2%}")
+
+    stable = [r for r in results if r["stable"] and r["rps"] > 0]
+    if not stable:
+        log.warning(f"Calibration of {name}: no stable candidate, not cached; "
+                    f"set CLIENT_PROFILE_BY_WAF or lower CALIBRATION_CONCURRENCY")
+        return None
+    best = max(r["rps"] for r in stable)
+    near = [r for r in stable if r["rps"] >= best * NEAR_BEST]
+    chosen = min(near, key=lambda r: (ClientProfile.parse(r["profile"]).max_connections,
+                                      ClientProfile.parse(r["profile"]).clients, -r["rps"]))
+    return {
+        "profile": chosen["profile"],
+        "rps": chosen["rps"],
+        "concurrency": settings.concurrency,
+        "calibrated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "candidates": results,
+    }
+
+
+async def resolve_profiles(wafs: dict, settings: Calibration, overrides: dict, timeout: httpx.Timeout) -> dict:
+    """
+    {url: ClientProfile} of every WAF: a manual override, the cached or newly
+    calibrated profile of its host, or the fallback.
+    """
+    profiles = {}
+    cache = load_cache() if settings.mode != "off" else {}
+    changed = False
+    for name, url in wafs.items():
+        if name in overrides:
+            profiles[url] = overrides[name]
+            source = "CLIENT_PROFILE_BY_WAF"
+        elif settings.mode == "off":
+            profiles[url] = settings.fallback(name)
+            source = "CLIENT_PROFILE"
+        else:
+            key = host_key(url)
+            entry = cache.get(key)
+            if entry and settings.mode == "auto" and entry.get("concurrency") != settings.concurrency:
+                log.info(f"Calibration of {name} ran at concurrency {entry.get('concurrency')}, "
+                         f"now {settings.concurrency}: recalibrating")
+                entry = None
+            if entry is None or settings.mode == "force":
+                log.info(f"Calibrating clients of {name} ({len(settings.candidates())} candidates, "
+                         f"{settings.seconds:g}s each at concurrency {settings.concurrency})")
+                entry = await calibrate(name, url, settings, timeout)
+                if entry is not None:
+                    cache[key] = entry
+                    changed = True
+                source = "calibrated"
+            else:
+                source = f"cached {entry['calibrated_at']}"
+            profiles[url] = ClientProfile.parse(entry["profile"]) if entry else settings.fallback(name)
+            if entry is None:
+                source = "CLIENT_PROFILE"
+        log.info(f"Clients of {name}: {profiles[url]} ({source})")
+    if changed:
+        save_cache(cache)
+        log.info(f"Saved client calibration to {CALIBRATION_PATH}")
+    return profiles
+
+
+if __name__ == "__main__":
+    import sys
+    args = sys.argv[1:]
+    if not args:
+        sys.exit(__doc__)
+    entry = asyncio.run(calibrate(args[0], args[0], Calibration(int(args[1]) if len(args) > 1 else 100),
+                                  httpx.Timeout(6.0, connect=4.0)))
+    print(f"chosen: {entry['profile']}" if entry else "no stable candidate")
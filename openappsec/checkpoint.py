@@ -0,0 +1,74 @@
+# checkpoint.py
+"""
+Completion bitmaps for resuming an interrupted run (`runner.py --resume`).
+
+Every result row the writer thread commits is a checkpoint: its (payload, WAF)
+pair is done. On resume the committed results of the run are folded into one
+bitmap per (test, WAF), indexed by the payload's position in its test file.
+That is one bit per request (about 1.2 MB for 10M requests), it pickles
+cheaply to worker processes, and the sender can skip a finished pair, or a
+whole finished range, without asking the DB.
+"""
+from config import DB_PATH
+from storage import connect
+
+
+class CompletedPairs:
+    """Set of (test, waf_id, item_index) triples, stored as bitmaps."""
+
+    def __init__(self):
+        self._bits = {}     # (DataSetType, TestName, waf_id) -> bytearray
+        self.total = 0
+
+    def add(self, test: tuple, waf_id: int, index: int):
+        bits = self._bits.get((*test, waf_id))
+        if bits is None:
+            bits = self._bits[(*test, waf_id)] = bytearray()
+        byte, mask = index >> 3, 1 << (index & 7)
+        if byte >= len(bits):
+            bits.extend(bytes(byte + 1 - len(bits)))
+        if not bits[byte] & mask:
+            bits[byte] |= mask
+            self.total += 1
+
+    def done(self, test: tuple, waf_id: int, index: int) -> bool:
+        bits = self._bits.get((*test, waf_id))
+        byte = index >> 3
+        return bits is not None and byte < len(bits) and bool(bits[byte] & (1 << (index & 7)))
+
+    def range_done(self, test: tuple, waf_id: int, start: int, stop: int) -> bool:
+        """True when every index in [start, stop) is done."""
+        bits = self._bits.get((*test, waf_id))
+        if bits is None or (stop + 7) >> 3 > len(bits):
+            return False
+        i = start
+        while i < stop and i & 7:
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+            i += 1
+        full_end = stop & ~7
+        if i < full_end and bits[i >> 3:full_end >> 3].count(0xFF) != (full_end - i) >> 3:
+            return False
+        i = max(i, full_end)
+        while i < stop:
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+            i += 1
+        return True
+
+    @classmethod
+    def load(cls, run_id: int, db_path=DB_PATH) -> "CompletedPairs":
+        """Completed pairs of a run, from the results committed so far."""
+        completed = cls()
+        c = connect(db_path)
+        try:
+            rows = c.execute("""
+                SELECT p.DataSetType, p.TestName, p.item_index, r.waf_id
+                FROM results r JOIN payloads p ON p.payload_id = r.payload_id
+                WHERE r.run_id = ?
+            """, (run_id,))
+            for dataset_type, test_name, index, waf_id in rows:
+                completed.add((dataset_type, test_name), waf_id, index)
+        finally:
+            c.close()
+        return completed
@@ -1,33 +1,49 @@
-import sqlite3
-from pathlib import Path
-
-# Database configuration
-DB_PATH = Path.home() / "waf_compare" / "waf_comparison.db"
-DB_PATH.parent.mkdir(parents=True, exist_ok=True)  # Ensure ~/waf_compare exists
-print(f"Using DB at: {DB_PATH}")  # Debug print
-
-# Open SQLite connection (with safer options for WSL/Linux)
-conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
-try:
-    # On WSL, WAL often causes issues; force DELETE journal mode
-    conn.execute("PRAGMA journal_mode=DELETE;")
-    conn.execute("PRAGMA synchronous=NORMAL;")
-    conn.execute("PRAGMA temp_store=MEMORY;")
-    conn.execute("PRAGMA busy_timeout=30000;")
-except Exception:
-    pass
-
-# Data set URLs
-LEGITIMATE_URL_PATH = "https://downloads.openappsec.io/waf-comparison-project/legitimate.zip"
-MALICIOUS_URL_PATH  = "https://downloads.openappsec.io/waf-comparison-project/malicious.zip"
-
-# Data set Paths
-DATA_PATH = Path("Data")
-LEGITIMATE_PATH = DATA_PATH / "Legitimate"
-MALICIOUS_PATH  = DATA_PATH / "Malicious"
-
-# WAF configuration (edit to your hosts)
-WAFS_DICT = {
-    "AAP WAF":      "https://",
-    "BunkerWeb WAF": "https://",
-}
+import sqlite3
+from pathlib import Path
+
+# Database configuration
+DB_PATH = Path.home() / "waf_compare" / "waf_comparison.db"
+DB_PATH.parent.mkdir(parents=True, exist_ok=True)  # Ensure ~/waf_compare exists
+print(f"Using DB at: {DB_PATH}")  # Debug print
+
+# Per-host client calibration (protocol, pool size, client shards; see calibration.py)
+CALIBRATION_PATH = DB_PATH.parent / "client_calibration.json"
+
+# Open SQLite connection (with safer options for WSL/Linux)
+conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30)
+try:
+    # On WSL, WAL often causes issues; force DELETE journal mode
+    conn.execute("PRAGMA journal_mode=DELETE;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute("PRAGMA busy_timeout=30000;")
+except Exception:
+    pass
+
+# Data set URLs
+LEGITIMATE_URL_PATH = "https://downloads.openappsec.io/waf-comparison-project/legitimate.zip"
+MALICIOUS_URL_PATH  = "https://downloads.openappsec.io/waf-comparison-project/malicious.zip"
+
+# Data set Paths
+DATA_PATH = Path("Data")
+LEGITIMATE_PATH = DATA_PATH / "Legitimate"
+MALICIOUS_PATH  = DATA_PATH / "Malicious"
+
+# Downloaded archives (kept as-is when streaming with DATA_FROM_ZIP=true)
+LEGITIMATE_ZIP_PATH = DATA_PATH / LEGITIMATE_URL_PATH.split("/")[-1]
+MALICIOUS_ZIP_PATH  = DATA_PATH / MALICIOUS_URL_PATH.split("/")[-1]
+
+# Payload manifest (per-file counts and item offsets), rebuilt only for changed files
+MANIFEST_PATH = DATA_PATH / "manifest.idx"
+
+# Compiled binary corpus (see corpus.py); used by the runner when it matches the manifest
+CORPUS_PATH = DATA_PATH / "corpus.bin"
+
+# Site category of every Legitimate test file (stratifies smoke samples, see sampling.py)
+CATEGORIES_PATH = Path("Legitimate Data Set categories.csv")
+
+# WAF configuration (edit to your hosts)
+WAFS_DICT = {
+    "AAP WAF":      "https://",
+    "BunkerWeb WAF": "https://",
+}
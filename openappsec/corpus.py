@@ -0,0 +1,271 @@
+# corpus.py
+"""
+Compiled binary payload corpus.
+
+`compile_corpus` turns the JSON test files under Data/ into one flat file that
+the runner memory-maps. Every payload is a length-prefixed record:
+
+    u8 body_kind | u16 method_len | u32 url_len | u16 n_headers | u32 body_len
+    method | url | n_headers * (u16 name_len | u32 value_len | name | value) | body
+
+body_kind is 0 for no body, 1 for a text body and 2 for any other JSON value
+(form dicts etc.), which is kept as JSON text. A file table at the end holds,
+per test file, its manifest key, the size/mtime it was compiled from and an
+array of u64 record offsets.
+
+Records are read as slices of the mapping, so there is no JSON decoding in the
+send loop and several runner processes share one page-cached copy.
+"""
+import json
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Iterator, Optional
+
+from config import CORPUS_PATH, DATA_PATH
+from helper import log
+from manifest import refresh_manifest, manifest_key, iter_payloads_at
+
+MAGIC = b"WAFCORP1"
+HEADER = struct.Struct("<8sIQ")        # magic, file_count, table_offset
+RECORD = struct.Struct("<BHIHI")       # body_kind, method_len, url_len, n_headers, body_len
+HEADER_FIELD = struct.Struct("<HI")    # name_len, value_len
+FILE_ENTRY = struct.Struct("<HQQI")    # key_len, size, mtime_ns, count
+
+BODY_NONE, BODY_TEXT, BODY_JSON = 0, 1, 2
+
+
+def normalize_headers(headers) -> dict:
+    """
+    Header names and values as str, the form the corpus stores them in. The
+    runner applies it to payloads of every source, so payload ids and the
+    stored header text do not depend on whether a payload came from the
+    corpus or straight from JSON.
+    """
+    return {str(k): v if isinstance(v, str) else str(v) for k, v in (headers or {}).items()}
+
+
+def _encode_record(payload: dict) -> bytes:
+    method = str(payload["method"]).encode("utf-8")
+    url = str(payload["url"]).encode("utf-8")
+    headers = normalize_headers(payload.get("headers"))
+    data = payload.get("data")
+
+    if data is None:
+        kind, body = BODY_NONE, b""
+    elif isinstance(data, str):
+        kind, body = BODY_TEXT, data.encode("utf-8")
+    else:
+        kind, body = BODY_JSON, json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    parts = [RECORD.pack(kind, len(method), len(url), len(headers), len(body)), method, url]
+    for k, v in headers.items():
+        kb = k.encode("utf-8")
+        vb = v.encode("utf-8")
+        parts.append(HEADER_FIELD.pack(len(kb), len(vb)))
+        parts.append(kb)
+        parts.append(vb)
+    parts.append(body)
+    return b"".join(parts)
+
+
+def _pad8(n: int) -> bytes:
+    return b"\0" * (-n % 8)
+
+
+def compile_corpus(test_files, manifest: dict, out_path: Path = CORPUS_PATH) -> int:
+    """
+    Write every payload of test_files into out_path (atomically).
+    Returns the number of records written.
+    """
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    table = []
+    total = 0
+
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        pos = HEADER.size
+        for path in test_files:
+            key = manifest_key(path)
+            entry = manifest.get(key)
+            if not entry or "error" in entry:
+                log.warning(f"Not compiling {path}: not a readable JSON array")
+                continue
+            offsets = []
+            for payload in iter_payloads_at(path, entry["offsets"]):
+                rec = _encode_record(payload)
+                offsets.append(pos)
+                f.write(rec)
+                pos += len(rec)
+            table.append((key, entry["size"], entry["mtime_ns"], offsets))
+            total += len(offsets)
+            log.debug(f"Compiled {key}: {len(offsets)} records")
+
+        pad = _pad8(pos)
+        f.write(pad)
+        table_offset = pos + len(pad)
+        for key, size, mtime_ns, offsets in table:
+            kb = key.encode("utf-8")
+            head = FILE_ENTRY.pack(len(kb), size, mtime_ns, len(offsets)) + kb
+            f.write(head + _pad8(len(head)))
+            f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(table), table_offset))
+
+    os.replace(tmp, out_path)
+    log.info(f"Compiled corpus: {total} payloads from {len(table)} files -> {out_path}")
+    return total
+
+
+class CorpusRecord:
+    """
+    One payload, backed by slices of the mapped corpus. Behaves like the
+    payload dicts the runner already consumes (`rec["url"]`, `rec.get("data")`).
+    """
+
+    __slots__ = ("_kind", "_method", "_url", "_headers", "_body")
+
+    def __init__(self, buf: memoryview, pos: int):
+        kind, m_len, u_len, n_headers, b_len = RECORD.unpack_from(buf, pos)
+        pos += RECORD.size
+        self._kind = kind
+        self._method = buf[pos:pos + m_len]
+        pos += m_len
+        self._url = buf[pos:pos + u_len]
+        pos += u_len
+        start = pos
+        for _ in range(n_headers):
+            k_len, v_len = HEADER_FIELD.unpack_from(buf, pos)
+            pos += HEADER_FIELD.size + k_len + v_len
+        self._headers = (buf[start:pos], n_headers)
+        self._body = buf[pos:pos + b_len]
+
+    @property
+    def method(self) -> str:
+        return str(self._method, "utf-8")
+
+    @property
+    def url(self) -> str:
+        return str(self._url, "utf-8")
+
+    @property
+    def headers(self) -> dict:
+        buf, n_headers = self._headers
+        out = {}
+        pos = 0
+        for _ in range(n_headers):
+            k_len, v_len = HEADER_FIELD.unpack_from(buf, pos)
+            pos += HEADER_FIELD.size
+            k = str(buf[pos:pos + k_len], "utf-8")
+            pos += k_len
+            out[k] = str(buf[pos:pos + v_len], "utf-8")
+            pos += v_len
+        return out
+
+    @property
+    def data(self):
+        if self._kind == BODY_NONE:
+            return None
+        if self._kind == BODY_TEXT:
+            return str(self._body, "utf-8")
+        return json.loads(str(self._body, "utf-8"))
+
+    @property
+    def body_bytes(self) -> memoryview:
+        """Raw body slice (no copy); JSON-kind bodies are returned as their JSON text."""
+        return self._body
+
+    def __getitem__(self, key):
+        if key in ("method", "url", "headers", "data"):
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class Corpus:
+    """Read-only, memory-mapped view of a compiled corpus file."""
+
+    def __init__(self, path: Path = CORPUS_PATH):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buf = memoryview(self._mm)
+
+        magic, file_count, table_offset = HEADER.unpack_from(self._buf, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path} is not a compiled corpus")
+
+        self.files = {}
+        pos = table_offset
+        for _ in range(file_count):
+            k_len, size, mtime_ns, count = FILE_ENTRY.unpack_from(self._buf, pos)
+            head = FILE_ENTRY.size + k_len
+            key = str(self._buf[pos + FILE_ENTRY.size:pos + head], "utf-8")
+            pos += head + (-head % 8)
+            offsets = self._buf[pos:pos + 8 * count].cast("Q")
+            pos += 8 * count
+            self.files[key] = {"size": size, "mtime_ns": mtime_ns, "count": count, "offsets": offsets}
+
+    def is_current(self, manifest: dict, keys) -> bool:
+        """True when every key is compiled from the same size/mtime the manifest has."""
+        for key in keys:
+            mine, theirs = self.files.get(key), manifest.get(key)
+            if not mine or not theirs:
+                return False
+            if mine["size"] != theirs["size"] or mine["mtime_ns"] != theirs["mtime_ns"]:
+                return False
+        return True
+
+    def iter_file(self, key: str, start: int = 0, stop: Optional[int] = None) -> Iterator[CorpusRecord]:
+        offsets = self.files[key]["offsets"]
+        stop = len(offsets) if stop is None else min(stop, len(offsets))
+        buf = self._buf
+        for i in range(start, stop):
+            yield CorpusRecord(buf, offsets[i])
+
+    def iter_items(self, key: str, indices) -> Iterator[CorpusRecord]:
+        offsets = self.files[key]["offsets"]
+        buf = self._buf
+        for i in indices:
+            yield CorpusRecord(buf, offsets[i])
+
+    def close(self):
+        # Records still alive keep slices of the map; in that case GC unmaps it later
+        try:
+            for entry in getattr(self, "files", {}).values():
+                entry["offsets"].release()
+            self._buf.release()
+            self._mm.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+
+def open_corpus(manifest: dict, keys, path: Path = CORPUS_PATH) -> Optional[Corpus]:
+    """Open the compiled corpus if it exists and matches the manifest, else None."""
+    if not path.exists():
+        return None
+    try:
+        corpus = Corpus(path)
+    except Exception as e:
+        log.warning(f"Cannot open compiled corpus {path}: {e}")
+        return None
+    if not corpus.is_current(manifest, keys):
+        log.warning(f"Compiled corpus {path} is stale; re-run `python corpus.py`. Reading JSON instead.")
+        corpus.close()
+        return None
+    return corpus
+
+
+if __name__ == "__main__":
+    files = sorted(DATA_PATH.rglob("*.json"))
+    compile_corpus(files, refresh_manifest(files))
@@ -0,0 +1,287 @@
+# distributed.py
+"""
+Multi-node runs: one coordinator hands out shards, agents send them.
+
+    python runner.py coordinator --listen 0.0.0.0:8765 --shards 32
+    python runner.py agent --coordinator http://HOST:8765 --name lg-1
+    python runner.py merge ~/waf_compare/results_*.db
+
+The coordinator plans the corpus exactly like a local run and splits it with
+shard_sources(). Agents must hold the same corpus (its version is checked),
+lease one shard at a time over HTTP, send it to the coordinator's WAFS_DICT
+and write a self-contained results file tagged with their machineName. Once
+every shard is done and every agent has closed its file, the coordinator
+merges the files it can read into DB_PATH; others can be merged with `merge`.
+
+Agents send a heartbeat every third of the lease timeout (--lease-timeout).
+An agent silent for longer is dropped: the shards it leased or completed go
+back to the queue (its unfinished file is never merged), and later calls of
+that agent are refused. Idle agents wait while others still hold leases, so
+returned shards find a taker. With --timeout the coordinator stops after that
+many seconds and merges the files of the agents that finished by then.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+from config import DB_PATH
+from helper import log
+from sources import plan_sources, shard_sources
+from storage import merge_results
+
+
+class Coordinator:
+    """Shard bookkeeping shared by the HTTP handler threads."""
+
+    def __init__(self, info: dict, shards: list, lease_seconds: float = 300.0):
+        self.info = info
+        self.shards = shards
+        self.lease_seconds = lease_seconds
+        self.pending = deque(range(len(shards)))
+        self.leased = {}            # shard_id -> agent
+        self.done = set()
+        # agent -> {"file": str | None, "finished": bool, "seen": monotonic time, "completed": [shard_id]}
+        self.agents = {}
+        self.dropped = set()
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def _touch(self, agent: str) -> bool:
+        """Note that agent is alive; False when it was dropped (caller holds the lock)."""
+        if agent in self.dropped:
+            return False
+        self.agents.setdefault(agent, {"file": None, "finished": False, "seen": 0.0, "completed": []})
+        self.agents[agent]["seen"] = time.monotonic()
+        return True
+
+    def lease(self, agent: str) -> dict:
+        with self.lock:
+            if not self._touch(agent):
+                return {"error": "dropped"}
+            if not self.pending:
+                # Shards of an agent that goes silent come back to the queue
+                return {"shard": None, "retry": min(5.0, self.lease_seconds / 3) if self.leased else None}
+            shard_id = self.pending.popleft()
+            self.leased[shard_id] = agent
+        log.info(f"Shard {shard_id} leased to {agent} ({len(self.pending)} left to lease)")
+        return {"shard": shard_id, "units": self.shards[shard_id]}
+
+    def heartbeat(self, agent: str) -> dict:
+        with self.lock:
+            if not self._touch(agent):
+                return {"error": "dropped"}
+        return {"ok": True}
+
+    def complete(self, agent: str, shard_id: int) -> dict:
+        with self.lock:
+            if not self._touch(agent):
+                return {"error": "dropped"}
+            if self.leased.get(shard_id) == agent:
+                del self.leased[shard_id]
+                self.done.add(shard_id)
+                self.agents[agent]["completed"].append(shard_id)
+            self._check_finished()
+        log.info(f"Shard {shard_id} completed by {agent} ({len(self.done)}/{len(self.shards)})")
+        return {"ok": True}
+
+    def finish(self, agent: str, results_file: str) -> dict:
+        with self.lock:
+            if not self._touch(agent):
+                return {"error": "dropped"}
+            self.agents[agent].update(file=results_file, finished=True)
+            self._check_finished()
+        log.info(f"Agent {agent} finished; results in {results_file}")
+        return {"ok": True}
+
+    def expire(self) -> list:
+        """
+        Drop the unfinished agents silent for lease_seconds and queue their
+        leased and completed shards again; returns the dropped agents.
+        """
+        now = time.monotonic()
+        with self.lock:
+            silent = [agent for agent, st in self.agents.items()
+                      if not st["finished"] and now - st["seen"] > self.lease_seconds]
+            for agent in silent:
+                st = self.agents.pop(agent)
+                self.dropped.add(agent)
+                shards = sorted([s for s, a in self.leased.items() if a == agent] + st["completed"])
+                for shard_id in shards:
+                    self.leased.pop(shard_id, None)
+                    self.done.discard(shard_id)
+                self.pending.extendleft(reversed(shards))
+                log.warning(f"Agent {agent} silent for {now - st['seen']:.0f}s: dropped, "
+                            f"shards {shards} back in the queue")
+            self._check_finished()
+        return silent
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "shards": len(self.shards),
+                "done": len(self.done),
+                "leased": {str(k): v for k, v in self.leased.items()},
+                "agents": dict(self.agents),
+                "dropped": sorted(self.dropped),
+            }
+
+    def _check_finished(self):
+        if len(self.done) == len(self.shards) and all(a["finished"] for a in self.agents.values()):
+            self.finished.set()
+
+
+def _make_handler(coord: Coordinator):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, obj, code=200):
+            body = json.dumps(obj).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/plan":
+                self._reply(coord.info)
+            elif self.path == "/status":
+                self._reply(coord.status())
+            else:
+                self._reply({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            req = json.loads(self.rfile.read(length) or b"{}")
+            if req.get("session") != coord.info["session"]:
+                self._reply({"error": "unknown session"}, 409)
+                return
+            if self.path == "/lease":
+                reply = coord.lease(req["agent"])
+            elif self.path == "/heartbeat":
+                reply = coord.heartbeat(req["agent"])
+            elif self.path == "/complete":
+                reply = coord.complete(req["agent"], int(req["shard"]))
+            elif self.path == "/finish":
+                reply = coord.finish(req["agent"], req["results_file"])
+            else:
+                self._reply({"error": "not found"}, 404)
+                return
+            self._reply(reply, 409 if "error" in reply else 200)
+
+        def log_message(self, fmt, *args):
+            log.debug("coordinator: " + fmt % args)
+
+    return Handler
+
+
+def run_coordinator(wafs: dict, listen: str = "127.0.0.1:8765", shards: int = 16,
+                    data_from_zip: bool = False, smoke=None, merge: bool = True,
+                    lease_seconds: float = 300.0, timeout: float = 0) -> list:
+    """
+    Serve a shard plan until every shard is done and all agents finished, or
+    for at most `timeout` seconds (0: no limit). Returns the results files of
+    the finished agents (merged into DB_PATH when merge is set).
+    """
+    plan = plan_sources(from_zip=data_from_zip, smoke=smoke)
+    try:
+        units = [s for s in shard_sources(plan.sources, shards) if s]
+        version = plan.version
+    finally:
+        plan.close()
+
+    info = {
+        "session": uuid.uuid4().hex,
+        "wafs": dict(wafs),
+        "corpus_version": version,
+        "data_from_zip": data_from_zip,
+        "smoke": smoke._asdict() if smoke else None,
+        "shards": len(units),
+        "lease_seconds": lease_seconds,
+    }
+    coord = Coordinator(info, units, lease_seconds)
+    host, port = listen.rsplit(":", 1)
+    server = ThreadingHTTPServer((host, int(port)), _make_handler(coord))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Coordinator listening on {listen}: {len(units)} shards, corpus {version}, WAFs {list(wafs)}")
+
+    deadline = time.monotonic() + timeout if timeout else None
+    try:
+        last = 0.0
+        while not coord.finished.wait(timeout=1):
+            coord.expire()
+            if deadline and time.monotonic() >= deadline:
+                st = coord.status()
+                log.warning(f"Coordinator timeout after {timeout:g}s: {st['done']}/{st['shards']} shards done; "
+                            f"merging the results of the agents that finished")
+                break
+            if time.time() - last >= 30:
+                st = coord.status()
+                log.info(f"Coordinator: {st['done']}/{st['shards']} shards done, leased={st['leased']}")
+                last = time.time()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with coord.lock:
+        files = [a["file"] for a in coord.agents.values() if a["finished"]]
+    if merge:
+        local = [f for f in files if Path(f).exists()]
+        for f in sorted(set(files) - set(local)):
+            log.warning(f"Results file {f} is not reachable from here; merge it with `runner.py merge`")
+        merged = merge_results(local, into=DB_PATH)
+        log.info(f"Merged {merged} results from {len(local)} agent files into {DB_PATH}")
+    return files
+
+
+# -------------------- Agent side (HTTP client) --------------------
+
+class CoordinatorClient:
+    def __init__(self, url: str, agent: str):
+        self.url = url.rstrip("/")
+        self.agent = agent
+        self.http = httpx.Client(timeout=30)
+        self.info = self._get("/plan")
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        """Keep this agent's leases alive while a shard runs; own client, own thread."""
+        with httpx.Client(timeout=30) as http:
+            while not self._stop.wait(self.info.get("lease_seconds", 300.0) / 3):
+                try:
+                    r = http.post(self.url + "/heartbeat", json={"session": self.info["session"], "agent": self.agent})
+                    if r.status_code == 409:
+                        log.error(f"Coordinator dropped agent {self.agent}: {r.json().get('error')}")
+                        return
+                except httpx.HTTPError as e:
+                    log.warning(f"Heartbeat to {self.url} failed: {e}")
+
+    def _get(self, path):
+        r = self.http.get(self.url + path)
+        r.raise_for_status()
+        return r.json()
+
+    def _post(self, path, **body):
+        body.update(session=self.info["session"], agent=self.agent)
+        r = self.http.post(self.url + path, json=body)
+        r.raise_for_status()
+        return r.json()
+
+    def lease(self) -> dict:
+        return self._post("/lease")
+
+    def complete(self, shard_id: int):
+        self._post("/complete", shard=shard_id)
+
+    def finish(self, results_file: str):
+        self._post("/finish", results_file=results_file)
+
+    def close(self):
+        self._stop.set()
+        self.http.close()
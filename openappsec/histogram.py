@@ -0,0 +1,102 @@
+# histogram.py
+"""
+Mergeable log-linear latency histogram (HDR-style).
+
+Values are non-negative integers (microseconds here). Values below 2**bits
+get a bucket of their own; above that, every power-of-two range is split into
+2**(bits-1) equal buckets, so each recorded value is known to within
+1 / 2**(bits-1) of itself (under 1% with the default bits=8) whatever its
+magnitude. Counts are kept sparsely per bucket index, so merging histograms
+from several runs, workers or shards is adding counts, and percentiles come
+out of the merged counts without revisiting any row.
+"""
+import json
+from typing import Iterable, Optional
+
+
+class LatencyHistogram:
+    """Sparse bucket counts; record(), merge(), percentile()."""
+
+    __slots__ = ("bits", "counts", "total", "max_value", "min_value")
+
+    def __init__(self, bits: int = 8):
+        self.bits = bits
+        self.counts = {}
+        self.total = 0
+        self.max_value = None
+        self.min_value = None
+
+    def bucket_index(self, value: int) -> int:
+        bits = self.bits
+        if value < (1 << bits):
+            return value
+        shift = value.bit_length() - bits
+        return (1 << bits) + (shift - 1) * (1 << (bits - 1)) + ((value >> shift) - (1 << (bits - 1)))
+
+    def bucket_range(self, index: int) -> tuple[int, int]:
+        """[low, high) of the values that fall into bucket `index`."""
+        bits = self.bits
+        if index < (1 << bits):
+            return index, index + 1
+        half = 1 << (bits - 1)
+        shift = (index - (1 << bits)) // half + 1
+        top = (index - (1 << bits)) % half + half
+        return top << shift, (top + 1) << shift
+
+    def record(self, value: int, count: int = 1):
+        value = max(0, int(value))
+        idx = self.bucket_index(value)
+        self.counts[idx] = self.counts.get(idx, 0) + count
+        self.total += count
+        if self.max_value is None or value > self.max_value:
+            self.max_value = value
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+
+    def record_all(self, values: Iterable[Optional[int]]):
+        for v in values:
+            if v is not None:
+                self.record(v)
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        if other.bits != self.bits:
+            raise ValueError("cannot merge histograms of different precision")
+        for idx, n in other.counts.items():
+            self.counts[idx] = self.counts.get(idx, 0) + n
+        self.total += other.total
+        for attr, pick in (("max_value", max), ("min_value", min)):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            setattr(self, attr, theirs if mine is None else mine if theirs is None else pick(mine, theirs))
+        return self
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Value at percentile q (0-100): midpoint of its bucket, clamped to the observed range."""
+        if not self.total:
+            return None
+        rank = max(1, -(-self.total * q // 100))
+        seen = 0
+        for idx in sorted(self.counts):
+            seen += self.counts[idx]
+            if seen >= rank:
+                low, high = self.bucket_range(idx)
+                return min(max((low + high - 1) / 2, self.min_value), self.max_value)
+        return float(self.max_value)
+
+    def to_dict(self) -> dict:
+        return {"bits": self.bits, "counts": {str(k): v for k, v in self.counts.items()},
+                "min": self.min_value, "max": self.max_value}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "LatencyHistogram":
+        h = cls(d["bits"])
+        h.counts = {int(k): v for k, v in d["counts"].items()}
+        h.total = sum(h.counts.values())
+        h.min_value, h.max_value = d.get("min"), d.get("max")
+        return h
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_dict(), separators=(",", ":"))
+
+    @classmethod
+    def loads(cls, s: str) -> "LatencyHistogram":
+        return cls.from_dict(json.loads(s))
@@ -0,0 +1,166 @@
+# limiter.py
+"""
+Adaptive per-WAF concurrency limit (AIMD on latency and failures).
+
+The runner keeps one limiter per WAF and data set type (Malicious requests
+have their own timeouts and body inspection, hence their own latency) instead
+of fixed semaphores shared by all WAFs, so a slow WAF neither holds back the
+others' request slots nor gets pushed into timeouts recorded as status 0.
+The limit works like TCP congestion control:
+
+- slow start: +1 per success until the first congestion signal;
+- congestion avoidance: +1/limit per success (about +1 per round trip);
+- multiplicative decrease (limit * backoff) on a failed request, or when the
+  smoothed latency exceeds `tolerance` times the WAF's unloaded latency; at
+  most once per smoothed round trip, so one burst counts as one signal.
+
+Latency is measured around the request in the event loop, so a busy loop
+adds its own lag to every sample. With a loop_lag source (the recent lag of
+profiling.LoopLagMonitor), high latency while the loop lag alone could
+explain the excess holds the limit instead of decreasing it: a saturated
+client would otherwise shrink every limit, and growing it would only load
+the client more. min_limit is the floor for both signals.
+
+The limit only grows while at least half of it is in use, so a WAF that is
+fed slower than it could go does not build up a limit it never tested. The
+unloaded latency is the lowest smoothed latency seen over the last two
+windows of samples: robust to single fast responses, and it follows a WAF
+whose baseline drifts during a long run.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Optional
+
+
+class AIMDLimiter:
+    """Async concurrency limiter for one WAF; use as `async with limiter.slot() as s`."""
+
+    def __init__(self, name: str, initial: int, min_limit: int = 1, max_limit: int = 1500,
+                 adaptive: bool = True, backoff: float = 0.9, tolerance: float = 2.0,
+                 window: int = 1000, loop_lag: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit) if adaptive else self.max_limit)
+        self.adaptive = adaptive
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.window = window
+        self.loop_lag = loop_lag        # seconds of recent event-loop lag, or None
+
+        self.inflight = 0
+        self._waiters = deque()
+
+        self.slow_start = True
+        self.smoothed = None            # EWMA of latency, seconds
+        self._window_min = None
+        self._prev_window_min = None
+        self._window_n = 0
+        self._last_decrease = 0.0
+
+        # stats for the log
+        self.peak_limit = self.limit
+        self.decreases = 0
+        self.lag_holds = 0              # latency signals put down to loop lag
+        self.failures = 0
+        self.samples = 0
+
+    @property
+    def baseline(self):
+        mins = [m for m in (self._window_min, self._prev_window_min) if m is not None]
+        return min(mins) if mins else None
+
+    async def acquire(self):
+        while self.inflight >= int(self.limit):
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                # A wake-up handed to a cancelled waiter goes to the next one
+                if fut.done() and not fut.cancelled():
+                    self._wake()
+                raise
+        self.inflight += 1
+
+    def release(self, latency: float, failed: bool):
+        self.inflight -= 1
+        self.samples += 1
+        if failed:
+            self.failures += 1
+        else:
+            self.smoothed = latency if self.smoothed is None else 0.95 * self.smoothed + 0.05 * latency
+        if self.adaptive:
+            self._update(latency, failed)
+        self._wake()
+
+    def slot(self):
+        return _Slot(self)
+
+    def _wake(self):
+        free = int(self.limit) - self.inflight
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    def _update(self, latency: float, failed: bool):
+        if not failed:
+            if self.samples >= 20 and (self._window_min is None or self.smoothed < self._window_min):
+                self._window_min = self.smoothed
+            self._window_n += 1
+            if self._window_n >= self.window:
+                self._prev_window_min, self._window_min, self._window_n = self._window_min, None, 0
+
+        baseline = self.baseline
+        congested = failed
+        if not failed and baseline is not None and self.smoothed > self.tolerance * baseline:
+            if self.loop_lag and self.loop_lag() > (self.tolerance - 1) * baseline:
+                self.lag_holds += 1
+                return
+            congested = True
+        now = time.monotonic()
+        if congested:
+            if now - self._last_decrease >= (self.smoothed or latency):
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._last_decrease = now
+                self.slow_start = False
+                self.decreases += 1
+        elif self.inflight + 1 < self.limit / 2:
+            pass
+        elif self.slow_start:
+            self.limit = min(self.max_limit, self.limit + 1)
+        else:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self.peak_limit = max(self.peak_limit, self.limit)
+
+    def describe(self) -> str:
+        base = f"{self.baseline * 1000:.1f}ms" if self.baseline is not None else "-"
+        lat = f"{self.smoothed * 1000:.1f}ms" if self.smoothed is not None else "-"
+        mode = "adaptive" if self.adaptive else "fixed"
+        return (f"{self.name}: limit={int(self.limit)} ({mode}, peak {int(self.peak_limit)}, max {self.max_limit}) "
+                f"inflight={self.inflight} latency={lat} baseline={base} "
+                f"failed={self.failures}/{self.samples} decreases={self.decreases} lag_holds={self.lag_holds}")
+
+
+class _Slot:
+    """Holds one slot of a limiter; report the request's outcome with done()."""
+
+    __slots__ = ("limiter", "t0", "failed")
+
+    def __init__(self, limiter: AIMDLimiter):
+        self.limiter = limiter
+        self.failed = False
+
+    def done(self, failed: bool):
+        self.failed = failed
+
+    async def __aenter__(self):
+        await self.limiter.acquire()
+        self.t0 = time.perf_counter()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.limiter.release(time.perf_counter() - self.t0, self.failed or exc_type is not None)
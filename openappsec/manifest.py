@@ -0,0 +1,181 @@
+# manifest.py
+"""
+Persistent payload manifest for the Data/ directory.
+
+Each test file is keyed by its path, size and mtime. For every file we keep
+the number of payloads it holds and the byte offset of each item inside the
+top-level JSON array, so the runner can size its progress bar without parsing
+the corpus and can stream (or slice) items straight from those offsets.
+Only files whose size or mtime changed are re-indexed.
+"""
+import json
+import os
+from json.decoder import WHITESPACE
+from pathlib import Path
+from typing import Iterator, Optional
+
+from config import DATA_PATH, MANIFEST_PATH
+from helper import log
+
+MANIFEST_VERSION = 1
+
+_decoder = json.JSONDecoder()
+
+
+def manifest_key(path: Path) -> str:
+    """Stable key for a test file: its POSIX path relative to DATA_PATH."""
+    try:
+        return Path(path).relative_to(DATA_PATH).as_posix()
+    except ValueError:
+        return Path(path).as_posix()
+
+
+def index_json_array(raw: bytes) -> list[int]:
+    """
+    Return the byte offset of every item in a top-level JSON array.
+    Each item is decoded once to find where it ends; nothing is kept.
+    """
+    text = raw.decode("utf-8")
+    ascii_only = len(text) == len(raw)
+    end = len(text)
+
+    pos = WHITESPACE.match(text, 0).end()
+    if pos >= end or text[pos] != "[":
+        raise ValueError("expected a top-level JSON array")
+    pos += 1
+
+    offsets = []
+    byte_pos = char_pos = 0
+    while True:
+        pos = WHITESPACE.match(text, pos).end()
+        if pos >= end:
+            raise ValueError("unterminated JSON array")
+        if text[pos] == "]":
+            break
+        if ascii_only:
+            offsets.append(pos)
+        else:
+            byte_pos += len(text[char_pos:pos].encode("utf-8"))
+            char_pos = pos
+            offsets.append(byte_pos)
+        _, pos = _decoder.raw_decode(text, pos)
+        pos = WHITESPACE.match(text, pos).end()
+        if pos < end and text[pos] == ",":
+            pos += 1
+        elif pos >= end or text[pos] != "]":
+            raise ValueError(f"expected ',' or ']' at char {pos}")
+    return offsets
+
+
+def index_file(path: Path) -> dict:
+    """Build a fresh manifest entry for one test file."""
+    st = os.stat(path)
+    with open(path, "rb") as f:
+        raw = f.read()
+    offsets = index_json_array(raw)
+    return {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "count": len(offsets),
+        "offsets": offsets,
+    }
+
+
+def load_manifest(manifest_path: Path = MANIFEST_PATH) -> dict:
+    """Load the manifest from disk; an unreadable or outdated one is treated as empty."""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+        log.debug(f"Manifest {manifest_path} has an old format, rebuilding")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning(f"Manifest {manifest_path} unreadable ({e}), rebuilding")
+    return {"version": MANIFEST_VERSION, "files": {}}
+
+
+def save_manifest(manifest: dict, manifest_path: Path = MANIFEST_PATH):
+    """Write the manifest atomically (tmp file of this process + rename)."""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = manifest_path.with_suffix(f"{manifest_path.suffix}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, separators=(",", ":"))
+    os.replace(tmp, manifest_path)
+
+
+def refresh_manifest(test_files, manifest_path: Path = MANIFEST_PATH) -> dict:
+    """
+    Return {manifest_key: entry} for test_files, re-indexing only files whose
+    size/mtime changed since the last run. Entries for files that are gone
+    are dropped. Files that fail to index get count 0 and an "error" field.
+    """
+    manifest = load_manifest(manifest_path)
+    old = manifest["files"]
+    files = {}
+    changed = len(old) != len(test_files)
+
+    for path in test_files:
+        key = manifest_key(path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            log.warning(f"Cannot stat {path}: {e}")
+            changed = True
+            continue
+        entry = old.get(key)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            files[key] = entry
+            continue
+
+        changed = True
+        try:
+            entry = index_file(path)
+            log.debug(f"Indexed {key}: {entry['count']} payloads")
+        except Exception as e:
+            log.warning(f"Failed to index {path}: {e}")
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "count": 0, "offsets": [], "error": str(e)}
+        files[key] = entry
+
+    if changed:
+        manifest["files"] = files
+        save_manifest(manifest, manifest_path)
+        log.info(f"Manifest updated: {len(files)} files, {sum(e['count'] for e in files.values())} payloads")
+    return files
+
+
+def iter_payloads_at(path: Path, offsets: list[int], start: int = 0, stop: Optional[int] = None) -> Iterator[dict]:
+    """
+    Stream items [start:stop] of a test file using its manifest offsets.
+    One seek, then each item is read and decoded on its own, so memory stays
+    at one payload regardless of file size.
+    """
+    stop = len(offsets) if stop is None else min(stop, len(offsets))
+    if start >= stop:
+        return
+    with open(path, "rb") as f:
+        f.seek(offsets[start])
+        for i in range(start, stop):
+            if i + 1 < len(offsets):
+                chunk = f.read(offsets[i + 1] - offsets[i])
+            else:
+                chunk = f.read()
+            item, _ = _decoder.raw_decode(chunk.decode("utf-8"))
+            yield item
+
+
+def iter_payloads_picked(path: Path, offsets: list[int], indices: list[int]) -> Iterator[dict]:
+    """Items at the given (ascending) indices of a test file; one open, one seek per item."""
+    with open(path, "rb") as f:
+        for i in indices:
+            f.seek(offsets[i])
+            chunk = f.read(offsets[i + 1] - offsets[i]) if i + 1 < len(offsets) else f.read()
+            item, _ = _decoder.raw_decode(chunk.decode("utf-8"))
+            yield item
+
+
+if __name__ == "__main__":
+    entries = refresh_manifest(sorted(DATA_PATH.rglob("*.json")))
+    for key, entry in sorted(entries.items()):
+        print(f"{entry['count']:>10}  {key}")
@@ -0,0 +1,84 @@
+# matcher.py
+"""
+Block-page detection on response bodies, chunk by chunk.
+
+The slow path feeds every chunk of a body to a BlockScan as aiter_bytes()
+yields it and stops reading at the first phrase found. Chunks are searched as
+bytes (no decoding) together with the last len(longest phrase) - 1 bytes of
+the previous chunk, so phrases split across chunks are found and every byte
+is searched once. Phrases that matched recently move to the front, so a WAF's
+own block page is usually found by the first search.
+
+Each WAF can also get a signature of its own block page, learned from the
+XSS probe of the connectivity check (learn_signature, BLOCK_CALIBRATION=true).
+"""
+import re
+from typing import Iterable, Optional
+
+_TITLE = re.compile(rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+_TEXT_BREAKS = re.compile(rb"<[^>]*>|[\r\n]+")
+# Parts of a block page that change per request: ids, times, addresses (anything with a digit), hex digests
+_VOLATILE = re.compile(rb"[0-9A-Fa-f]{8,}|[\w.:/-]*\d[\w.:/-]*")
+
+
+class BlockMatcher:
+    """Finds any of a set of phrases in a body; scanner() for chunked bodies."""
+
+    def __init__(self, phrases: Iterable[str]):
+        self.phrases = list(dict.fromkeys(p.encode("utf-8") for p in phrases if p))
+        self.overlap = max((len(p) for p in self.phrases), default=1) - 1
+
+    def search(self, data: bytes) -> Optional[bytes]:
+        """The first phrase found in data, or None."""
+        phrases = self.phrases
+        for i, phrase in enumerate(phrases):
+            if phrase in data:
+                if i:
+                    # Transpose towards the front: frequent block pages get checked first
+                    phrases[i - 1], phrases[i] = phrase, phrases[i - 1]
+                return phrase
+        return None
+
+    def scanner(self) -> "BlockScan":
+        return BlockScan(self)
+
+
+class BlockScan:
+    """Incremental search over one body; feed() returns True on the first match."""
+
+    __slots__ = ("matcher", "tail")
+
+    def __init__(self, matcher: BlockMatcher):
+        self.matcher = matcher
+        self.tail = b""
+
+    def feed(self, chunk: bytes) -> bool:
+        data = self.tail + chunk if self.tail else chunk
+        if self.matcher.search(data) is not None:
+            return True
+        overlap = self.matcher.overlap
+        self.tail = data[-overlap:] if overlap else b""
+        return False
+
+
+def learn_signature(block_page: bytes, normal_page: bytes, max_len: int = 64) -> Optional[str]:
+    """
+    Text of a WAF's block page that its normal page lacks: the page title if
+    it is distinctive, else the longest such line of text. Lines are cut at
+    per-request values (incident ids, timestamps, client addresses), so the
+    signature, and the verdict cache key it is part of, is the same on every
+    run and matches every block page. None when the pages share everything
+    worth matching on.
+    """
+    normal = normal_page.lower()
+    candidates = []
+    title = _TITLE.search(block_page)
+    if title:
+        candidates += sorted(_VOLATILE.split(title.group(1).strip()), key=len, reverse=True)
+    candidates += sorted((part for line in _TEXT_BREAKS.split(block_page) for part in _VOLATILE.split(line)),
+                         key=len, reverse=True)
+    for text in candidates:
+        text = text[:max_len].strip()
+        if len(text) >= 8 and text.lower() not in normal:
+            return text.decode("utf-8", "ignore") or None
+    return None
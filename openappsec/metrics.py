@@ -0,0 +1,133 @@
+# metrics.py
+"""
+Live run metrics in Prometheus text format (METRICS_PORT=9108 python runner.py).
+
+    curl -s localhost:9108/metrics
+
+Counters and gauges are labelled by WAF and data set where that applies.
+Every sending process keeps its own registry; with --workers the worker
+registries are shipped to the parent as snapshots together with their rows,
+and the parent's endpoint reports the sum.
+"""
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from helper import log
+
+METRIC_HELP = {
+    "waf_requests_sent_total": ("counter", "Requests handed to the HTTP client."),
+    "waf_responses_total": ("counter", "Completed requests by status class (failed = status 0)."),
+    "waf_blocked_total": ("counter", "Requests detected as blocked."),
+    "waf_failures_total": ("counter", "Requests that failed or timed out (recorded as status 0)."),
+    "waf_response_seconds_sum": ("counter", "Total time of completed requests, in seconds."),
+    "waf_inflight_requests": ("gauge", "Requests sent and not yet answered."),
+    "waf_concurrency_limit": ("gauge", "Current concurrency limit of the WAF's limiter."),
+    "runner_requests_submitted_total": ("counter", "(payload, WAF) pairs scheduled so far."),
+    "runner_verdict_cache_hits_total": ("counter", "Results answered from the verdict cache instead of sent."),
+    "runner_pending_tasks": ("gauge", "Scheduled request tasks not finished yet."),
+    "runner_writer_backlog": ("gauge", "Items waiting in the DB writer queue."),
+    "runner_rows_committed_total": ("counter", "Result rows committed to the DB."),
+    "runner_commits_total": ("counter", "Writer transactions committed."),
+    "runner_commit_p99_seconds": ("gauge", "99th percentile of the writer's commit duration."),
+    "runner_commit_max_seconds": ("gauge", "Longest commit of the writer."),
+    "runner_stage_seconds_total": ("counter", "Cumulative seconds per runner stage (see profiling.py)."),
+    "runner_stage_calls_total": ("counter", "Calls per runner stage."),
+    "runner_loop_lag_samples_total": ("counter", "Event-loop lag samples taken."),
+    "runner_loop_lag_p99_seconds": ("gauge", "99th percentile of event-loop lag."),
+    "runner_loop_lag_max_seconds": ("gauge", "Largest event-loop lag seen."),
+}
+
+
+def status_class(status: int) -> str:
+    return "failed" if status == 0 else f"{status // 100}xx"
+
+
+class Metrics:
+    """Thread-safe registry of labelled counters and gauges."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)     # (name, labels) -> value
+        self._gauges = {}                       # (name, labels) -> value or callable
+        self._remote = {}                       # source -> snapshot of another process
+
+    def inc(self, name: str, labels: tuple = (), n: float = 1):
+        with self._lock:
+            self._counters[(name, labels)] += n
+
+    def set(self, name: str, labels: tuple = (), value=0):
+        """Set a gauge; value may be a callable evaluated at scrape time."""
+        with self._lock:
+            self._gauges[(name, labels)] = value
+
+    def snapshot(self) -> dict:
+        """Plain {(name, labels): value} of this process (picklable)."""
+        with self._lock:
+            snap = dict(self._counters)
+            gauges = list(self._gauges.items())
+        for key, value in gauges:
+            snap[key] = value() if callable(value) else value
+        return snap
+
+    def absorb(self, source, snapshot: dict):
+        """Keep the latest snapshot sent by another process (e.g. a worker)."""
+        with self._lock:
+            self._remote[source] = snapshot
+
+    def totals(self) -> dict:
+        """{(name, labels): value} summed over this process and the absorbed snapshots."""
+        totals = defaultdict(float)
+        with self._lock:
+            remote = list(self._remote.values())
+        for snap in [self.snapshot(), *remote]:
+            for key, value in snap.items():
+                totals[key] += value
+        return totals
+
+    def render(self) -> str:
+        totals = self.totals()
+        lines = []
+        by_name = defaultdict(list)
+        for (name, labels), value in totals.items():
+            by_name[name].append((labels, value))
+        for name in sorted(by_name):
+            kind, help_text = METRIC_HELP.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(by_name[name]):
+                if labels:
+                    label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    lines.append(f"{name}{{{label_text}}} {value:g}")
+                else:
+                    lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def serve_metrics(metrics: Metrics, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve GET /metrics from a daemon thread; call .shutdown() when the run ends."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Serving live metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,153 @@
+# pacing.py
+"""
+Open-loop load: per-WAF request rates enforced by token buckets.
+
+By default the runner is closed-loop and sends as fast as its concurrency
+limits allow, so throughput depends on the runner, and a WAF's rate limiting
+(429 counts as a block) can leak into the detection numbers. With TARGET_RPS
+set, every WAF gets a token bucket whose rate follows a profile over time:
+
+    500                   constant 500 requests/s
+    ramp:50:1000:300      linear from 50 to 1000 req/s over 300 s, then hold 1000
+    steps:100,200,400:60  each rate held for 60 s, the last one until the end
+
+TARGET_RPS_BY_WAF="BunkerWeb WAF=200;Other WAF=steps:50,100:120" overrides the
+profile for single WAFs. Every paced WAF is fed by a loop of its own, which
+takes a token before it creates a request, so each WAF gets its own rate. The
+rate a WAF actually received (requests sent over the last second, see
+RateMeter) is stored with each result, so block rates are compared across
+the load levels that were reached, not the ones asked for.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Optional
+
+
+class RateProfile:
+    """Target requests/s as a function of seconds since the start of the run."""
+
+    def __init__(self, kind: str, rates: list[float], seconds: float = 0.0):
+        self.kind = kind
+        self.rates = rates
+        self.seconds = seconds
+
+    @classmethod
+    def parse(cls, spec: str) -> "RateProfile":
+        spec = spec.strip()
+        try:
+            if spec.startswith("ramp:"):
+                start, end, seconds = spec[len("ramp:"):].split(":")
+                return cls("ramp", [float(start), float(end)], float(seconds))
+            if spec.startswith("steps:"):
+                rates, seconds = spec[len("steps:"):].split(":")
+                return cls("steps", [float(r) for r in rates.split(",") if r.strip()], float(seconds))
+            return cls("constant", [float(spec)])
+        except ValueError:
+            raise ValueError(f"Bad rate profile {spec!r}; use N, ramp:START:END:SECONDS or steps:R1,R2,...:SECONDS")
+
+    def rate(self, elapsed: float) -> float:
+        if self.kind == "ramp":
+            start, end = self.rates
+            if elapsed >= self.seconds or self.seconds <= 0:
+                return end
+            return start + (end - start) * elapsed / self.seconds
+        if self.kind == "steps":
+            step = int(elapsed // self.seconds) if self.seconds > 0 else len(self.rates) - 1
+            return self.rates[min(step, len(self.rates) - 1)]
+        return self.rates[0]
+
+    def scaled(self, factor: float) -> "RateProfile":
+        """Same shape at factor times the rate (a worker's share of the target)."""
+        return RateProfile(self.kind, [r * factor for r in self.rates], self.seconds)
+
+    def __repr__(self):
+        if self.kind == "ramp":
+            return f"ramp {self.rates[0]:g}->{self.rates[1]:g} req/s over {self.seconds:g}s"
+        if self.kind == "steps":
+            return f"steps {','.join(f'{r:g}' for r in self.rates)} req/s every {self.seconds:g}s"
+        return f"{self.rates[0]:g} req/s"
+
+
+def rate_profiles(wafs: dict, default_spec: str, overrides_spec: str = "") -> dict:
+    """{WAF name: RateProfile} for every WAF, or {} when no target is configured."""
+    overrides = {}
+    for part in overrides_spec.split(";"):
+        if "=" in part:
+            name, spec = part.split("=", 1)
+            overrides[name.strip()] = RateProfile.parse(spec)
+    unknown = set(overrides) - set(wafs)
+    if unknown:
+        raise ValueError(f"TARGET_RPS_BY_WAF names unknown WAFs: {sorted(unknown)}")
+    if not default_spec.strip() and not overrides:
+        return {}
+    default = RateProfile.parse(default_spec) if default_spec.strip() else None
+    return {name: overrides.get(name, default) for name in wafs if overrides.get(name, default)}
+
+
+class TokenBucket:
+    """
+    Paces callers of take() to the profile's rate. Takers queue in FIFO order;
+    `burst` tokens may accumulate while the WAF is idle (0: 10 ms worth of the
+    current rate, which absorbs event loop timer granularity at high rates).
+    """
+
+    def __init__(self, profile: RateProfile, burst: float = 0.0):
+        self.profile = profile
+        self.burst = burst
+        self.tokens = 1.0
+        self.started: Optional[float] = None
+        self.last = 0.0
+        self.issued = 0
+        self.last_issued = None
+        self._lock = asyncio.Lock()
+
+    async def take(self) -> float:
+        """Wait for a token; returns the target rate it was issued at."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if self.started is None:
+                    self.started = self.last = now
+                rate = self.profile.rate(now - self.started)
+                burst = self.burst or rate / 100
+                self.tokens = min(max(1.0, burst), self.tokens + (now - self.last) * rate)
+                self.last = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    self.issued += 1
+                    self.last_issued = now
+                    return rate
+                await asyncio.sleep((1.0 - self.tokens) / rate if rate > 0 else 0.1)
+
+    def describe(self) -> str:
+        if self.started is None:
+            return f"target {self.profile}, not started"
+        elapsed = time.monotonic() - self.started
+        active = max(1e-3, self.last_issued - self.started)
+        return (f"target {self.profile}, now {self.profile.rate(elapsed):.0f} req/s, "
+                f"achieved {self.issued / active:.0f} req/s average")
+
+
+class RateMeter:
+    """Requests/s over the last `window` seconds, from the times of the requests sent."""
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self.times = deque()
+        self.first = None
+
+    def tick(self, now: float = None) -> Optional[float]:
+        """Count a request sent at `now` (perf_counter); the current rate, None on the first request."""
+        now = time.perf_counter() if now is None else now
+        if self.first is None:
+            self.first = now
+            self.times.append(now)
+            return None
+        self.times.append(now)
+        while self.times[0] <= now - self.window:
+            self.times.popleft()
+        if now - self.first < self.window:
+            # Not a full window yet: intervals between the requests seen so far
+            return (len(self.times) - 1) / max(now - self.first, 1e-6)
+        return len(self.times) / self.window
@@ -0,0 +1,174 @@
+# profiling.py
+"""
+Where the runner's time goes: per-stage timers, event-loop lag and an opt-in
+sampling profiler.
+
+Stages (cumulative seconds and calls, per process):
+
+    parse          reading the next payload from its source
+    schedule       payload id, request template, task creation
+    wait_inflight  waiting for room in a feeder's share of ASYNC_MAX_INFLIGHT
+    wait_rate      waiting for a token of the WAF's rate (TARGET_RPS)
+    wait_limiter   waiting for a slot of the WAF's concurrency limit
+    request        the HTTP request itself
+    enqueue        handing the result row to the writer (or the worker's batch)
+    serialize      writer: turning queued rows into DB tuples
+    commit         writer: inserts, count upserts and the commit
+
+Stages run by concurrent tasks (wait_rate, wait_limiter, request) add up to
+more than the wall time and are shown as average concurrency (x N); the
+serial ones (parse, schedule, wait_inflight, enqueue and the writer's) as the
+share of wall time the loop or the writer thread spent on them. Loop lag is
+how late a 100 ms sleep wakes up: a loop that is busy parsing or scheduling,
+or starved of the GIL by the writer, answers late. Timers and lag are
+published as metrics, so worker processes report theirs with their metrics
+snapshots and the end-of-run profile covers every process.
+
+PROFILE_OUTPUT=path samples the stacks of all threads every PROFILE_INTERVAL
+ms and writes them in collapsed-stack format ("frame;frame;frame count"), the
+input of flamegraph.pl, speedscope and similar tools.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from histogram import LatencyHistogram
+
+STAGES = ("parse", "schedule", "wait_inflight", "wait_rate", "wait_limiter", "request", "enqueue",
+          "serialize", "commit")
+# Timed by many tasks at once: reported as average concurrency rather than share of wall time
+CONCURRENT_STAGES = frozenset(("wait_rate", "wait_limiter", "request"))
+
+
+class StageTimer:
+    """Cumulative seconds and calls per stage. Each stage is timed from one thread only."""
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def add(self, stage: str, seconds: float, calls: int = 1):
+        self.seconds[stage] += seconds
+        self.calls[stage] += calls
+
+    def timed_iter(self, stage: str, iterable):
+        """Yield from iterable, timing every next() as `stage`."""
+        it = iter(iterable)
+        perf = time.perf_counter
+        while True:
+            t = perf()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add(stage, perf() - t, 0)
+                return
+            self.add(stage, perf() - t)
+            yield item
+
+    def publish(self, metrics, process: str):
+        """Expose the timers as metrics (read at scrape and snapshot time)."""
+        for stage in STAGES:
+            labels = (("process", process), ("stage", stage))
+            metrics.set("runner_stage_seconds_total", labels, lambda s=stage: self.seconds[s])
+            metrics.set("runner_stage_calls_total", labels, lambda s=stage: self.calls[s])
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag; run() as a task of the loop being watched."""
+
+    def __init__(self, interval: float = 0.1, recent_samples: int = 10):
+        self.interval = interval
+        self.hist = LatencyHistogram()
+        self._recent = deque([0.0], maxlen=recent_samples)
+
+    @property
+    def recent(self) -> float:
+        """Highest lag of the last samples (about a second), in seconds."""
+        return max(self._recent)
+
+    async def run(self):
+        perf = time.perf_counter
+        while True:
+            t = perf()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, perf() - t - self.interval)
+            self._recent.append(lag)
+            self.hist.record(int(lag * 1e6))
+
+    def publish(self, metrics, process: str):
+        labels = (("process", process),)
+        metrics.set("runner_loop_lag_samples_total", labels, lambda: self.hist.total)
+        metrics.set("runner_loop_lag_p99_seconds", labels, lambda: (self.hist.percentile(99) or 0) / 1e6)
+        metrics.set("runner_loop_lag_max_seconds", labels, lambda: (self.hist.max_value or 0) / 1e6)
+
+
+def format_profile(totals: dict, wall: float) -> list[str]:
+    """Lines of the end-of-run profile table from Metrics.totals()."""
+    stages = defaultdict(lambda: [0.0, 0])
+    lag = defaultdict(dict)
+    for (name, labels), value in totals.items():
+        labels = dict(labels)
+        if name == "runner_stage_seconds_total":
+            stages[labels["stage"]][0] += value
+        elif name == "runner_stage_calls_total":
+            stages[labels["stage"]][1] += value
+        elif name.startswith("runner_loop_lag_"):
+            lag[labels["process"]][name[len("runner_loop_lag_"):]] = value
+
+    lines = [f"{'stage':<14} {'total s':>10} {'calls':>10} {'mean ms':>9} {'busy':>8}"]
+    for stage in STAGES:
+        seconds, calls = stages.get(stage, (0.0, 0))
+        if not calls and not seconds:
+            continue
+        mean = f"{seconds / calls * 1000:9.3f}" if calls else f"{'-':>9}"
+        share = seconds / wall if wall else 0.0
+        busy = f"x{share:7.1f}" if stage in CONCURRENT_STAGES else f"{share * 100:7.1f}%"
+        lines.append(f"{stage:<14} {seconds:10.2f} {int(calls):10d} {mean} {busy}")
+    for process in sorted(lag):
+        l = lag[process]
+        if l.get("samples_total"):
+            lines.append(f"loop lag [{process}]: p99 {l.get('p99_seconds', 0) * 1000:.1f} ms, "
+                         f"max {l.get('max_seconds', 0) * 1000:.1f} ms over {int(l['samples_total'])} samples")
+    return lines
+
+
+class SamplingProfiler:
+    """Samples every thread's stack from a daemon thread; stop() writes collapsed stacks to `path`."""
+
+    def __init__(self, path, interval: float = 0.005):
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
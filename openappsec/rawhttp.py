@@ -0,0 +1,282 @@
+# rawhttp.py
+"""
+Minimal HTTP/1.1 client for the status-only fast path (RAW_HTTP_WAFS).
+
+Legitimate requests with FAST_BLOCK_DETECTION only need the status code, yet
+httpx builds its full request/response models, takes its pool lock and parses
+every header. RawHTTPClient writes pre-encoded requests (see templates.py) to
+keep-alive asyncio stream connections, parses the status line and the framing
+headers only (Content-Length, Transfer-Encoding, Connection) and discards the
+body. With pipeline > 1 up to that many requests are written to a connection
+before their responses are read; responses arrive in order, and a failure
+fails every request still waiting on that connection.
+
+    python rawhttp.py URL [N] [CONCURRENCY] [PIPELINE]   # throughput vs. httpx
+"""
+import asyncio
+import ssl
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+HEAD_LIMIT = 1 << 20        # largest response head accepted
+DISCARD_CHUNK = 1 << 16
+
+
+class RawHTTPError(Exception):
+    pass
+
+
+class _Connection:
+    """One keep-alive connection; requests are written in order and answered in order."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.waiting = deque()          # (future, timing, is_head) in send order
+        self.closed = False
+        self.idle = False               # in the pool's idle queue
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._read_responses())
+
+    def send(self, data: bytes, timing, is_head: bool) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.waiting.append((fut, timing, is_head))
+        self.writer.write(data)
+        self._wakeup.set()
+        return fut
+
+    def close(self, exc: BaseException = None):
+        if self.closed:
+            return
+        self.closed = True
+        self._task.cancel()
+        self.writer.close()
+        while self.waiting:
+            fut, _, _ = self.waiting.popleft()
+            if not fut.done():
+                fut.set_exception(exc or RawHTTPError("connection closed"))
+
+    async def _read_responses(self):
+        try:
+            while True:
+                if not self.waiting:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                fut, timing, is_head = self.waiting[0]
+                status, keep_alive = await self._read_response(timing, is_head)
+                self.waiting.popleft()
+                if not fut.done():
+                    fut.set_result(status)
+                if not keep_alive:
+                    self.close(RawHTTPError("server closed the connection"))
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.close(e)
+
+    async def _read_response(self, timing, is_head: bool):
+        reader = self.reader
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            if timing is not None and timing.headers_at is None:
+                timing.headers_at = time.perf_counter()
+            lines = head.split(b"\r\n")
+            parts = lines[0].split(None, 2)
+            if len(parts) < 2 or not parts[0].startswith(b"HTTP/1."):
+                raise RawHTTPError(f"bad status line {lines[0][:80]!r}")
+            status = int(parts[1])
+            if 100 <= status < 200 and status != 101:
+                continue                # interim response; the final one follows
+            break
+
+        length, chunked, keep_alive = None, False, parts[0] != b"HTTP/1.0"
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = b"chunked" in value.lower()
+            elif name == b"connection":
+                value = value.strip().lower()
+                keep_alive = value == b"keep-alive" if parts[0] == b"HTTP/1.0" else value != b"close"
+
+        if is_head or status in (204, 304):
+            return status, keep_alive
+        if chunked:
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";", 1)[0], 16)
+                if size == 0:
+                    while await reader.readuntil(b"\r\n") != b"\r\n":
+                        pass            # trailers
+                    break
+                await self._discard(size + 2)
+        elif length is not None:
+            await self._discard(length)
+        else:
+            # Body delimited by the end of the connection
+            while await reader.read(DISCARD_CHUNK):
+                pass
+            keep_alive = False
+        return status, keep_alive
+
+    async def _discard(self, n: int):
+        while n > 0:
+            chunk = await self.reader.read(min(n, DISCARD_CHUNK))
+            if not chunk:
+                raise RawHTTPError("connection closed mid-body")
+            n -= len(chunk)
+
+
+class RawHTTPClient:
+    """Keep-alive pool to one base URL; status(template) sends a request and returns its status code."""
+
+    def __init__(self, base_url: str, max_connections: int = 1000, pipeline: int = 1,
+                 connect_timeout: float = 4.0, read_timeout: float = 6.0):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"raw HTTP engine needs an http(s) URL, not {base_url!r}")
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.host_header = parts.netloc.rpartition("@")[2].encode("idna")
+        self.prefix = parts.path.rstrip("/").encode("utf-8")
+        self.ssl = None
+        if parts.scheme == "https":
+            self.ssl = ssl.create_default_context()
+            self.ssl.set_alpn_protocols(["http/1.1"])
+        self.max_connections = max_connections
+        self.pipeline = max(1, pipeline)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = deque()            # connections with room for another request
+        self._connections = set()
+        self._opening = 0
+        self._waiters = deque()
+
+    async def status(self, template, timing=None, read_timeout: float = None) -> int:
+        line, headers, body = template.raw_parts()
+        conn = await self._acquire(timing)
+        try:
+            fut = conn.send(b"".join((line[0], self.prefix, line[1], b"Host: ", self.host_header, b"\r\n",
+                                      headers, body)), timing, template.method == "HEAD")
+            self._release(conn)
+            try:
+                return await asyncio.wait_for(fut, read_timeout or self.read_timeout)
+            except asyncio.TimeoutError:
+                # The connection's responses are out of step with its requests now
+                conn.close(RawHTTPError("read timeout on another request of this connection"))
+                raise
+        finally:
+            self._release(conn)
+
+    async def _acquire(self, timing) -> _Connection:
+        while True:
+            while self._idle:
+                conn = self._idle.popleft()
+                conn.idle = False
+                if conn.closed or conn.reader.at_eof() or conn.writer.is_closing():
+                    # Closed by the server while idle (keep-alive timeout)
+                    conn.close()
+                    self._connections.discard(conn)
+                elif len(conn.waiting) < self.pipeline:
+                    return conn
+            if len(self._connections) + self._opening < self.max_connections:
+                return await self._open(timing)
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                # A wake-up handed to a cancelled waiter goes to the next one
+                if fut.done() and not fut.cancelled():
+                    self._wake()
+                raise
+
+    async def _open(self, timing) -> _Connection:
+        self._opening += 1
+        try:
+            if timing is not None:
+                timing.connect_start = time.perf_counter()
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl, limit=HEAD_LIMIT,
+                                        server_hostname=self.host if self.ssl else None),
+                self.connect_timeout)
+            if timing is not None:
+                timing.connect_end = time.perf_counter()
+        finally:
+            self._opening -= 1
+            self._wake()
+        conn = _Connection(reader, writer)
+        self._connections.add(conn)
+        return conn
+
+    def _release(self, conn: _Connection):
+        if conn.closed:
+            self._connections.discard(conn)
+        elif not conn.idle and len(conn.waiting) < self.pipeline:
+            conn.idle = True
+            self._idle.append(conn)
+        else:
+            return
+        self._wake()
+
+    def _wake(self):
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+
+    async def aclose(self):
+        for conn in list(self._connections):
+            conn.close()
+        self._connections.clear()
+        self._idle.clear()
+
+
+async def _benchmark(url: str, n: int, concurrency: int, pipeline: int):
+    import httpx
+    from templates import RequestTemplate
+
+    async def drive(send):
+        sem = asyncio.Semaphore(concurrency)
+        statuses = {}
+
+        async def one(i):
+            async with sem:
+                status = await send(i)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(n)))
+        return n / (time.perf_counter() - t0), statuses
+
+    limits = httpx.Limits(max_keepalive_connections=concurrency, max_connections=concurrency)
+    async with httpx.AsyncClient(http2=False, limits=limits) as client:
+        templates = [RequestTemplate.build("GET", f"/?i={i}", {}, None, client.headers) for i in range(n)]
+        rate_httpx, st_httpx = await drive(lambda i: _httpx_status(client, templates[i], url))
+    raw = RawHTTPClient(url, max_connections=concurrency, pipeline=pipeline)
+    try:
+        rate_raw, st_raw = await drive(lambda i: raw.status(templates[i]))
+    finally:
+        await raw.aclose()
+    print(f"{n} GETs to {url}, concurrency {concurrency}")
+    print(f"  httpx     : {rate_httpx:8.0f} req/s  {st_httpx}")
+    print(f"  raw engine: {rate_raw:8.0f} req/s  {st_raw}  (pipeline {pipeline}, {rate_raw / rate_httpx:.2f}x)")
+
+
+async def _httpx_status(client, template, url):
+    r = await client.send(template.request(url, client))
+    return r.status_code
+
+
+if __name__ == "__main__":
+    import sys
+    args = sys.argv[1:]
+    if not args:
+        sys.exit(__doc__)
+    asyncio.run(_benchmark(args[0], int(args[1]) if len(args) > 1 else 20000,
+                           int(args[2]) if len(args) > 2 else 100, int(args[3]) if len(args) > 3 else 1))
@@ -1,491 +1,1061 @@
-import asyncio
-import sqlite3
-import os
-import socket
-import json
-import threading
-import queue
-import datetime
-import time
-import random
-from pathlib import Path
-from typing import Iterator, Optional
-
-from tqdm import tqdm
-import httpx
-
-from analyzer import analyze_results
-from config import WAFS_DICT, DATA_PATH, DB_PATH
-from helper import log, prepare_data  # no global-conn DB ops here
-
-
-# ---------------- DB bootstrap (avoid global conn) ----------------
-
-def ensure_db_dir():
-    DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-
-def ensure_results_table(fresh: bool = False):
-    """(Re)create the results table using a fresh, local connection."""
-    ensure_db_dir()
-    with sqlite3.connect(DB_PATH) as c:
-        try:
-            c.execute("PRAGMA journal_mode=WAL;")
-            c.execute("PRAGMA synchronous=OFF;")
-            c.execute("PRAGMA temp_store=MEMORY;")
-        except Exception:
-            pass
-        if fresh:
-            c.execute("DROP TABLE IF EXISTS waf_comparison")
-        c.execute("""
-        CREATE TABLE IF NOT EXISTS waf_comparison (
-            method TEXT,
-            url TEXT,
-            headers TEXT,
-            data TEXT,
-            machineName TEXT,
-            DestinationURL TEXT,
-            WAF_Name TEXT,
-            DateTime TEXT,
-            TestName TEXT,
-            DataSetType TEXT,
-            response_status_code INTEGER,
-            isBlocked INTEGER,
-            response_body TEXT
-        );
-        """)
-    log.info(f"DB ready at {DB_PATH} (fresh={fresh})")
-
-def _safe_text(val):
-    """Convert any object to a safe, null-free string for SQLite."""
-    if val is None:
-        s = ""
-    elif isinstance(val, bytes):
-        s = val.decode("utf-8", errors="replace")
-    elif isinstance(val, str):
-        s = val
-    else:
-        try:
-            s = json.dumps(val, ensure_ascii=False)
-        except Exception:
-            s = str(val)
-    return s.replace("\x00", "\uFFFD")
-
-def _flush_to_db(rows, db_conn):
-    """Fast executemany insert; writer-thread-owned connection only."""
-    if not rows:
-        return 0
-    out = []
-    for r in rows:
-        out.append((
-            _safe_text(r["method"]),
-            _safe_text(r["url"]),
-            _safe_text(r["headers"]),
-            _safe_text(r["data"]),
-            _safe_text(r["machineName"]),
-            _safe_text(r["DestinationURL"]),
-            _safe_text(r["WAF_Name"]),
-            _safe_text(r["DateTime"]),
-            _safe_text(r["TestName"]),
-            _safe_text(r["DataSetType"]),
-            int(r["response_status_code"]),
-            int(bool(r["isBlocked"]))
-        ))
-    with db_conn:
-        db_conn.executemany("""
-            INSERT INTO waf_comparison (
-              method,url,headers,data,machineName,DestinationURL,WAF_Name,DateTime,
-              TestName,DataSetType,response_status_code,isBlocked,response_body
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,NULL)
-        """, out)
-    return len(out)
-
-def _sanitize_headers_for_http2(hdrs: dict | None) -> dict:
-    """Drop hop-by-hop headers and anything illegal for HTTP/2 (e.g., Connection)."""
-    hdrs = (hdrs or {}).copy()
-    for k in list(hdrs.keys()):
-        kl = k.lower()
-        if kl in ("host", "connection", "content-length", "proxy-connection",
-                  "keep-alive", "transfer-encoding", "upgrade"):
-            hdrs.pop(k, None)
-    return hdrs
-
-
-# -------------- Streaming JSON (no full file load) --------------
-
-def iter_payloads_from_json(path: Path, limit: Optional[int] = None) -> Iterator[dict]:
-    """
-    Stream items from a top-level JSON array like:
-    [ {payload1}, {payload2}, ... ]
-
-    If limit is provided (SMOKE_N), we load once, optionally shuffle,
-    and slice to get a representative subset.
-    Without limit, we stream to keep memory lower.
-    """
-    if limit is not None:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        if os.getenv("SMOKE_SHUFFLE", "true").lower() in ("1", "true", "yes", "y"):
-            random.shuffle(data)
-        data = data[:limit]
-        for item in data:
-            yield item
-        return
-
-    # full streaming path for large runs
-    try:
-        import ijson  # type: ignore
-        with open(path, "rb") as f:
-            for item in ijson.items(f, "item"):
-                yield item
-        return
-    except Exception:
-        pass  # fall back
-
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    for item in data:
-        yield item
-
-
-# -------------------- Runner --------------------
-
-class Wafs:
-    """Async HTTP runner with a single writer thread (batched inserts)."""
-
-    def __init__(self):
-        self.wafs = WAFS_DICT
-        self.inverse_waf_dict = {v: k for k, v in self.wafs.items()}
-        self._lock = threading.Lock()
-
-        # ---- Tunables via env ----
-        # block detection (fast path skips body inspection)
-        self.fast_block_detection = os.getenv("FAST_BLOCK_DETECTION", "true").lower() in ("1", "true", "yes", "y")
-
-        # statuses considered "blocked"
-        block_status_csv = os.getenv("BLOCK_STATUS", "403,406,429")
-        try:
-            self.block_status = {int(x.strip()) for x in block_status_csv.split(",") if x.strip()}
-        except Exception:
-            self.block_status = {403, 406, 429}
-
-        # phrases signaling a block page (used in slow path)
-        default_phrases = [
-            "The requested URL was rejected. Please consult with your administrator.",
-            "Request blocked by",
-            "Access denied",
-            "ModSecurity Action",
-            "403 Forbidden",
-        ]
-        extra_phrases = [p.strip() for p in os.getenv("BLOCK_PHRASES", "").split("||") if p.strip()]
-        self.block_phrases = default_phrases + extra_phrases
-
-        # limit how much body to peek in slow mode
-        self.peek_bytes = int(os.getenv("PEEK_BYTES", "2048"))
-
-        # HTTP timeouts
-        self.connect_t = float(os.getenv("HTTP_CONNECT_TIMEOUT", "4.0"))
-        self.read_t    = float(os.getenv("HTTP_READ_TIMEOUT",    "6.0"))
-        self.write_t   = float(os.getenv("HTTP_WRITE_TIMEOUT",   "4.0"))
-        self.pool_t    = float(os.getenv("HTTP_POOL_TIMEOUT",    "4.0"))
-
-        # Malicious-only timeouts & retry
-        self.mal_connect_t = float(os.getenv("MAL_HTTP_CONNECT_TIMEOUT", str(self.connect_t)))
-        self.mal_read_t    = float(os.getenv("MAL_HTTP_READ_TIMEOUT",    "10.0"))
-        self.mal_write_t   = float(os.getenv("MAL_HTTP_WRITE_TIMEOUT",   str(self.write_t)))
-        self.mal_retries   = int(os.getenv("MAL_HTTP_RETRIES",           "1"))
-
-        # Concurrency limits
-        self.max_inflight       = int(os.getenv("ASYNC_MAX_INFLIGHT", "5000"))
-        self.sem_concurrency    = int(os.getenv("ASYNC_CONCURRENCY", "1500"))     # for Legitimate
-        self.mal_sem_concurrency = int(os.getenv("MALICIOUS_CONCURRENCY", "1000")) # smaller for Malicious
-
-    def get_waf_name_by_url(self, url):
-        return self.inverse_waf_dict[url]
-
-    def check_connection(self):
-        """Quick sync health checks (HTTP/1.1 is fine here)."""
-        import requests
-        from requests.adapters import HTTPAdapter
-        s = requests.Session()
-        s.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
-        s.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
-
-        failed = False
-        log.info(f"Starting run. DB={DB_PATH}  Hosts={list(self.wafs.keys())}")
-        log.debug("Initiating health check to confirm proper connectivity configurations.")
-        for name, url in self.wafs.items():
-            try:
-                r = s.get(url, timeout=3)
-                if r.status_code == 200:
-                    log.info(f"Health check passed - WAF: {name}")
-                else:
-                    log.error(f"Health check failed - WAF: {name} - please allow: {url} (status={r.status_code})")
-                    failed = True
-            except Exception as e:
-                log.error(f"Health check failed - WAF: {name} - {e}")
-                failed = True
-
-        log.debug("Initiating WAF functionality verification (basic XSS should be blocked).")
-        for name, url in self.wafs.items():
-            try:
-                r = s.get(url + "/?a=<script>alert(1)</script>", timeout=3)
-                blocked = (r.status_code in self.block_status) or any(p in r.text for p in self.block_phrases)
-                if blocked:
-                    log.info(f"WAF functionality check passed - WAF: {name}")
-                else:
-                    log.error(f"WAF functionality check failed - WAF: {name} - should block basic XSS")
-                    failed = True
-            except Exception as e:
-                log.error(f"WAF functionality check (malicious) failed - WAF: {name} - {e}")
-                failed = True
-
-        if failed:
-            raise ConnectionError("Connectivity/WAF checks failed; fix config and re-run.")
-        log.info("All connectivity tests passed.")
-
-    async def send_payloads_async(self):
-        """Async HTTP scheduler with backpressure feeding a writer thread."""
-        if not self.wafs:
-            log.warning("WAFS_DICT is empty, skipping payload send step.")
-            return
-
-        # Fresh table using a local connection (no global conn here)
-        ensure_results_table(fresh=True)
-
-        # --- scan dataset and pre-count total requests (for % bar) ---
-        test_files = list(DATA_PATH.rglob("*.json"))
-        SMOKE_N = int(os.getenv("SMOKE_N", "0")) or None
-        for p in test_files:
-            try:
-                if SMOKE_N:
-                    cnt = sum(1 for _ in iter_payloads_from_json(p, limit=SMOKE_N))
-                else:
-                    cnt = sum(1 for _ in iter_payloads_from_json(p))
-            except Exception:
-                cnt = 0
-            total_requests += cnt * len(self.wafs)
-        log.info(f"Submitting & running payloads: 0 / {total_requests}")
-
-        # Async clients per WAF
-        limits = httpx.Limits(max_keepalive_connections=1000, max_connections=1000)
-        default_timeouts = httpx.Timeout(connect=self.connect_t, read=self.read_t, write=self.write_t, pool=self.pool_t)
-        mal_timeouts     = httpx.Timeout(connect=self.mal_connect_t, read=self.mal_read_t, write=self.mal_write_t, pool=self.pool_t)
-
-        clients = {}
-        for waf_name, url in self.wafs.items():
-            # Use HTTP/1.1 for BunkerWeb to avoid H2 stalls under load
-            use_h2 = (waf_name.find("BunkerWeb") == -1)
-            clients[url] = httpx.AsyncClient(http2=use_h2, limits=limits, timeout=default_timeouts)
-
-        # Writer thread + queue
-        q = queue.Queue(maxsize=10000)
-        stop = object()
-        BATCH_SIZE = 10000
-
-        def writer():
-            local = sqlite3.connect(DB_PATH)
-            try:
-                try:
-                    local.execute("PRAGMA journal_mode=WAL;")
-                    local.execute("PRAGMA synchronous=OFF;")
-                    local.execute("PRAGMA temp_store=MEMORY;")
-                except Exception:
-                    pass
-
-                buf = []
-                while True:
-                    item = q.get()
-                    if item is stop:
-                        break
-                    buf.append(item)
-                    if len(buf) >= BATCH_SIZE:
-                        _flush_to_db(buf, local)
-                        buf.clear()
-                if buf:
-                    _flush_to_db(buf, local)
-            finally:
-                local.close()
-
-        wt = threading.Thread(target=writer, daemon=True)
-        wt.start()
-
-        # ---------------- Request worker ----------------
-
-        async def one_request(
-            client: httpx.AsyncClient,
-            method: str,
-            url: str,
-            headers: dict,
-            data,
-            inspect_body: bool,
-            timeouts: httpx.Timeout,
-            retries: int,
-        ):
-            headers = _sanitize_headers_for_http2(headers)
-            attempt = 0
-            while True:
-                try:
-                    if self.fast_block_detection and not inspect_body:
-                        # FAST path: status-only
-                        r = await client.request(method, url, headers=headers, data=data, timeout=timeouts)
-                        blocked = (r.status_code in self.block_status)
-                        return r.status_code, blocked, ""
-                    else:
-                        # SLOW path: do not read full body; peek only up to self.peek_bytes
-                        async with client.stream(method, url, headers=headers, data=data, timeout=timeouts) as r:
-                            status = r.status_code
-                            if status in self.block_status:
-                                return status, True, ""
-
-                            # Read incrementally, up to peek_bytes
-                            total = 0
-                            chunks = []
-                            try:
-                                async for chunk in r.aiter_bytes():
-                                    if not chunk:
-                                        break
-                                    chunks.append(chunk)
-                                    total += len(chunk)
-                                    if total >= self.peek_bytes:
-                                        break
-                            except (httpx.ReadTimeout, httpx.TimeoutException):
-                                text = (b"".join(chunks)[: self.peek_bytes]).decode("utf-8", "ignore") if chunks else ""
-                                blocked = any(p in text for p in self.block_phrases)
-                                return status, blocked, text
-
-                            text = (b"".join(chunks)[: self.peek_bytes]).decode("utf-8", "ignore") if chunks else ""
-                            blocked = any(p in text for p in self.block_phrases)
-                            return status, blocked, text
-                except (httpx.ConnectTimeout, httpx.ReadTimeout, httpx.WriteTimeout,
-                        httpx.TimeoutException, httpx.RemoteProtocolError):
-                    attempt += 1
-                    if attempt > retries:
-                        return 0, False, "REQUEST FAILED OR TIMED OUT"
-                    await asyncio.sleep(0.05 * attempt)  # tiny backoff
-                except Exception:
-                    return 0, False, "REQUEST FAILED OR TIMED OUT"
-
-        # Concurrency & backpressure
-        MAX_INFLIGHT = self.max_inflight
-        sem_legit = asyncio.Semaphore(self.sem_concurrency)
-        sem_mal   = asyncio.Semaphore(self.mal_sem_concurrency)
-        pending = set()
-
-        async def schedule(payload, base_url, client, test_path):
-            method = str(payload["method"])
-            rel_url = str(payload["url"])
-            headers = payload.get("headers") or {}
-            data = payload.get("data")
-
-            # Force body inspection for Malicious to catch non-403 block pages,
-            # while keeping fast detection for Legitimate
-            dataset_type = test_path.parent.stem
-            inspect_body = (dataset_type.lower() == "malicious")
-
-            sem      = sem_mal if inspect_body else sem_legit
-            timeouts = mal_timeouts if inspect_body else default_timeouts
-            retries  = self.mal_retries if inspect_body else 0
-
-            async with sem:
-                status, blocked, body = await one_request(
-                    client, method, base_url + rel_url, headers, data, inspect_body, timeouts, retries
-                )
-
-            # Keep body only if we inspected (useful for later reports)
-            body = body if inspect_body else ""
-
-            q.put({
-                "method": method,
-                "url": rel_url,
-                "headers": headers,         # raw; serialized by writer
-                "data": data,               # raw; serialized by writer
-                "machineName": socket.gethostname(),
-                "DestinationURL": base_url,
-                "WAF_Name": self.get_waf_name_by_url(base_url),
-                "DateTime": datetime.datetime.now().isoformat(timespec="seconds"),
-                "TestName": test_path.stem,
-                "DataSetType": dataset_type,
-                "response_status_code": status,
-                "isBlocked": blocked,
-                "response_body": body,
-            })
-
-        # Drive the loop with a simple percentage bar + x/total logging
-        processed = 0
-        last_log_time = time.time()
-        try:
-            with tqdm(total=total_requests, desc="Submitting & running payloads", unit="req") as pbar:
-                for test_path in test_files:
-                    for payload in iter_payloads_from_json(test_path, limit=SMOKE_N):
-                        for base_url, client in clients.items():
-                            task = asyncio.create_task(schedule(payload, base_url, client, test_path))
-                            pending.add(task)
-                            processed += 1
-                            pbar.update(1)
-                            # log every 5 seconds
-                            now = time.time()
-                            if now - last_log_time >= 5 or processed == total_requests:
-                                log.info(f"Submitting & running payloads: {processed} / {total_requests}")
-                                last_log_time = now
-
-                            if len(pending) >= MAX_INFLIGHT:
-                                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-
-                # drain remaining
-                while pending:
-                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-        finally:
-            # Always close clients and stop writer, even on Ctrl-C
-            await asyncio.gather(*(c.aclose() for c in clients.values()), return_exceptions=True)
-            q.put(stop)
-            wt.join(timeout=30)
-
-        # Quick DB snapshot (optional, concise)
-        self._print_db_counts()
-
-    @staticmethod
-    def _print_db_counts():
-        with sqlite3.connect(DB_PATH) as c:
-            rows = c.execute("""
-              SELECT WAF_Name,
-                     SUM(CASE WHEN response_status_code!=0 THEN 1 ELSE 0 END) AS nonzero,
-                     COUNT(*) AS total,
-                     SUM(CASE WHEN response_status_code=403 THEN 1 ELSE 0 END) AS blocks_403,
-                     SUM(CASE WHEN isBlocked=1 THEN 1 ELSE 0 END) AS blocks_detected
-              FROM waf_comparison
-              GROUP BY WAF_Name
-            """).fetchall()
-
-            per_ds = c.execute("""
-              SELECT WAF_Name, DataSetType,
-                     SUM(CASE WHEN response_status_code!=0 THEN 1 ELSE 0 END) AS nonzero,
-                     SUM(CASE WHEN isBlocked=1 THEN 1 ELSE 0 END) AS detected_blocks
-              FROM waf_comparison
-              GROUP BY WAF_Name, DataSetType
-              ORDER BY WAF_Name, DataSetType
-            """).fetchall()
-
-        log.info("=== DB Results Snapshot ===")
-        for name, nonzero, total, blocks_403, blocks_detected in rows:
-            log.info(f"WAF {name}: non-zero={nonzero}/{total}  403={blocks_403}  detected_blocks={blocks_detected}")
-
-        for name, ds, nonzero, detected in per_ds:
-            log.info(f"    -> {name} [{ds}]: non-zero={nonzero}  detected_blocks={detected}")
-
-def main():
-    log.info("==== WAF Comparison Runner: START ====")
-    log.info(f"Data path: {DATA_PATH} | DB: {DB_PATH}")
-    wafs = Wafs()
-    wafs.check_connection()
-    prepare_data()
-    try:
-        asyncio.run(wafs.send_payloads_async())
-    except KeyboardInterrupt:
-        log.warning("Interrupted by user. Attempted graceful shutdown.")
-    analyze_results()
-    log.info("==== WAF Comparison Runner: END ====")
-
-
-if __name__ == "__main__":
-    main()
-
+import argparse
+import asyncio
+import contextlib
+import itertools
+import multiprocessing
+import os
+import socket
+import threading
+import queue
+import time
+from pathlib import Path
+
+from tqdm import tqdm
+import httpx
+
+from analyzer import analyze_results
+from calibration import Calibration, ClientProfile, profile_overrides, resolve_profiles
+from config import WAFS_DICT, DATA_PATH, DB_PATH
+from helper import log, prepare_data  # no global-conn DB ops here
+from checkpoint import CompletedPairs
+from corpus import normalize_headers
+from distributed import CoordinatorClient, run_coordinator
+from limiter import AIMDLimiter
+from matcher import BlockMatcher, learn_signature
+from rawhttp import RawHTTPClient
+from histogram import LatencyHistogram
+from metrics import Metrics, serve_metrics, status_class
+from pacing import RateMeter, TokenBucket, rate_profiles
+from profiling import LoopLagMonitor, SamplingProfiler, StageTimer, format_profile
+from sampling import SmokeSpec
+from sources import plan_sources, shard_sources
+from templates import RequestTemplate
+from verdicts import VerdictCache, detection_fingerprint, parse_fingerprints
+from storage import (
+    PAYLOAD_ROW, RESULT_ROW, ResultRecord, connect, ensure_results_table, register_wafs, start_run, finish_run,
+    resumable_run, corpus_version_stored, mark_corpus_version, payload_id, flush_to_db, merge_results, prune_runs,
+)
+
+
+@contextlib.asynccontextmanager
+async def _streamed(response: httpx.Response):
+    """Close a response sent with stream=True, as client.stream() does."""
+    try:
+        yield response
+    finally:
+        await response.aclose()
+
+
+class _RequestTiming:
+    """httpx trace hook (rawhttp.py sets the same fields): when a new connection was set up and when response headers arrived."""
+
+    __slots__ = ("connect_start", "connect_end", "headers_at")
+
+    def __init__(self):
+        self.connect_start = self.connect_end = self.headers_at = None
+
+    async def __call__(self, event: str, info: dict):
+        if event == "connection.connect_tcp.started":
+            self.connect_start = time.perf_counter()
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            self.connect_end = time.perf_counter()
+        elif event.endswith(".receive_response_headers.complete"):
+            self.headers_at = time.perf_counter()
+
+    def connect_us(self):
+        """TCP (+TLS) setup time, or None when a pooled connection was reused."""
+        if self.connect_start is None or self.connect_end is None:
+            return None
+        return int((self.connect_end - self.connect_start) * 1e6)
+
+    def ttfb_us(self, t0: float):
+        return int((self.headers_at - t0) * 1e6) if self.headers_at is not None else None
+
+
+# -------------------- Runner --------------------
+
+class Wafs:
+    """Async HTTP runner with a single writer thread (batched inserts)."""
+
+    def __init__(self, wafs: dict | None = None):
+        self.wafs = WAFS_DICT if wafs is None else wafs
+        self.inverse_waf_dict = {v: k for k, v in self.wafs.items()}
+        self._lock = threading.Lock()
+
+        # ---- Tunables via env ----
+        # block detection (fast path skips body inspection)
+        self.fast_block_detection = os.getenv("FAST_BLOCK_DETECTION", "true").lower() in ("1", "true", "yes", "y")
+
+        # read payloads straight from the downloaded zips instead of extracting them
+        self.data_from_zip = os.getenv("DATA_FROM_ZIP", "false").lower() in ("1", "true", "yes", "y")
+
+        # statuses considered "blocked"
+        block_status_csv = os.getenv("BLOCK_STATUS", "403,406,429")
+        try:
+            self.block_status = {int(x.strip()) for x in block_status_csv.split(",") if x.strip()}
+        except Exception:
+            self.block_status = {403, 406, 429}
+
+        # phrases signaling a block page (used in slow path)
+        default_phrases = [
+            "The requested URL was rejected. Please consult with your administrator.",
+            "Request blocked by",
+            "Access denied",
+            "ModSecurity Action",
+            "403 Forbidden",
+        ]
+        extra_phrases = [p.strip() for p in os.getenv("BLOCK_PHRASES", "").split("||") if p.strip()]
+        self.block_phrases = default_phrases + extra_phrases
+
+        # learn each WAF's block page from the XSS probe of check_connections (see matcher.py)
+        self.block_calibration = os.getenv("BLOCK_CALIBRATION", "false").lower() in ("1", "true", "yes", "y")
+        self.block_signatures = {}  # WAF URL -> learned phrases
+
+        # limit how much body to peek in slow mode
+        self.peek_bytes = int(os.getenv("PEEK_BYTES", "2048"))
+
+        # HTTP timeouts
+        self.connect_t = float(os.getenv("HTTP_CONNECT_TIMEOUT", "4.0"))
+        self.read_t    = float(os.getenv("HTTP_READ_TIMEOUT",    "6.0"))
+        self.write_t   = float(os.getenv("HTTP_WRITE_TIMEOUT",   "4.0"))
+        self.pool_t    = float(os.getenv("HTTP_POOL_TIMEOUT",    "4.0"))
+
+        # Malicious-only timeouts & retry
+        self.mal_connect_t = float(os.getenv("MAL_HTTP_CONNECT_TIMEOUT", str(self.connect_t)))
+        self.mal_read_t    = float(os.getenv("MAL_HTTP_READ_TIMEOUT",    "10.0"))
+        self.mal_write_t   = float(os.getenv("MAL_HTTP_WRITE_TIMEOUT",   str(self.write_t)))
+        self.mal_retries   = int(os.getenv("MAL_HTTP_RETRIES",           "1"))
+
+        # Concurrency limits (the two per-WAF ones are ceilings for the adaptive limiter)
+        self.max_inflight       = int(os.getenv("ASYNC_MAX_INFLIGHT", "5000"))
+        self.sem_concurrency    = int(os.getenv("ASYNC_CONCURRENCY", "1500"))     # per WAF, for Legitimate
+        self.mal_sem_concurrency = int(os.getenv("MALICIOUS_CONCURRENCY", "1000")) # per WAF, smaller for Malicious
+
+        # Adaptive (AIMD) per-WAF concurrency; false keeps every WAF at the ceilings above
+        self.adaptive_concurrency = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() in ("1", "true", "yes", "y")
+        self.adaptive_initial     = int(os.getenv("ADAPTIVE_INITIAL_LIMIT", "32"))
+        self.adaptive_min         = int(os.getenv("ADAPTIVE_MIN_LIMIT", "16"))
+        self.adaptive_tolerance   = float(os.getenv("ADAPTIVE_LATENCY_TOLERANCE", "2.0"))  # x unloaded latency
+        self.adaptive_backoff     = float(os.getenv("ADAPTIVE_BACKOFF", "0.9"))
+        self.limit_log_interval   = float(os.getenv("LIMIT_LOG_INTERVAL", "30"))
+
+        # Open-loop load: per-WAF target requests/s (see pacing.py); empty = closed loop
+        self.target_rps        = os.getenv("TARGET_RPS", "")
+        self.target_rps_by_waf = os.getenv("TARGET_RPS_BY_WAF", "")
+        self.rps_burst         = float(os.getenv("RPS_BURST", "0"))  # tokens; 0 = 10 ms worth
+        self.rps_share         = 1
+        rate_profiles(self.wafs, self.target_rps, self.target_rps_by_waf)  # fail early on a bad spec
+
+        # Minimal HTTP/1.1 engine for the status-only fast path (see rawhttp.py):
+        # comma-separated WAF names or "all"; pipeline = requests in flight per connection
+        raw_wafs = os.getenv("RAW_HTTP_WAFS", "").strip()
+        self.raw_http_wafs = set(self.wafs) if raw_wafs.lower() == "all" else \
+            {n.strip() for n in raw_wafs.split(",") if n.strip()}
+        if self.raw_http_wafs - set(self.wafs):
+            raise ValueError(f"RAW_HTTP_WAFS names unknown WAFs: {sorted(self.raw_http_wafs - set(self.wafs))}")
+        self.raw_http_pipeline = int(os.getenv("RAW_HTTP_PIPELINE", "1"))
+
+        # Record connect time and time-to-first-byte per request (httpx trace hooks)
+        self.latency_trace = os.getenv("LATENCY_TRACE", "true").lower() in ("1", "true", "yes", "y")
+
+        # httpx protocol, pool size and client shards per WAF (see calibration.py)
+        self.calibration = Calibration(self.sem_concurrency)
+        self.client_overrides = profile_overrides(self.wafs, os.getenv("CLIENT_PROFILE_BY_WAF", ""))
+        self.client_profiles = {}   # WAF URL -> ClientProfile, resolved when the run's clients are made
+
+        # Run groups kept in the DB after each run; 0 keeps all (see storage.prune_runs)
+        self.keep_runs = int(os.getenv("KEEP_RUNS", "0"))
+
+        # Verdict cache: per-WAF config fingerprints; results of unchanged WAFs are reused (see verdicts.py)
+        self.waf_fingerprints = parse_fingerprints(self.wafs, os.getenv("WAF_FINGERPRINTS", ""))
+
+        # Keep-alive connections opened per WAF (and engine) before the timed run; 0 = cold start
+        self.warm_connections = int(os.getenv("WARM_CONNECTIONS", "32"))
+
+        # Per-stage timers and loop lag (end-of-run profile, metrics); optional stack sampling
+        self.stages = StageTimer()
+        self.process_name = "main"
+        self.profile_output = os.getenv("PROFILE_OUTPUT", "")          # collapsed stacks file
+        self.profile_interval = float(os.getenv("PROFILE_INTERVAL", "5")) / 1000   # ms between samples
+
+        # Live Prometheus-style metrics endpoint (0 = off)
+        self.metrics_port = int(os.getenv("METRICS_PORT", "0"))
+        self.metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+        self.metrics = Metrics()
+
+        # Writer commits (= resume checkpoints) at least this often, in seconds
+        self.checkpoint_interval = float(os.getenv("CHECKPOINT_INTERVAL", "2.0"))
+        self.writer_batch_size = int(os.getenv("WRITER_BATCH_SIZE", "10000"))   # most rows per commit
+
+    def scale_concurrency(self, share: int):
+        """Give this process 1/share of the configured concurrency (used by --workers)."""
+        self.max_inflight        = max(1, -(-self.max_inflight // share))
+        self.sem_concurrency     = max(1, -(-self.sem_concurrency // share))
+        self.mal_sem_concurrency = max(1, -(-self.mal_sem_concurrency // share))
+        self.adaptive_initial    = max(1, -(-self.adaptive_initial // share))
+        self.warm_connections    = -(-self.warm_connections // share)
+        self.rps_share           = share
+
+    def matcher_for(self, url) -> BlockMatcher:
+        """Block phrases for one WAF: its learned signature first, then the configured ones."""
+        return BlockMatcher(self.block_signatures.get(url, []) + self.block_phrases)
+
+    def detection_settings(self, url) -> dict:
+        """Everything that decides `blocked` for one WAF (part of its verdict cache key)."""
+        return {
+            "block_status": sorted(self.block_status),
+            "phrases": self.block_signatures.get(url, []) + self.block_phrases,
+            "fast_block_detection": self.fast_block_detection,
+            "peek_bytes": self.peek_bytes,
+        }
+
+    def get_waf_name_by_url(self, url):
+        return self.inverse_waf_dict[url]
+
+    @contextlib.asynccontextmanager
+    async def _http_clients(self, check: bool = True, warm: bool = True):
+        """
+        The run's clients, ({url: [httpx clients]}, {url: raw engine}). With
+        check, each WAF's client profile is resolved (calibrated if needed) and
+        the health and functionality checks run on the clients, for all WAFs
+        at once; their pools are pre-warmed so the timed run starts on open
+        connections. Without check (workers) self.client_profiles must be set.
+        """
+        default_timeouts = httpx.Timeout(connect=self.connect_t, read=self.read_t, write=self.write_t, pool=self.pool_t)
+        if check:
+            self.client_profiles = await resolve_profiles(self.wafs, self.calibration, self.client_overrides,
+                                                          default_timeouts)
+        clients = {url: self.client_profiles.get(url, ClientProfile()).make_clients(default_timeouts)
+                   for url in self.wafs.values()}
+        raw_clients = {}
+        if self.fast_block_detection:
+            for waf_name in self.raw_http_wafs & set(self.wafs):
+                url = self.wafs[waf_name]
+                # Same connection budget as the URL's httpx clients (already scaled per worker)
+                pool = self.client_profiles.get(url, ClientProfile()).max_connections
+                raw_clients[url] = RawHTTPClient(url, max_connections=pool, pipeline=self.raw_http_pipeline,
+                                                 connect_timeout=self.connect_t, read_timeout=self.read_t)
+                log.info(f"Fast path of {waf_name} uses the raw HTTP/1.1 engine (pipeline {self.raw_http_pipeline})")
+        try:
+            if check:
+                await self.check_connections(clients)
+            if warm and self.warm_connections > 0:
+                await asyncio.gather(*(self._warm(name, url, clients[url], raw_clients.get(url))
+                                       for name, url in self.wafs.items()))
+            yield clients, raw_clients
+        finally:
+            # Always close clients, even on Ctrl-C
+            await asyncio.gather(*(c.aclose() for c in [*sum(clients.values(), []), *raw_clients.values()]),
+                                 return_exceptions=True)
+
+    async def check_connections(self, clients: dict):
+        """Health and functionality checks of every WAF, concurrently, on the run's clients."""
+        log.info(f"Starting run. DB={DB_PATH}  Hosts={list(self.wafs.keys())}")
+        passed = await asyncio.gather(*(self._check_waf(name, url, clients[url][0]) for name, url in self.wafs.items()))
+        if not all(passed):
+            raise ConnectionError("Connectivity/WAF checks failed; fix config and re-run.")
+        log.info("All connectivity tests passed.")
+
+    async def _check_waf(self, name: str, url: str, client: httpx.AsyncClient) -> bool:
+        normal_page = b""
+        try:
+            r = await client.get(url, timeout=3)
+            normal_page = r.content[: self.peek_bytes]
+            if r.status_code != 200:
+                log.error(f"Health check failed - WAF: {name} - please allow: {url} (status={r.status_code})")
+                return False
+            log.info(f"Health check passed - WAF: {name} ({r.http_version})")
+            if self.client_profiles[url].http2 and r.http_version != "HTTP/2":
+                log.info(f"WAF {name}: HTTP/2 requested, but {url} answered over {r.http_version}")
+        except Exception as e:
+            log.error(f"Health check failed - WAF: {name} - {e}")
+            return False
+
+        # WAF functionality verification (basic XSS should be blocked)
+        try:
+            r = await client.get(url + "/?a=<script>alert(1)</script>", timeout=3)
+            body = r.content[: self.peek_bytes]
+            blocked = (r.status_code in self.block_status) or self.matcher_for(url).search(body) is not None
+            if not blocked:
+                log.error(f"WAF functionality check failed - WAF: {name} - should block basic XSS")
+                return False
+            log.info(f"WAF functionality check passed - WAF: {name}")
+            if self.block_calibration and body:
+                signature = learn_signature(body, normal_page)
+                if signature:
+                    self.block_signatures[url] = [signature]
+                    log.info(f"Learned block page signature - WAF: {name}: {signature!r}")
+        except Exception as e:
+            log.error(f"WAF functionality check (malicious) failed - WAF: {name} - {e}")
+            return False
+        return True
+
+    async def _warm(self, name: str, url: str, shards: list, raw: RawHTTPClient = None):
+        """Open warm_connections keep-alive connections to one WAF (over its client shards) with as many requests."""
+        n = self.warm_connections
+        t0 = time.perf_counter()
+        responses = await asyncio.gather(*(shards[i % len(shards)].get(url, timeout=3) for i in range(n)),
+                                         return_exceptions=True)
+        ok = [r for r in responses if isinstance(r, httpx.Response)]
+        protocols = sorted({r.http_version for r in ok})
+        if raw is not None:
+            template = RequestTemplate.build("GET", "/", {}, None, shards[0].headers)
+            raw_ok = await asyncio.gather(*(raw.status(template, read_timeout=3) for _ in range(n)), return_exceptions=True)
+            ok += [s for s in raw_ok if isinstance(s, int)]
+            protocols.append("raw HTTP/1.1")
+        log.info(f"Pre-warmed {name}: {len(ok)}/{n * (2 if raw else 1)} requests answered over "
+                 f"{', '.join(protocols) or 'no connection'} in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    async def send_payloads_async(self, workers: int = 1, resume: bool = False):
+        """
+        Async HTTP scheduler with backpressure feeding a writer thread.
+        Each call is a new run unless resume picks up this machine's unfinished
+        one, in which case only the (payload, WAF) pairs it lacks are sent.
+        """
+        if not self.wafs:
+            log.warning("WAFS_DICT is empty, skipping payload send step.")
+            return
+        if workers > 1:
+            # Checked once here; every worker warms clients of its own
+            async with self._http_clients(warm=False):
+                pass
+            await self._send_payloads(workers, resume, None)
+        else:
+            async with self._http_clients() as http:
+                await self._send_payloads(workers, resume, http)
+
+    async def _send_payloads(self, workers: int, resume: bool, http):
+        # Results of earlier runs are kept; the view shows the newest run group
+        ensure_results_table()
+
+        # --- plan payload sources; totals come from the manifest (no pre-parse) ---
+        smoke = SmokeSpec.from_env()
+        plan = plan_sources(from_zip=self.data_from_zip, smoke=smoke)
+
+        run_id = None
+        if resume:
+            run_id = resumable_run(socket.gethostname(), plan.version)
+        # Learned block signatures are known by now (check_connections)
+        fingerprints = {url: detection_fingerprint(fingerprint, self.detection_settings(url))
+                        for url, fingerprint in self.waf_fingerprints.items()}
+        # Payload text goes to the DB once per corpus version, results reference it by id
+        run = {
+            "run_id": run_id or start_run(socket.gethostname(), plan.version),
+            "waf_ids": register_wafs(self.wafs),
+            "write_payloads": not corpus_version_stored(plan.version),
+            "completed": CompletedPairs.load(run_id) if run_id else None,
+            "verdicts": VerdictCache.load(fingerprints) if fingerprints else None,
+        }
+        already_done = run["completed"].total if run_id else 0
+        if run_id:
+            log.info(f"Resuming run {run_id}: {already_done} requests already done")
+        total_payloads = plan.total_payloads
+        total_requests = total_payloads * len(self.wafs) if total_payloads is not None else None
+        log.info(f"Submitting & running payloads: {already_done} / {total_requests if total_requests is not None else '?'}")
+
+        q, close_writer = self._start_writer(DB_PATH, self.checkpoint_interval, self.metrics, self.stages,
+                                             self.writer_batch_size)
+        metrics_server = self._serve_metrics()
+        profiler = self._start_profiling()
+        started = time.perf_counter()
+
+        # Drive the loop with a simple percentage bar + x/total logging
+        processed = already_done
+        completed = False
+        last_log_time = time.time()
+        try:
+            with tqdm(total=total_requests, initial=already_done, desc="Submitting & running payloads", unit="req") as pbar:
+                def on_submit(n):
+                    nonlocal processed, last_log_time
+                    processed += n
+                    pbar.update(n)
+                    self.metrics.inc("runner_requests_submitted_total", n=n)
+                    # log every 5 seconds
+                    now = time.time()
+                    if now - last_log_time >= 5 or processed == total_requests:
+                        log.info(f"Submitting & running payloads: {processed} / {total_requests or '?'}")
+                        last_log_time = now
+
+                if workers > 1:
+                    completed = await asyncio.to_thread(
+                        self._run_workers, plan, run, workers, smoke, q.put, on_submit
+                    )
+                else:
+                    await self._drive(plan, None, run, q.put, on_submit, http)
+                    completed = True
+        finally:
+            # Always stop the writer, even on Ctrl-C
+            close_writer()
+            plan.close()
+            if run["verdicts"]:
+                self._store_verdicts(run)
+            if metrics_server:
+                metrics_server.shutdown()
+            self._log_profile(time.perf_counter() - started, profiler)
+
+        if completed:
+            finish_run(run["run_id"])
+            if run["write_payloads"] and plan.version:
+                mark_corpus_version(plan.version, total_payloads)
+
+        # Quick DB snapshot (optional, concise)
+        self._print_db_counts(run["run_id"])
+
+    def _store_verdicts(self, run):
+        """Log the cache hits of the run and save what it sent to the verdict cache."""
+        hits = {dict(labels)["waf"]: int(n) for (name, labels), n in self.metrics.totals().items()
+                if name == "runner_verdict_cache_hits_total"}
+        for url in run["verdicts"].fingerprints:
+            name = self.get_waf_name_by_url(url)
+            log.info(f"Verdict cache: {hits.get(name, 0)} results of {name} reused")
+        stored = run["verdicts"].store(run["run_id"], run["waf_ids"])
+        log.info(f"Verdict cache: stored {stored} new results")
+
+    def _start_profiling(self, suffix=""):
+        """Publish this process's stage timers; start the stack sampler if PROFILE_OUTPUT is set."""
+        self.stages.publish(self.metrics, self.process_name)
+        if not self.profile_output:
+            return None
+        return SamplingProfiler(self.profile_output + suffix, self.profile_interval).start()
+
+    def _log_profile(self, wall: float, profiler=None):
+        log.info(f"=== Run profile ({wall:.1f}s wall, all processes) ===")
+        for line in format_profile(self.metrics.totals(), wall):
+            log.info(line)
+        if profiler:
+            profiler.stop()
+            log.info(f"Stack samples written to {profiler.path} (collapsed format, e.g. for flamegraph.pl)")
+
+    def _serve_metrics(self):
+        if not self.metrics_port:
+            return None
+        return serve_metrics(self.metrics, self.metrics_port, self.metrics_host)
+
+    @staticmethod
+    def _start_writer(db_path, checkpoint_interval: float = 2.0, metrics=None, stages=None,
+                      batch_size: int = 10000):
+        """
+        Start the single writer thread; returns (queue, close) where close()
+        flushes and joins. Group commit: each transaction takes every row
+        already queued, up to batch_size, and no row waits longer than
+        checkpoint_interval for its commit. Every commit is a checkpoint that
+        --resume builds on.
+        """
+        q = queue.Queue(maxsize=batch_size)
+        stop = object()
+        metrics = metrics or Metrics()
+        metrics.set("runner_writer_backlog", (), q.qsize)
+        commit_latency = LatencyHistogram()
+        metrics.set("runner_commit_p99_seconds", (), lambda: (commit_latency.percentile(99) or 0) / 1e6)
+        metrics.set("runner_commit_max_seconds", (), lambda: (commit_latency.max_value or 0) / 1e6)
+        committed = 0
+
+        def writer():
+            nonlocal committed
+            local = connect(db_path)
+            try:
+                buf = []
+                deadline = None         # commit due for the oldest buffered row
+                stopping = False
+                while not stopping:
+                    try:
+                        item = q.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        item = None
+                    while item is not None:
+                        if item is stop:
+                            stopping = True
+                            break
+                        buf.append(item)
+                        if deadline is None:
+                            deadline = time.monotonic() + checkpoint_interval
+                        if len(buf) >= batch_size:
+                            break
+                        try:
+                            item = q.get_nowait()
+                        except queue.Empty:
+                            item = None
+                    if buf and (stopping or len(buf) >= batch_size or time.monotonic() >= deadline):
+                        n = flush_to_db(buf, local, stages, commit_latency)
+                        committed += n
+                        metrics.inc("runner_rows_committed_total", n=n)
+                        metrics.inc("runner_commits_total")
+                        buf.clear()
+                        deadline = None
+            finally:
+                local.close()
+
+        wt = threading.Thread(target=writer, daemon=True)
+        wt.start()
+
+        def close():
+            q.put(stop)
+            wt.join(timeout=30)
+            commits = commit_latency.total
+            if commits:
+                log.info(f"Writer: {committed} rows in {commits} commits ({committed / commits:.0f} rows/commit), "
+                         f"commit p50 {commit_latency.percentile(50) / 1000:.1f} ms, "
+                         f"p99 {commit_latency.percentile(99) / 1000:.1f} ms, max {commit_latency.max_value / 1000:.1f} ms")
+
+        return q, close
+
+    async def run_agent_async(self, coordinator_url: str, name: str, out_path=None):
+        """
+        Agent mode: lease shards from a coordinator until none are left and
+        write their results to a self-contained file tagged with `name`.
+        """
+        client = CoordinatorClient(coordinator_url, name)
+        info = client.info
+        self.wafs = info["wafs"]
+        self.inverse_waf_dict = {v: k for k, v in self.wafs.items()}
+        self.data_from_zip = info["data_from_zip"]
+
+        plan = plan_sources(from_zip=self.data_from_zip, smoke=SmokeSpec.from_dict(info.get("smoke")))
+        if plan.version != info["corpus_version"]:
+            plan.close()
+            client.close()
+            raise RuntimeError(f"Local corpus {plan.version} differs from the coordinator's {info['corpus_version']}")
+
+        out_path = Path(out_path) if out_path else DB_PATH.parent / f"results_{name}.db"
+        ensure_results_table(fresh=True, db_path=out_path)
+        run = {
+            "run_id": start_run(name, plan.version, db_path=out_path),
+            "waf_ids": register_wafs(self.wafs, db_path=out_path),
+            "write_payloads": True,     # results files are self-contained
+            "completed": None,
+        }
+        self.process_name = "agent"
+        q, close_writer = self._start_writer(out_path, self.checkpoint_interval, self.metrics, self.stages,
+                                             self.writer_batch_size)
+        metrics_server = self._serve_metrics()
+        profiler = self._start_profiling()
+        started = time.perf_counter()
+        sent = 0
+
+        def on_submit(n):
+            nonlocal sent
+            sent += n
+            self.metrics.inc("runner_requests_submitted_total", n=n)
+
+        try:
+            # One set of checked, warm clients for every shard leased
+            async with self._http_clients() as http:
+                while True:
+                    lease = client.lease()
+                    if lease["shard"] is None:
+                        if lease.get("retry"):
+                            # Other agents still hold leases; their shards may come back
+                            await asyncio.sleep(lease["retry"])
+                            continue
+                        break
+                    units = [tuple(u) for u in lease["units"]]
+                    log.info(f"Agent {name}: running shard {lease['shard']} ({len(units)} units)")
+                    await self._drive(plan, units, run, q.put, on_submit, http)
+                    client.complete(lease["shard"])
+        finally:
+            close_writer()
+            plan.close()
+            if metrics_server:
+                metrics_server.shutdown()
+            self._log_profile(time.perf_counter() - started, profiler)
+        finish_run(run["run_id"], db_path=out_path)
+        client.finish(str(out_path.resolve()))
+        client.close()
+        log.info(f"Agent {name}: sent {sent} requests, results in {out_path}")
+
+    async def _drive(self, plan, units, run, emit, on_submit, http):
+        """
+        Send every (payload, WAF) pair of `units` -- (source_index, start, stop)
+        tuples, or all of plan.sources when None -- and hand tagged rows to emit().
+        Pairs in run["completed"] (a resumed run) are skipped, and pairs in
+        run["verdicts"] are answered from the cache. http: the (clients, raw
+        engines) of _http_clients().
+        """
+        run_id, waf_ids, write_payloads = run["run_id"], run["waf_ids"], run["write_payloads"]
+        completed, verdicts = run["completed"], run.get("verdicts")
+        if units is None:
+            units = [(i, 0, None) for i in range(len(plan.sources))]
+
+        # Async clients per WAF
+        clients, raw_clients = http
+        default_timeouts = httpx.Timeout(connect=self.connect_t, read=self.read_t, write=self.write_t, pool=self.pool_t)
+        mal_timeouts     = httpx.Timeout(connect=self.mal_connect_t, read=self.mal_read_t, write=self.mal_write_t, pool=self.pool_t)
+        matchers = {url: self.matcher_for(url) for url in self.wafs.values()}
+        base_headers = next(iter(clients.values()))[0].headers  # httpx defaults, the same for every client
+        shard_cycles = {url: itertools.cycle(shards) for url, shards in clients.items()}
+
+        # ---------------- Request worker ----------------
+
+        async def one_request(
+            client: httpx.AsyncClient,
+            template: RequestTemplate,
+            base_url: str,
+            inspect_body: bool,
+            timeouts: httpx.Timeout,
+            retries: int,
+            matcher: BlockMatcher,
+            trace=None,
+            raw: RawHTTPClient = None,
+        ):
+            extensions = {"timeout": timeouts.as_dict()}
+            if trace is not None:
+                extensions["trace"] = trace
+            attempt = 0
+            while True:
+                try:
+                    if raw is not None and self.fast_block_detection and not inspect_body:
+                        # FAST path on the raw engine: status line only
+                        status = await raw.status(template, trace, timeouts.read)
+                        return status, status in self.block_status, ""
+                    request = template.request(base_url, client, extensions)
+                    if self.fast_block_detection and not inspect_body:
+                        # FAST path: status-only
+                        r = await client.send(request)
+                        blocked = (r.status_code in self.block_status)
+                        return r.status_code, blocked, ""
+                    else:
+                        # SLOW path: do not read full body; peek only up to self.peek_bytes
+                        async with _streamed(await client.send(request, stream=True)) as r:
+                            status = r.status_code
+                            if status in self.block_status:
+                                return status, True, ""
+
+                            # Search chunks as they arrive, up to peek_bytes; stop at the first match
+                            scan = matcher.scanner()
+                            blocked = False
+                            total = 0
+                            chunks = []
+                            try:
+                                async for chunk in r.aiter_bytes():
+                                    if not chunk:
+                                        break
+                                    chunks.append(chunk)
+                                    if scan.feed(chunk[: self.peek_bytes - total]):
+                                        blocked = True
+                                        break
+                                    total += len(chunk)
+                                    if total >= self.peek_bytes:
+                                        break
+                            except (httpx.ReadTimeout, httpx.TimeoutException):
+                                pass
+
+                            text = (b"".join(chunks)[: self.peek_bytes]).decode("utf-8", "ignore") if chunks else ""
+                            return status, blocked, text
+                except (httpx.ConnectTimeout, httpx.ReadTimeout, httpx.WriteTimeout,
+                        httpx.TimeoutException, httpx.RemoteProtocolError):
+                    attempt += 1
+                    if attempt > retries:
+                        return 0, False, "REQUEST FAILED OR TIMED OUT"
+                    await asyncio.sleep(0.05 * attempt)  # tiny backoff
+                except Exception:
+                    return 0, False, "REQUEST FAILED OR TIMED OUT"
+
+        # Open loop: a token bucket per WAF paces sending; this process sends 1/rps_share of the target.
+        # The rate a paced WAF actually got (meters) is what its rows record.
+        buckets, meters = {}, {}
+        for waf_name, profile in rate_profiles(self.wafs, self.target_rps, self.target_rps_by_waf).items():
+            buckets[self.wafs[waf_name]] = TokenBucket(profile.scaled(1 / self.rps_share), self.rps_burst)
+            meters[self.wafs[waf_name]] = RateMeter()
+            log.info(f"Open-loop load for {waf_name}: {profile}")
+
+        # Concurrency & backpressure: one limiter per (WAF, Malicious?) pair.
+        # Paced WAFs keep fixed limits: adapting them would close the loop again.
+        MAX_INFLIGHT = self.max_inflight
+        lag = LoopLagMonitor()
+        limiters = {}
+        for waf_name, url in self.wafs.items():
+            for malicious, ceiling in ((False, self.sem_concurrency), (True, self.mal_sem_concurrency)):
+                limiters[(url, malicious)] = AIMDLimiter(
+                    f"{waf_name} [{'Malicious' if malicious else 'Legitimate'}]",
+                    initial=self.adaptive_initial, min_limit=min(self.adaptive_min, ceiling), max_limit=ceiling,
+                    adaptive=self.adaptive_concurrency and url not in buckets,
+                    backoff=self.adaptive_backoff, tolerance=self.adaptive_tolerance,
+                    loop_lag=lambda: lag.recent,
+                )
+        # Feeders: every paced WAF reads the corpus on its own, at its own rate, so a
+        # slow target cannot hold back the others; the unpaced WAFs share one feeder.
+        # Each gets its share of ASYNC_MAX_INFLIGHT.
+        unpaced = [url for url in self.wafs.values() if url not in buckets]
+        groups = ([unpaced] if unpaced else []) + [[url] for url in buckets]
+        pendings = [set() for _ in groups]
+
+        # Live metrics, labelled per (WAF, data set), and stage timers (profiling.py)
+        metrics = self.metrics
+        stages = self.stages
+        perf = time.perf_counter
+        metric_labels = {}
+        metrics.set("runner_pending_tasks", (), lambda: sum(len(p) for p in pendings))
+        for (url, malicious), limiter in limiters.items():
+            labels = (("waf", self.get_waf_name_by_url(url)), ("dataset", "Malicious" if malicious else "Legitimate"))
+            metrics.set("waf_concurrency_limit", labels, lambda limiter=limiter: int(limiter.limit))
+
+        def log_limits(final=False):
+            for limiter in limiters.values():
+                if limiter.samples:
+                    log.info(("Final concurrency " if final else "Concurrency ") + limiter.describe())
+            for url, bucket in buckets.items():
+                log.info(f"{'Final load' if final else 'Load'} {self.get_waf_name_by_url(url)}: {bucket.describe()}")
+
+        async def report_limits():
+            while True:
+                await asyncio.sleep(self.limit_log_interval)
+                log_limits()
+
+        async def schedule(template, pid, base_url, client, test):
+            dataset_type = test[0]
+
+            # Force body inspection for Malicious to catch non-403 block pages,
+            # while keeping fast detection for Legitimate
+            inspect_body = (dataset_type.lower() == "malicious")
+
+            limiter  = limiters[(base_url, inspect_body)]
+            timeouts = mal_timeouts if inspect_body else default_timeouts
+            retries  = self.mal_retries if inspect_body else 0
+
+            timing = _RequestTiming() if self.latency_trace else None
+            labels = metric_labels.get((base_url, dataset_type))
+            if labels is None:
+                labels = metric_labels[(base_url, dataset_type)] = (
+                    ("waf", self.get_waf_name_by_url(base_url)), ("dataset", dataset_type))
+
+            t = perf()
+            async with limiter.slot() as slot:
+                metrics.inc("waf_requests_sent_total", labels)
+                metrics.inc("waf_inflight_requests", labels)
+                t0 = perf()
+                stages.add("wait_limiter", t0 - t)
+                achieved_rps = meters[base_url].tick(t0) if base_url in meters else None
+                if achieved_rps is not None:
+                    achieved_rps = round(achieved_rps * self.rps_share)
+                try:
+                    status, blocked, body = await one_request(
+                        client, template, base_url, inspect_body, timeouts, retries,
+                        matchers[base_url], timing, raw_clients.get(base_url)
+                    )
+                finally:
+                    metrics.inc("waf_inflight_requests", labels, -1)
+                latency = perf() - t0
+                latency_us = int(latency * 1e6)
+                stages.add("request", latency)
+                slot.done(failed=(status == 0))
+
+            metrics.inc("waf_responses_total", labels + (("class", status_class(status)),))
+            metrics.inc("waf_response_seconds_sum", labels, latency_us / 1e6)
+            if blocked:
+                metrics.inc("waf_blocked_total", labels)
+            if status == 0:
+                metrics.inc("waf_failures_total", labels)
+
+            t = perf()
+            emit((RESULT_ROW, ResultRecord(
+                run_id, pid, waf_ids[base_url], int(status), int(bool(blocked)), latency_us, achieved_rps,
+                timing.ttfb_us(t0) if timing else None,
+                timing.connect_us() if timing else None,
+                test,
+                body if status != 0 else None,
+            )))
+            stages.add("enqueue", perf() - t)
+
+        async def feed(urls, pending, inflight):
+            """
+            Send every pair of `units` for the WAFs in urls; a paced WAF (alone in its feeder) takes a token first.
+            Every feeder emits the payload rows it sends (INSERT OR IGNORE keeps one): a paced
+            feeder may run ahead of the others, and its results must not be committed before their payloads.
+            """
+            bucket = buckets.get(urls[0]) if len(urls) == 1 else None
+            feeder_cycles = [(u, shard_cycles[u]) for u in urls]
+            # Set when the window has room again; asyncio.wait over thousands of pending
+            # tasks on every wake-up would cost the loop O(window) each time
+            room = asyncio.Event()
+
+            def finished(task):
+                pending.discard(task)
+                if len(pending) < inflight:
+                    room.set()
+            for i, start, stop in units:
+                source = plan.sources[i]
+                dataset_type, test_name = source.path.parent.stem, source.path.stem
+                test = (dataset_type, test_name)
+                targets = feeder_cycles
+                if completed is not None and not source.indexed:
+                    end = stop if stop is not None else source.count
+                    if end is not None and all(completed.range_done(test, waf_ids[u], start, end) for u in urls):
+                        continue
+                items = stages.timed_iter("parse", source.open(start, stop))
+                # Samples yield each payload's index in its file, so ids match a full run
+                for index, payload in (items if source.indexed else enumerate(items, start)):
+                    t_sched = perf()
+                    if completed is not None:
+                        targets = [(u, c) for u, c in feeder_cycles if not completed.done(test, waf_ids[u], index)]
+                        if not targets:
+                            continue
+                    method, url = str(payload["method"]), str(payload["url"])
+                    headers, data = normalize_headers(payload.get("headers")), payload.get("data")
+                    pid = payload_id(dataset_type, test_name, index, method, url, headers, data)
+                    if write_payloads:
+                        emit((PAYLOAD_ROW, (pid, dataset_type, test_name, index, method, url, headers, data)))
+                    # Prepared once, sent to every WAF of the feeder
+                    template = RequestTemplate.build(method, url, headers, data, base_headers)
+
+                    for base_url, shards in targets:
+                        if verdicts is not None:
+                            cached = verdicts.get(base_url, pid)
+                            if cached is not None:
+                                emit((RESULT_ROW, ResultRecord(run_id, pid, waf_ids[base_url], *cached,
+                                                               None, None, None, None, test, None)))
+                                metrics.inc("runner_verdict_cache_hits_total",
+                                            (("waf", self.get_waf_name_by_url(base_url)),))
+                                on_submit(1)
+                                continue
+                        if bucket is not None:
+                            # Waiting tasks would fill the pending window: the token comes first
+                            t_wait = perf()
+                            stages.add("schedule", t_wait - t_sched, 0)
+                            await bucket.take()
+                            t_sched = perf()
+                            stages.add("wait_rate", t_sched - t_wait)
+                        task = asyncio.create_task(schedule(template, pid, base_url, next(shards), test))
+                        pending.add(task)
+                        task.add_done_callback(finished)
+                        on_submit(1)
+
+                        if len(pending) >= inflight:
+                            t_wait = perf()
+                            stages.add("schedule", t_wait - t_sched, 0)
+                            room.clear()
+                            await room.wait()
+                            t_sched = perf()
+                            stages.add("wait_inflight", t_sched - t_wait)
+                    stages.add("schedule", perf() - t_sched)
+
+            # drain remaining
+            if pending:
+                await asyncio.wait(set(pending))
+
+        lag.publish(metrics, self.process_name)
+        monitors = [asyncio.create_task(report_limits()), asyncio.create_task(lag.run())]
+        feeders = [asyncio.create_task(feed(urls, pending, max(1, MAX_INFLIGHT * len(urls) // len(self.wafs))))
+                   for urls, pending in zip(groups, pendings)]
+        try:
+            await asyncio.gather(*feeders)
+        finally:
+            for task in feeders + monitors:
+                task.cancel()
+            log_limits(final=True)
+
+    async def _drive_warm(self, plan, units, run, emit, on_submit):
+        """_drive on freshly warmed clients (the parent already ran the checks)."""
+        async with self._http_clients(check=False) as http:
+            await self._drive(plan, units, run, emit, on_submit, http)
+
+    def _run_workers(self, plan, run, workers, smoke, emit, on_submit) -> bool:
+        """
+        Fan the run out over `workers` processes, each with its own event loop
+        and httpx clients. Their rows come back in batches and go to the single
+        writer; submit counts feed the shared progress bar.
+        Returns True when every worker finished its shard.
+        """
+        ctx = multiprocessing.get_context("spawn")
+        out_q = ctx.Queue(maxsize=256)
+        shards = [shard for shard in shard_sources(plan.sources, workers) if shard]
+        procs = [
+            ctx.Process(
+                target=_worker_main,
+                args=(i, dict(self.wafs), shard, run, self.data_from_zip, smoke, len(shards),
+                      self.block_signatures, self.client_profiles, out_q),
+                daemon=True,
+            )
+            for i, shard in enumerate(shards)
+        ]
+        for p in procs:
+            p.start()
+        log.info(f"Started {len(procs)} worker processes")
+
+        finished = set()
+        while len(finished) < len(procs):
+            try:
+                kind, index, submitted, rows, snapshot, zip_counts = out_q.get(timeout=1)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs):
+                    break
+                continue
+            self.metrics.absorb(index, snapshot)
+            for row in rows:
+                emit(row)
+            if submitted:
+                on_submit(submitted)
+            if kind == "done":
+                finished.add(index)
+                # Counted by the worker, saved by plan.close() once the run ends
+                plan.zip_counts.update(zip_counts or {})
+
+        for p in procs:
+            p.join(timeout=5)
+        for i, p in enumerate(procs):
+            if i not in finished:
+                log.error(f"Worker {i} did not finish its shard (exit code {p.exitcode})")
+        return len(finished) == len(procs)
+
+    @staticmethod
+    def _print_db_counts(run_id):
+        c = connect()
+        try:
+            rows = c.execute("""
+              SELECT w.WAF_Name,
+                     SUM(CASE WHEN r.status!=0 THEN 1 ELSE 0 END) AS nonzero,
+                     COUNT(*) AS total,
+                     SUM(CASE WHEN r.status=403 THEN 1 ELSE 0 END) AS blocks_403,
+                     SUM(r.blocked) AS blocks_detected
+              FROM results r JOIN wafs w ON w.waf_id = r.waf_id
+              WHERE r.run_id = ?
+              GROUP BY w.WAF_Name
+            """, (run_id,)).fetchall()
+
+            per_ds = c.execute("""
+              SELECT w.WAF_Name, rc.DataSetType,
+                     SUM(rc.blocked + rc.passed) AS nonzero,
+                     SUM(rc.blocked) AS detected_blocks
+              FROM result_counts rc
+              JOIN wafs w ON w.waf_id = rc.waf_id
+              WHERE rc.run_id = ?
+              GROUP BY w.WAF_Name, rc.DataSetType
+              ORDER BY w.WAF_Name, rc.DataSetType
+            """, (run_id,)).fetchall()
+        finally:
+            c.close()
+
+        log.info("=== DB Results Snapshot ===")
+        for name, nonzero, total, blocks_403, blocks_detected in rows:
+            log.info(f"WAF {name}: non-zero={nonzero}/{total}  403={blocks_403}  detected_blocks={blocks_detected}")
+
+        for name, ds, nonzero, detected in per_ds:
+            log.info(f"    -> {name} [{ds}]: non-zero={nonzero}  detected_blocks={detected}")
+
+# -------------------- Worker processes (--workers N) --------------------
+
+class _WorkerSink:
+    """Batches a worker's rows, submit counts and metrics snapshot for the parent process."""
+
+    def __init__(self, index, out_q, metrics, batch_size=500, interval=0.5):
+        self.index = index
+        self.out_q = out_q
+        self.metrics = metrics
+        self.batch_size = batch_size
+        self.interval = interval
+        self.rows = []
+        self.submitted = 0
+        self.last_flush = time.monotonic()
+
+    def emit(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size or time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def on_submit(self, n):
+        self.submitted += n
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.flush()
+
+    def flush(self, kind="rows", zip_counts=None):
+        self.out_q.put((kind, self.index, self.submitted, self.rows, self.metrics.snapshot(), zip_counts))
+        self.rows = []
+        self.submitted = 0
+        self.last_flush = time.monotonic()
+
+
+def _worker_main(index, wafs, units, run, data_from_zip, smoke, share, block_signatures, client_profiles, out_q):
+    """Entry point of one worker process: its own plan, event loop and clients."""
+    runner = Wafs(wafs)
+    runner.scale_concurrency(share)
+    runner.block_signatures = block_signatures
+    runner.client_profiles = {url: profile.scaled(share) for url, profile in client_profiles.items()}
+    runner.process_name = f"worker-{index}"
+    plan = plan_sources(from_zip=data_from_zip, smoke=smoke)
+    sink = _WorkerSink(index, out_q, runner.metrics)
+    profiler = runner._start_profiling(f".{runner.process_name}")
+    try:
+        asyncio.run(runner._drive_warm(plan, units, run, sink.emit, sink.on_submit))
+    except BaseException:
+        sink.flush()
+        raise
+    else:
+        sink.flush("done", plan.zip_counts)
+    finally:
+        plan.close(save=False)
+        if profiler:
+            profiler.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WAF Comparison Runner")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("RUNNER_WORKERS", "1")),
+                        help="number of sender processes (default: 1, or RUNNER_WORKERS)")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue this machine's last unfinished run, sending only what it lacks")
+    sub = parser.add_subparsers(dest="command")
+
+    p_coord = sub.add_parser("coordinator", help="serve a shard plan to agents, then merge their results")
+    p_coord.add_argument("--listen", default="127.0.0.1:8765", help="host:port to listen on")
+    p_coord.add_argument("--shards", type=int, default=16, help="number of shards to split the corpus into")
+    p_coord.add_argument("--no-merge", action="store_true", help="only collect results file paths")
+    p_coord.add_argument("--lease-timeout", type=float, default=300.0,
+                         help="seconds without a heartbeat before an agent is dropped and its shards re-queued")
+    p_coord.add_argument("--timeout", type=float, default=0,
+                         help="stop after this many seconds and merge the finished agents' results (default: no limit)")
+
+    p_agent = sub.add_parser("agent", help="send shards leased from a coordinator")
+    p_agent.add_argument("--coordinator", required=True, help="coordinator URL, e.g. http://10.0.0.5:8765")
+    p_agent.add_argument("--name", default=socket.gethostname(), help="machineName recorded for this agent")
+    p_agent.add_argument("--out", default=None, help="results file (default: results_<name>.db next to the DB)")
+
+    p_merge = sub.add_parser("merge", help="merge agent results files into the analyzer DB")
+    p_merge.add_argument("files", nargs="+")
+    p_merge.add_argument("--append", action="store_true", help="add to the latest run group instead of starting a new one")
+
+    p_prune = sub.add_parser("prune", help="delete old runs from the analyzer DB and compact it")
+    p_prune.add_argument("--keep", type=int, default=int(os.getenv("KEEP_RUNS") or "1"),
+                         help="run groups to keep, the latest first (default: KEEP_RUNS, or 1)")
+    args = parser.parse_args()
+
+    log.info("==== WAF Comparison Runner: START ====")
+    log.info(f"Data path: {DATA_PATH} | DB: {DB_PATH}")
+    wafs = Wafs()
+    smoke = SmokeSpec.from_env()
+
+    if args.command == "prune":
+        prune_runs(args.keep)
+        return
+    if args.command == "merge":
+        merge_results(args.files, into=DB_PATH, append=args.append)
+    elif args.command == "coordinator":
+        prepare_data(from_zip=wafs.data_from_zip)
+        try:
+            run_coordinator(wafs.wafs, listen=args.listen, shards=args.shards,
+                            data_from_zip=wafs.data_from_zip, smoke=smoke, merge=not args.no_merge,
+                            lease_seconds=args.lease_timeout, timeout=args.timeout)
+        except KeyboardInterrupt:
+            log.warning("Interrupted by user. Coordinator stopped.")
+            return
+        if args.no_merge:
+            return
+    elif args.command == "agent":
+        prepare_data(from_zip=wafs.data_from_zip)
+        try:
+            asyncio.run(wafs.run_agent_async(args.coordinator, args.name, args.out))
+        except KeyboardInterrupt:
+            log.warning("Interrupted by user. Agent stopped.")
+        return
+    else:
+        prepare_data(from_zip=wafs.data_from_zip)
+        try:
+            asyncio.run(wafs.send_payloads_async(workers=args.workers, resume=args.resume))
+        except KeyboardInterrupt:
+            log.warning("Interrupted by user. Attempted graceful shutdown; continue with --resume.")
+    if wafs.keep_runs:
+        prune_runs(wafs.keep_runs)
+    analyze_results()
+    log.info("==== WAF Comparison Runner: END ====")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# sampling.py
+"""
+Smoke runs: reproducible, stratified samples of the corpus.
+
+    SMOKE_N=10            at most 10 payloads per test file
+    SMOKE_TOTAL=5000      5000 payloads in all, split over the strata
+    SMOKE_FRACTION=0.01   1% of the corpus, split the same way
+    SMOKE_SEED=1          sample seed (same seed, same corpus: same payloads)
+    SMOKE_SHUFFLE=false   the first payloads of each file instead of a random sample
+
+A budget (SMOKE_TOTAL or SMOKE_FRACTION) is apportioned to strata in
+proportion to their size, and every stratum gets at least one payload:
+Legitimate files by the site category of `Legitimate Data Set
+categories.csv` (E-Commerce, information, Files uploads, ...), Malicious
+files by attack type (the test file, e.g. sqli). A stratum's share is then
+split over its files the same way. SMOKE_N also caps every file's share.
+
+Files with manifest offsets (or in the compiled corpus) read only the
+sampled payloads. Streams (zip members) are sampled in one pass with
+reservoir sampling, keeping only the sample in memory. Every file draws from
+its own generator seeded by SMOKE_SEED and the file, so workers, agents and
+reruns pick the same payloads. Sampled payloads keep their index in the file,
+so their item_index and payload_id are those of a full run.
+"""
+import csv
+import itertools
+import math
+import os
+import random
+from typing import Iterable, NamedTuple, Optional
+
+from config import CATEGORIES_PATH
+from helper import log
+
+# Bytes per payload assumed for archive members of unknown count
+ESTIMATED_PAYLOAD_BYTES = 1500
+
+
+class SmokeSpec(NamedTuple):
+    per_file: Optional[int] = None
+    total: Optional[int] = None
+    fraction: Optional[float] = None
+    seed: int = 1
+    shuffle: bool = True
+
+    @classmethod
+    def from_env(cls) -> Optional["SmokeSpec"]:
+        """The smoke settings of the environment, or None for a full run."""
+        spec = cls(
+            per_file=int(os.getenv("SMOKE_N", "0")) or None,
+            total=int(os.getenv("SMOKE_TOTAL", "0")) or None,
+            fraction=float(os.getenv("SMOKE_FRACTION", "0")) or None,
+            seed=int(os.getenv("SMOKE_SEED", "1")),
+            shuffle=os.getenv("SMOKE_SHUFFLE", "true").lower() in ("1", "true", "yes", "y"),
+        )
+        if spec.fraction is not None and not 0 < spec.fraction <= 1:
+            raise ValueError(f"SMOKE_FRACTION must be in (0, 1], not {spec.fraction}")
+        return spec if spec.per_file or spec.total or spec.fraction else None
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> Optional["SmokeSpec"]:
+        """Inverse of _asdict(), for specs sent as JSON (coordinator to agents)."""
+        return cls(**d) if d else None
+
+    def budget(self, corpus_size: int) -> Optional[int]:
+        """Total payloads to sample, or None when only SMOKE_N applies."""
+        if self.total:
+            return min(self.total, corpus_size)
+        if self.fraction:
+            return math.ceil(corpus_size * self.fraction)
+        return None
+
+    def rng(self, key: str) -> random.Random:
+        """Generator of one test file; str seeds hash the same in every process."""
+        return random.Random(f"{self.seed}:{key}")
+
+    def describe(self) -> str:
+        parts = []
+        if self.total:
+            parts.append(f"{self.total} payloads")
+        if self.fraction:
+            parts.append(f"{self.fraction:.4g} of the corpus")
+        if self.per_file:
+            parts.append(f"at most {self.per_file} per file")
+        parts.append(f"seed {self.seed}" if self.shuffle else "first payloads")
+        return ", ".join(parts)
+
+
+def load_categories(path=CATEGORIES_PATH) -> dict:
+    """{testName: category} of the Legitimate data set; {} when the CSV is missing."""
+    try:
+        with open(path, newline="", encoding="utf-8") as f:
+            return {row["testName"].strip(): row["category"].strip() for row in csv.DictReader(f)}
+    except (OSError, KeyError):
+        log.warning(f"No test categories in {path}; Legitimate smoke samples are stratified per file")
+        return {}
+
+
+def stratum(dataset_type: str, test_name: str, categories: dict) -> str:
+    if dataset_type.lower() == "legitimate":
+        return f"Legitimate/{categories.get(test_name, test_name)}"
+    return f"{dataset_type}/{test_name}"
+
+
+def apportion(budget: int, weights: dict, minimum: int = 0) -> dict:
+    """
+    Split budget over weights in proportion (largest remainder), at least
+    `minimum` each when the budget allows; ties go to the smaller key.
+    """
+    keys = sorted(k for k, w in weights.items() if w > 0)
+    if not keys or budget <= 0:
+        return {k: 0 for k in weights}
+    base = minimum if budget >= minimum * len(keys) else 0
+    rest = budget - base * len(keys)
+    total = sum(weights[k] for k in keys)
+    exact = {k: rest * weights[k] / total for k in keys}
+    shares = {k: base + int(exact[k]) for k in keys}
+    left = budget - sum(shares.values())
+    for k in sorted(keys, key=lambda k: (int(exact[k]) - exact[k], k))[:left]:
+        shares[k] += 1
+    return {k: shares.get(k, 0) for k in weights}
+
+
+def smoke_quotas(spec: SmokeSpec, files: list) -> dict:
+    """
+    {key: payloads to sample} for files = [(key, DataSetType, TestName,
+    count or None, size in bytes)]. Unknown counts (zip members not counted
+    yet) are estimated from the size and the bytes per payload of the known
+    files (ESTIMATED_PAYLOAD_BYTES when there are none).
+    """
+    if spec.budget(0) is None:
+        return {key: min(count, spec.per_file) if count is not None else spec.per_file
+                for key, _, _, count, _ in files}
+    known = [(count, nbytes) for *_, count, nbytes in files if count is not None]
+    per_payload = sum(b for _, b in known) / max(1, sum(c for c, _ in known)) if known else ESTIMATED_PAYLOAD_BYTES
+    sizes = {key: count if count is not None else max(1, round(nbytes / per_payload))
+             for key, _, _, count, nbytes in files}
+    if len(known) < len(files):
+        log.warning(f"Smoke budget split uses sizes estimated at {per_payload:.0f} bytes per payload for "
+                    f"archive members not counted yet (exact after one full run)")
+    budget = spec.budget(sum(sizes.values()))
+
+    categories = load_categories()
+    strata = {}
+    for key, dataset_type, test_name, *_ in files:
+        strata.setdefault(stratum(dataset_type, test_name, categories), []).append(key)
+    stratum_budget = apportion(budget, {s: sum(sizes[k] for k in keys) for s, keys in strata.items()}, minimum=1)
+    quotas = {}
+    for s, keys in strata.items():
+        quotas.update(apportion(stratum_budget[s], {k: sizes[k] for k in keys}))
+    log.info(f"Smoke sample of {budget} payloads over {len(strata)} strata: " + ", ".join(
+        f"{s} {stratum_budget[s]}" for s in sorted(strata)))
+    cap = spec.per_file
+    return {key: min(q, sizes[key], cap) if cap else min(q, sizes[key]) for key, q in quotas.items()}
+
+
+def pick_indices(count: int, k: int, spec: SmokeSpec, key: str) -> list[int]:
+    """Sorted indices of k of count payloads: a uniform sample, or the first k."""
+    k = min(k, count)
+    if not spec.shuffle:
+        return list(range(k))
+    return sorted(spec.rng(key).sample(range(count), k))
+
+
+def reservoir_sample(items: Iterable, k: int, rng: random.Random) -> list:
+    """
+    Uniform sample of k items of a stream in one pass, as (index, item) pairs
+    in stream order (Algorithm L: skips ahead between replacements, O(k) memory).
+    """
+    if k <= 0:
+        return []
+    it = enumerate(items)
+    reservoir = list(itertools.islice(it, k))
+    if len(reservoir) == k:
+        w = math.exp(math.log(rng.random() or 1e-12) / k)
+        while True:
+            skip = math.floor(math.log(rng.random() or 1e-12) / math.log1p(-w)) if w < 1 else 0
+            nxt = next(itertools.islice(it, skip, skip + 1), None)
+            if nxt is None:
+                break
+            reservoir[rng.randrange(k)] = nxt
+            w *= math.exp(math.log(rng.random() or 1e-12) / k)
+    reservoir.sort(key=lambda pair: pair[0])
+    return reservoir
+
+
+def sample_stream(items: Iterable, k: int, spec: SmokeSpec, key: str) -> Iterable:
+    """(index, payload) pairs of k payloads of a stream: a reservoir sample, or the first k."""
+    if not spec.shuffle:
+        return itertools.islice(enumerate(items), k)
+    return reservoir_sample(items, k, spec.rng(key))
@@ -0,0 +1,317 @@
+# sources.py
+"""
+Where the runner's payloads come from.
+
+A run is a list of TestSource entries, one per test file. Each carries the
+path used for TestName/DataSetType (`path.stem`, `path.parent.stem`), the
+number of payloads it will yield (None when not known yet) and a callable
+returning a fresh payload iterator. Payloads are read from, in order of
+preference: the compiled corpus, the extracted JSON files via their manifest
+offsets, or the downloaded zip archives, streamed member by member.
+"""
+import codecs
+import hashlib
+import itertools
+import json
+import os
+import zipfile
+from json.decoder import WHITESPACE
+from pathlib import Path, PurePath, PurePosixPath
+from typing import Callable, Iterator, NamedTuple, Optional
+
+from config import DATA_PATH, LEGITIMATE_ZIP_PATH, MALICIOUS_ZIP_PATH
+from corpus import open_corpus
+from helper import log
+from manifest import load_manifest, save_manifest, refresh_manifest, manifest_key, iter_payloads_at, \
+    iter_payloads_picked
+from sampling import SmokeSpec, pick_indices, sample_stream, smoke_quotas
+
+_decoder = json.JSONDecoder()
+
+
+class TestSource(NamedTuple):
+    path: PurePath
+    key: str
+    count: Optional[int]
+    open: Callable[..., Iterator]      # open(start=0, stop=None) -> payloads [start:stop]
+    splittable: bool = False           # True when open() seeks to start instead of skipping
+    indexed: bool = False              # True when open() yields (index in the file, payload) pairs (samples)
+
+
+# -------------- Streaming JSON (no full file load) --------------
+
+def iter_payloads_from_json(path: Path, limit: Optional[int] = None, smoke: Optional[SmokeSpec] = None,
+                            key: str = "") -> Iterator[dict]:
+    """
+    Stream items from a top-level JSON array like:
+    [ {payload1}, {payload2}, ... ]
+
+    With limit, only a sample of `limit` items is kept (see sampling.py),
+    still in one streaming pass, as (index, item) pairs.
+    """
+    with open(path, "rb") as f:
+        if limit is not None:
+            yield from sample_stream(iter_json_array_stream(f), limit, smoke or SmokeSpec(), key or str(path))
+            return
+        yield from iter_json_array_stream(f)
+
+
+def iter_json_array_stream(fp, chunk_size: int = 1 << 16) -> Iterator:
+    """
+    Incrementally decode a top-level JSON array from a binary stream, yielding
+    each item as soon as it is complete. Uses ijson when installed.
+    """
+    try:
+        import ijson  # type: ignore
+    except ImportError:
+        ijson = None
+    if ijson is not None:
+        yield from ijson.items(fp, "item", use_float=True)
+        return
+
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos = "", 0
+    started = eof = False
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos < len(buf):
+            c = buf[pos]
+            if not started:
+                if c != "[":
+                    raise ValueError("expected a top-level JSON array")
+                started = True
+                pos += 1
+                continue
+            if c == "]":
+                return
+            if c == ",":
+                pos += 1
+                continue
+            try:
+                item, end = _decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A value ending exactly at the buffer edge may be truncated; read more first
+                if end < len(buf) or eof:
+                    yield item
+                    pos = end
+                    continue
+        if eof:
+            raise ValueError("unterminated JSON array")
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + utf8.decode(chunk, final=eof)
+        pos = 0
+
+
+# -------------------- Zip archives --------------------
+
+def zip_json_members(zip_path: Path) -> list[zipfile.ZipInfo]:
+    with zipfile.ZipFile(zip_path) as zf:
+        return [
+            i for i in zf.infolist()
+            if not i.is_dir() and i.filename.endswith(".json") and not i.filename.startswith("__MACOSX/")
+        ]
+
+
+def iter_payloads_from_zip(zip_path: Path, member: str, limit: Optional[int] = None,
+                           smoke: Optional[SmokeSpec] = None, key: str = "") -> Iterator[dict]:
+    """
+    Decode one archive member while it is being decompressed (no extraction);
+    with limit, (index, item) pairs of a sample.
+    """
+    with zipfile.ZipFile(zip_path) as zf, zf.open(member) as f:
+        if limit is not None:
+            yield from sample_stream(iter_json_array_stream(f), limit, smoke or SmokeSpec(), key or member)
+            return
+        yield from iter_json_array_stream(f)
+
+
+class SourcePlan:
+    """The ordered test sources of one run, plus what must be released after it."""
+
+    def __init__(self, sources: list[TestSource], version: Optional[str] = None, corpus=None):
+        self.sources = sources
+        self.version = version      # corpus version; None for partial (smoke) runs
+        self.corpus = corpus
+        self.zip_counts = {}        # manifest entries of zip members counted while streaming
+
+    @staticmethod
+    def make_version(parts) -> str:
+        """Corpus version: digest over (key, size, mtime/crc) of every source."""
+        h = hashlib.sha1()
+        for part in sorted(parts):
+            h.update(repr(part).encode("utf-8"))
+        return h.hexdigest()[:16]
+
+    @property
+    def total_payloads(self) -> Optional[int]:
+        """Sum of per-source counts, or None while any zip member has not been counted yet."""
+        if any(s.count is None for s in self.sources):
+            return None
+        return sum(s.count for s in self.sources)
+
+    def _record_zip_count(self, key: str, info: zipfile.ZipInfo, count: int):
+        self.zip_counts[key] = {"size": info.file_size, "crc": info.CRC, "count": count}
+
+    def close(self, save: bool = True):
+        """
+        Release the corpus and merge the zip member counts learned while
+        streaming into the manifest on disk. Worker processes pass save=False
+        and hand zip_counts to the parent, which saves once after they join.
+        """
+        if save and self.zip_counts:
+            manifest = load_manifest()
+            manifest.setdefault("zip_members", {}).update(self.zip_counts)
+            save_manifest(manifest)
+        if self.corpus:
+            self.corpus.close()
+
+
+def _test_of(path: PurePath) -> tuple:
+    return path.parent.stem, path.stem
+
+
+def plan_file_sources(smoke: Optional[SmokeSpec] = None) -> SourcePlan:
+    """
+    Sources for the extracted JSON files under DATA_PATH. A smoke sample
+    reads only its payloads, through the manifest offsets or the corpus, and
+    its files can be split across workers like full ones.
+    """
+    test_files = sorted(DATA_PATH.rglob("*.json"))
+    manifest = refresh_manifest(test_files)
+
+    indexed = []
+    for p in test_files:
+        entry = manifest.get(manifest_key(p))
+        if not entry or "error" in entry:
+            log.warning(f"Skipping {p}: not a readable JSON array")
+            continue
+        indexed.append((p, entry))
+
+    # Prefer the compiled, memory-mapped corpus when it matches the manifest
+    corpus = None
+    if os.getenv("USE_CORPUS", "true").lower() in ("1", "true", "yes", "y"):
+        corpus = open_corpus(manifest, [manifest_key(p) for p, _ in indexed])
+        if corpus:
+            log.info(f"Reading payloads from compiled corpus {corpus.path}")
+
+    quotas = {}
+    if smoke:
+        quotas = smoke_quotas(smoke, [(manifest_key(p), *_test_of(p), e["count"], e["size"]) for p, e in indexed])
+
+    sources = []
+    for p, entry in indexed:
+        key = manifest_key(p)
+        if smoke:
+            picked = pick_indices(entry["count"], quotas[key], smoke, key)
+            if not picked:
+                continue
+            if corpus:
+                opener = (lambda start=0, stop=None, key=key, picked=picked:
+                          zip(picked[start:stop], corpus.iter_items(key, picked[start:stop])))
+            else:
+                opener = (lambda start=0, stop=None, p=p, offsets=entry["offsets"], picked=picked:
+                          zip(picked[start:stop], iter_payloads_picked(p, offsets, picked[start:stop])))
+            sources.append(TestSource(p, key, len(picked), opener, splittable=True, indexed=True))
+        elif corpus:
+            opener = (lambda start=0, stop=None, key=key: corpus.iter_file(key, start, stop))
+            sources.append(TestSource(p, key, entry["count"], opener, splittable=True))
+        else:
+            opener = (lambda start=0, stop=None, p=p, offsets=entry["offsets"]: iter_payloads_at(p, offsets, start, stop))
+            sources.append(TestSource(p, key, entry["count"], opener, splittable=True))
+    version = None if smoke else SourcePlan.make_version(
+        (manifest_key(p), e["size"], e["mtime_ns"]) for p, e in indexed)
+    return SourcePlan(sources, version=version, corpus=corpus)
+
+
+def plan_zip_sources(zip_paths=(LEGITIMATE_ZIP_PATH, MALICIOUS_ZIP_PATH), smoke: Optional[SmokeSpec] = None) -> SourcePlan:
+    """
+    Sources streamed straight out of the downloaded archives. Member counts are
+    learned on the first full pass and cached in the manifest (keyed by member
+    size and CRC), so later runs get exact progress totals. Smoke samples are
+    reservoir samples of each member's stream.
+    """
+    manifest = load_manifest()
+    known = manifest.get("zip_members", {})
+    plan = SourcePlan([])
+    parts = []
+
+    members = []
+    for zip_path in zip_paths:
+        for info in zip_json_members(zip_path):
+            key = f"{zip_path.name}!{info.filename}"
+            parts.append((key, info.file_size, info.CRC))
+            entry = known.get(key)
+            count = None
+            if entry and entry["size"] == info.file_size and entry["crc"] == info.CRC:
+                count = entry["count"]
+            members.append((zip_path, info, key, count))
+    quotas = {}
+    if smoke:
+        quotas = smoke_quotas(smoke, [(key, *_test_of(PurePosixPath(info.filename)), count, info.file_size)
+                                      for _, info, key, count in members])
+
+    for zip_path, info, key, count in members:
+        if smoke:
+            if not quotas[key]:
+                continue
+            count = min(count, quotas[key]) if count is not None else None
+
+        def stream(zip_path=zip_path, info=info, key=key, counted=count is not None):
+            if smoke:
+                yield from iter_payloads_from_zip(zip_path, info.filename, limit=quotas[key], smoke=smoke, key=key)
+                return
+            n = 0
+            for item in iter_payloads_from_zip(zip_path, info.filename):
+                n += 1
+                yield item
+            if not counted:
+                plan._record_zip_count(key, info, n)
+
+        opener = (lambda start=0, stop=None, stream=stream: itertools.islice(stream(), start, stop))
+        plan.sources.append(TestSource(PurePosixPath(info.filename), key, count, opener, indexed=bool(smoke)))
+
+    plan.version = None if smoke else SourcePlan.make_version(parts)
+    log.info(f"Streaming {len(plan.sources)} test files from {', '.join(p.name for p in zip_paths)}")
+    return plan
+
+
+def plan_sources(from_zip: bool = False, smoke: Optional[SmokeSpec] = None) -> SourcePlan:
+    if smoke:
+        log.info(f"Smoke run: {smoke.describe()}")
+    return plan_zip_sources(smoke=smoke) if from_zip else plan_file_sources(smoke)
+
+
+def shard_sources(sources: list[TestSource], n: int, min_chunk: int = 1000) -> list[list[tuple]]:
+    """
+    Split a run into n shards of (source_index, start, stop) units with about
+    the same number of payloads each. Splittable sources are cut into payload
+    ranges; the rest (zip members, smoke subsets) are assigned as whole files.
+    Units are kept in source order inside each shard for sequential reads.
+    """
+    known = [s.count for s in sources if s.count is not None]
+    chunk = max(min_chunk, sum(known) // max(1, n * 8))
+    units = []
+    for i, s in enumerate(sources):
+        if s.splittable and s.count:
+            for start in range(0, s.count, chunk):
+                units.append((i, start, min(start + chunk, s.count)))
+        else:
+            units.append((i, 0, None))
+
+    def size(unit):
+        i, start, stop = unit
+        if stop is not None:
+            return stop - start
+        return sources[i].count if sources[i].count is not None else chunk
+
+    shards = [[] for _ in range(n)]
+    loads = [0] * n
+    for unit in sorted(units, key=size, reverse=True):
+        k = loads.index(min(loads))
+        shards[k].append(unit)
+        loads[k] += size(unit)
+    return [sorted(shard) for shard in shards]
@@ -0,0 +1,589 @@
+# storage.py
+"""
+Results DB (normalized schema), owned by the runner's local connections.
+
+    payloads  one row per payload, keyed by a stable 64-bit payload_id
+    wafs      waf_id -> WAF_Name, DestinationURL
+    runs      run_id -> machineName, start DateTime, corpus version, run_group, finished
+    results   run_id, payload_id, waf_id, status, blocked, achieved_rps (the
+              rate a paced WAF achieved when the request was sent) and the
+              latencies latency_us (total), ttfb_us, connect_us (integers only;
+              connect_us is NULL when a pooled connection was reused)
+    result_counts  blocked / passed / failed counts per (run, WAF, DataSetType,
+              TestName), kept current by the writer with every batch it commits
+    bodies    body_id -> zlib-compressed response body (the inspected first
+              PEEK_BYTES); results.body_id refers to it, NULL when no body was read
+    verdicts  status and blocked per (WAF endpoint, config fingerprint,
+              payload_id), reused by later runs (see verdicts.py)
+
+Indexes serve the analyzer's filters (latest run group, isBlocked, data set
+and test) so its reports are answered by SQLite instead of full scans.
+
+Payload text is written once per corpus version instead of once per WAF.
+`waf_comparison` is a view over these tables with the original column names,
+so analyzer.py keeps reading it as before; `waf_counts` serves the headline
+metrics from result_counts without scanning results, also in the middle of a
+run. Both views show the latest run group only:
+a local run is a group of its own, merged agent runs share one. Earlier runs
+stay in the DB, and an interrupted run can be resumed (see checkpoint.py),
+until prune_runs() deletes all but the latest groups (KEEP_RUNS, `prune`).
+
+Block pages and application pages repeat across requests and WAFs, so bodies
+are content-addressed: every distinct body is compressed and stored once.
+waf_comparison decodes it again: response_body is the text, computed by the
+body_text SQL function, and response_body_z the compressed blob. Connections
+reading the view need that function: connect() registers it, other Python
+connections call register_functions(); clients without it (the sqlite3 shell)
+query the tables instead.
+"""
+import datetime
+import hashlib
+import json
+import sqlite3
+import time
+import zlib
+from typing import NamedTuple, Optional
+
+from config import DB_PATH
+from helper import log
+
+# Queue item tags understood by flush_to_db
+PAYLOAD_ROW, RESULT_ROW = 0, 1
+
+
+class ResultRecord(NamedTuple):
+    """
+    One result on its way to the writer (queue item (RESULT_ROW, record)).
+    A plain tuple: no per-row dict, and cheap to pickle from worker processes.
+    The first nine fields are the results columns in INSERT order; run_id and
+    test are the same objects for every row of a run and a source.
+    """
+    run_id: int
+    payload_id: int
+    waf_id: int
+    status: int
+    blocked: int
+    latency_us: int
+    achieved_rps: Optional[int]
+    ttfb_us: Optional[int]
+    connect_us: Optional[int]
+    test: tuple                 # (DataSetType, TestName)
+    body: Optional[str]         # inspected body, None if not read
+
+# Columns copied verbatim when merging results files
+PAYLOAD_COLUMNS = ("payload_id", "DataSetType", "TestName", "item_index", "method", "url", "headers", "data")
+RESULT_VALUE_COLUMNS = ("status", "blocked", "latency_us", "achieved_rps", "ttfb_us", "connect_us", "body_id")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS payloads (
+    payload_id INTEGER PRIMARY KEY,
+    DataSetType TEXT,
+    TestName TEXT,
+    item_index INTEGER,
+    method TEXT,
+    url TEXT,
+    headers TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS wafs (
+    waf_id INTEGER PRIMARY KEY,
+    WAF_Name TEXT NOT NULL,
+    DestinationURL TEXT NOT NULL,
+    UNIQUE (WAF_Name, DestinationURL)
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    machineName TEXT,
+    DateTime TEXT,
+    corpus_version TEXT,
+    run_group INTEGER,
+    finished TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL,
+    payload_id INTEGER NOT NULL,
+    waf_id INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    blocked INTEGER NOT NULL,
+    latency_us INTEGER,
+    achieved_rps INTEGER,
+    ttfb_us INTEGER,
+    connect_us INTEGER,
+    body_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS bodies (
+    body_id INTEGER PRIMARY KEY,
+    body BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_counts (
+    run_id INTEGER NOT NULL,
+    waf_id INTEGER NOT NULL,
+    DataSetType TEXT NOT NULL,
+    TestName TEXT NOT NULL,
+    blocked INTEGER NOT NULL DEFAULT 0,
+    passed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (run_id, waf_id, DataSetType, TestName)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS verdicts (
+    endpoint TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    payload_id INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    blocked INTEGER NOT NULL,
+    PRIMARY KEY (endpoint, fingerprint, payload_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS corpus_versions (
+    corpus_version TEXT PRIMARY KEY,
+    payload_count INTEGER,
+    DateTime TEXT
+);
+"""
+
+# Created after MIGRATIONS, which may add indexed columns to older DBs
+INDEXES = """
+CREATE INDEX IF NOT EXISTS results_run_blocked ON results (run_id, blocked, waf_id);
+CREATE INDEX IF NOT EXISTS payloads_dataset_test ON payloads (DataSetType, TestName);
+CREATE INDEX IF NOT EXISTS runs_group ON runs (run_group);
+"""
+
+VIEW = """
+CREATE VIEW waf_comparison AS
+SELECT p.method, p.url, p.headers, p.data,
+       ru.machineName, w.DestinationURL, w.WAF_Name, ru.DateTime,
+       p.TestName, p.DataSetType,
+       r.status  AS response_status_code,
+       r.blocked AS isBlocked,
+       body_text(b.body) AS response_body,
+       b.body    AS response_body_z,
+       r.achieved_rps, r.latency_us, r.ttfb_us, r.connect_us
+FROM results r
+JOIN payloads p ON p.payload_id = r.payload_id
+JOIN wafs w     ON w.waf_id = r.waf_id
+JOIN runs ru    ON ru.run_id = r.run_id
+LEFT JOIN bodies b ON b.body_id = r.body_id
+WHERE r.run_id IN (SELECT run_id FROM runs WHERE run_group = (SELECT MAX(run_group) FROM runs));
+
+CREATE VIEW waf_counts AS
+SELECT w.WAF_Name, c.DataSetType, c.TestName,
+       SUM(c.blocked) AS blocked,
+       SUM(c.passed)  AS passed,
+       SUM(c.failed)  AS failed
+FROM result_counts c
+JOIN wafs w  ON w.waf_id = c.waf_id
+WHERE c.run_id IN (SELECT run_id FROM runs WHERE run_group = (SELECT MAX(run_group) FROM runs))
+GROUP BY w.WAF_Name, c.DataSetType, c.TestName;
+"""
+
+# blocked / passed / failed of one result row, as SQL over results r
+COUNT_EXPRS = """
+    SUM(CASE WHEN r.status != 0 AND r.blocked THEN 1 ELSE 0 END),
+    SUM(CASE WHEN r.status != 0 AND NOT r.blocked THEN 1 ELSE 0 END),
+    SUM(CASE WHEN r.status = 0 THEN 1 ELSE 0 END)
+"""
+
+UPSERT_COUNTS = """
+INSERT INTO result_counts (run_id, waf_id, DataSetType, TestName, blocked, passed, failed)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (run_id, waf_id, DataSetType, TestName) DO UPDATE SET
+    blocked = blocked + excluded.blocked,
+    passed  = passed + excluded.passed,
+    failed  = failed + excluded.failed
+"""
+
+# Columns added to tables of DBs created by earlier versions
+MIGRATIONS = {
+    "runs": (("run_group", "INTEGER"), ("finished", "TEXT")),
+    "results": (("achieved_rps", "INTEGER"), ("ttfb_us", "INTEGER"), ("connect_us", "INTEGER"), ("body_id", "INTEGER")),
+}
+
+# Columns renamed since earlier versions: table -> ((old name, new name), ...), applied before MIGRATIONS
+RENAMED_COLUMNS = {
+    "results": (("target_rps", "achieved_rps"),),   # the rate achieved, not the target
+}
+
+
+def ensure_db_dir(db_path=DB_PATH):
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+
+
+def connect(path=DB_PATH) -> sqlite3.Connection:
+    """Local connection tuned for bulk writes (never the global config.conn)."""
+    c = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    try:
+        c.execute("PRAGMA journal_mode=WAL;")
+        c.execute("PRAGMA synchronous=OFF;")
+        c.execute("PRAGMA temp_store=MEMORY;")
+    except Exception:
+        pass
+    register_functions(c)
+    return c
+
+
+def register_functions(c: sqlite3.Connection):
+    """SQL functions the views use; needed by every connection that reads waf_comparison."""
+    c.create_function("body_text", 1, body_text, deterministic=True)
+
+
+def ensure_results_table(fresh: bool = False, db_path=DB_PATH):
+    """
+    Create the schema and (re)create the waf_comparison view. With fresh,
+    results of earlier runs are discarded; stored payloads are kept.
+    """
+    ensure_db_dir(db_path)
+    c = connect(db_path)
+    try:
+        with c:
+            kind = c.execute("SELECT type FROM sqlite_master WHERE name='waf_comparison'").fetchone()
+            if kind and kind[0] == "table":
+                # Pre-normalization DB: the old wide table gives way to the view
+                if fresh:
+                    c.execute("DROP TABLE waf_comparison")
+                else:
+                    c.execute("ALTER TABLE waf_comparison RENAME TO waf_comparison_legacy")
+                    log.warning("Renamed old waf_comparison table to waf_comparison_legacy")
+            had_counts = c.execute("SELECT 1 FROM sqlite_master WHERE name='result_counts'").fetchone()
+            c.executescript(SCHEMA)
+            _migrate(c)
+            c.executescript(INDEXES)
+            if fresh:
+                c.execute("DELETE FROM results")
+                c.execute("DELETE FROM result_counts")
+                c.execute("DELETE FROM runs")
+                c.execute("DELETE FROM bodies")
+            elif not had_counts:
+                # DB from before result_counts: count the stored results once
+                c.execute(f"""
+                    INSERT INTO result_counts (run_id, waf_id, DataSetType, TestName, blocked, passed, failed)
+                    SELECT r.run_id, r.waf_id, p.DataSetType, p.TestName, {COUNT_EXPRS}
+                    FROM results r JOIN payloads p ON p.payload_id = r.payload_id
+                    GROUP BY r.run_id, r.waf_id, p.DataSetType, p.TestName
+                """)
+            c.execute("DROP VIEW IF EXISTS waf_comparison")
+            c.execute("DROP VIEW IF EXISTS waf_counts")
+            c.executescript(VIEW)
+    finally:
+        c.close()
+    log.info(f"DB ready at {db_path} (fresh={fresh})")
+
+
+def _migrate(c: sqlite3.Connection, schema: str = "main"):
+    for table, renames in RENAMED_COLUMNS.items():
+        have = {row[1] for row in c.execute(f"PRAGMA {schema}.table_info({table})")}
+        for old, new in renames:
+            if old in have and new not in have:
+                c.execute(f"ALTER TABLE {schema}.{table} RENAME COLUMN {old} TO {new}")
+    for table, columns in MIGRATIONS.items():
+        have = {row[1] for row in c.execute(f"PRAGMA {schema}.table_info({table})")}
+        for name, decl in columns:
+            if name not in have:
+                c.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {decl}")
+    # Runs from before run groups existed: each one is a group of its own
+    c.execute(f"UPDATE {schema}.runs SET run_group = run_id WHERE run_group IS NULL")
+
+
+def register_wafs(wafs: dict, db_path=DB_PATH) -> dict:
+    """Return {DestinationURL: waf_id} for WAFS_DICT, inserting unknown entries."""
+    c = connect(db_path)
+    try:
+        with c:
+            c.executemany("INSERT OR IGNORE INTO wafs (WAF_Name, DestinationURL) VALUES (?, ?)", list(wafs.items()))
+            ids = {}
+            for name, url in wafs.items():
+                ids[url] = c.execute(
+                    "SELECT waf_id FROM wafs WHERE WAF_Name=? AND DestinationURL=?", (name, url)
+                ).fetchone()[0]
+        return ids
+    finally:
+        c.close()
+
+
+def start_run(machine_name: str, corpus_version, db_path=DB_PATH, run_group=None) -> int:
+    """Insert a run; without run_group it starts a new group (and becomes what the view shows)."""
+    c = connect(db_path)
+    try:
+        with c:
+            cur = c.execute(
+                "INSERT INTO runs (machineName, DateTime, corpus_version, run_group) VALUES (?, ?, ?, ?)",
+                (machine_name, datetime.datetime.now().isoformat(timespec="seconds"), corpus_version, run_group),
+            )
+            run_id = cur.lastrowid
+            if run_group is None:
+                c.execute("UPDATE runs SET run_group = run_id WHERE run_id = ?", (run_id,))
+        return run_id
+    finally:
+        c.close()
+
+
+def finish_run(run_id: int, db_path=DB_PATH):
+    c = connect(db_path)
+    try:
+        with c:
+            c.execute("UPDATE runs SET finished = ? WHERE run_id = ?",
+                      (datetime.datetime.now().isoformat(timespec="seconds"), run_id))
+    finally:
+        c.close()
+
+
+def resumable_run(machine_name: str, corpus_version, retry_failed: bool = True, db_path=DB_PATH):
+    """
+    Latest run of this machine if it is unfinished, belongs to the latest run
+    group and was sent from the same corpus version; else None. Failed
+    requests (status 0) of that run are dropped so they are sent again.
+    """
+    c = connect(db_path)
+    try:
+        row = c.execute("""
+            SELECT run_id, corpus_version, finished FROM runs
+            WHERE machineName = ? AND run_group = (SELECT MAX(run_group) FROM runs)
+            ORDER BY run_id DESC LIMIT 1
+        """, (machine_name,)).fetchone()
+        if row is None:
+            log.info("No earlier run to resume")
+            return None
+        run_id, version, finished = row
+        if finished:
+            log.info(f"Run {run_id} already finished at {finished}; nothing to resume")
+            return None
+        if corpus_version is None or version != corpus_version:
+            log.warning(f"Run {run_id} was sent from corpus {version}, now {corpus_version}; not resuming it")
+            return None
+        if retry_failed:
+            with c:
+                dropped = c.execute("DELETE FROM results WHERE run_id = ? AND status = 0", (run_id,)).rowcount
+                c.execute("UPDATE result_counts SET failed = 0 WHERE run_id = ?", (run_id,))
+            if dropped:
+                log.info(f"Run {run_id}: {dropped} failed requests will be retried")
+        return run_id
+    finally:
+        c.close()
+
+
+def corpus_version_stored(corpus_version, db_path=DB_PATH) -> bool:
+    """True when every payload of this corpus version is already in the payloads table."""
+    if corpus_version is None:
+        return False
+    c = connect(db_path)
+    try:
+        return c.execute(
+            "SELECT 1 FROM corpus_versions WHERE corpus_version=?", (corpus_version,)
+        ).fetchone() is not None
+    finally:
+        c.close()
+
+
+def mark_corpus_version(corpus_version, payload_count: int, db_path=DB_PATH):
+    c = connect(db_path)
+    try:
+        with c:
+            c.execute(
+                "INSERT OR REPLACE INTO corpus_versions (corpus_version, payload_count, DateTime) VALUES (?, ?, ?)",
+                (corpus_version, payload_count, datetime.datetime.now().isoformat(timespec="seconds")),
+            )
+    finally:
+        c.close()
+
+
+def payload_id(dataset_type: str, test_name: str, index: int, method, url, headers, data) -> int:
+    """
+    Stable signed 64-bit id of the payload at `index` of a test. Depends only
+    on the test and the payload itself, so any shard or worker computes the
+    same id for it.
+    """
+    canon = json.dumps([dataset_type, test_name, index, method, url, headers, data],
+                       sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    digest = hashlib.blake2b(canon.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def body_id(body: str) -> int:
+    """Stable signed 64-bit id of a response body (its content address)."""
+    digest = hashlib.blake2b(body.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def body_text(blob) -> str | None:
+    """Text of a body stored in bodies.body (also the body_text SQL function)."""
+    return zlib.decompress(blob).decode("utf-8", "replace") if blob is not None else None
+
+
+def _safe_text(val):
+    """Convert any object to a safe, null-free string for SQLite."""
+    if val is None:
+        s = ""
+    elif isinstance(val, bytes):
+        s = val.decode("utf-8", errors="replace")
+    elif isinstance(val, str):
+        s = val
+    else:
+        try:
+            s = json.dumps(val, ensure_ascii=False)
+        except Exception:
+            s = str(val)
+    return s.replace("\x00", "\uFFFD")
+
+
+def flush_to_db(rows, db_conn, stages=None, commit_latency=None):
+    """
+    Fast executemany insert of tagged queue items; writer-thread-owned connection only.
+    Result rows are ResultRecords; result_counts is updated from their test in
+    the same transaction, and each distinct body is stored once.
+    stages (profiling.StageTimer) gets the time spent on serialize and commit,
+    commit_latency (LatencyHistogram) the commit's duration in microseconds.
+    """
+    if not rows:
+        return 0
+    t0 = time.perf_counter()
+    payloads = []
+    results = []
+    counts = {}
+    bodies = {}
+    for tag, r in rows:
+        if tag == PAYLOAD_ROW:
+            pid, dataset_type, test_name, index, method, url, headers, data = r
+            payloads.append((
+                pid,
+                _safe_text(dataset_type),
+                _safe_text(test_name),
+                index,
+                _safe_text(method),
+                _safe_text(url),
+                _safe_text(headers),
+                _safe_text(data),
+            ))
+        else:
+            key = (r.run_id, r.waf_id, *r.test)
+            c = counts.get(key)
+            if c is None:
+                c = counts[key] = [0, 0, 0]
+            c[2 if r.status == 0 else 0 if r.blocked else 1] += 1
+            body = r.body
+            bid = None
+            if body:
+                body = _safe_text(body)
+                bid = body_id(body)
+                if bid not in bodies:
+                    bodies[bid] = zlib.compress(body.encode("utf-8", "surrogatepass"))
+            results.append((*r[:9], bid))
+    t1 = time.perf_counter()
+    with db_conn:
+        if payloads:
+            db_conn.executemany("""
+                INSERT OR IGNORE INTO payloads (
+                  payload_id,DataSetType,TestName,item_index,method,url,headers,data
+                ) VALUES (?,?,?,?,?,?,?,?)
+            """, payloads)
+        if bodies:
+            db_conn.executemany("INSERT OR IGNORE INTO bodies (body_id, body) VALUES (?,?)", bodies.items())
+        if results:
+            db_conn.executemany("""
+                INSERT INTO results (run_id,payload_id,waf_id,status,blocked,latency_us,achieved_rps,ttfb_us,connect_us,body_id)
+                VALUES (?,?,?,?,?,?,?,?,?,?)
+            """, results)
+            db_conn.executemany(UPSERT_COUNTS, [(*key, *c) for key, c in counts.items()])
+    t2 = time.perf_counter()
+    if stages is not None:
+        stages.add("serialize", t1 - t0)
+        stages.add("commit", t2 - t1)
+    if commit_latency is not None:
+        commit_latency.record(int((t2 - t1) * 1e6))
+    return len(results)
+
+
+def merge_results(files, into=DB_PATH, append: bool = False) -> int:
+    """
+    Combine self-contained results files (e.g. from distributed agents) into
+    the DB the analyzer reads. Every source run becomes a run of its own, so
+    machineName is kept; WAFs are matched by name and URL.
+    The merged runs form a new run group, or join the latest one with append.
+    """
+    ensure_results_table(db_path=into)
+    payload_cols = ", ".join(PAYLOAD_COLUMNS)
+    value_cols = ", ".join(RESULT_VALUE_COLUMNS)
+    src_value_cols = ", ".join("r." + col for col in RESULT_VALUE_COLUMNS)
+    c = connect(into)
+    merged = 0
+    run_group = c.execute("SELECT MAX(run_group) FROM runs").fetchone()[0] if append else None
+    try:
+        for path in files:
+            c.execute("ATTACH DATABASE ? AS src", (str(path),))
+            try:
+                with c:
+                    _migrate(c, "src")
+                    if c.execute("SELECT 1 FROM src.sqlite_master WHERE name='bodies'").fetchone():
+                        c.execute("INSERT OR IGNORE INTO main.bodies (body_id, body) SELECT body_id, body FROM src.bodies")
+                    c.execute(f"INSERT OR IGNORE INTO main.payloads ({payload_cols}) "
+                              f"SELECT {payload_cols} FROM src.payloads")
+                    c.execute("INSERT OR IGNORE INTO main.wafs (WAF_Name, DestinationURL) "
+                              "SELECT WAF_Name, DestinationURL FROM src.wafs")
+                    src_runs = c.execute(
+                        "SELECT run_id, machineName, DateTime, corpus_version, finished FROM src.runs").fetchall()
+                    for src_run, machine, started, version, finished in src_runs:
+                        run_id = c.execute(
+                            "INSERT INTO main.runs (machineName, DateTime, corpus_version, run_group, finished) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (machine, started, version, run_group, finished),
+                        ).lastrowid
+                        if run_group is None:
+                            run_group = run_id
+                            c.execute("UPDATE main.runs SET run_group = ? WHERE run_id = ?", (run_group, run_id))
+                        cur = c.execute(f"""
+                            INSERT INTO main.results (run_id, payload_id, waf_id, {value_cols})
+                            SELECT ?, r.payload_id, mw.waf_id, {src_value_cols}
+                            FROM src.results r
+                            JOIN src.wafs sw  ON sw.waf_id = r.waf_id
+                            JOIN main.wafs mw ON mw.WAF_Name = sw.WAF_Name AND mw.DestinationURL = sw.DestinationURL
+                            WHERE r.run_id = ?
+                        """, (run_id, src_run))
+                        merged += cur.rowcount
+                        c.execute(f"""
+                            INSERT INTO main.result_counts (run_id, waf_id, DataSetType, TestName, blocked, passed, failed)
+                            SELECT ?, mw.waf_id, p.DataSetType, p.TestName, {COUNT_EXPRS}
+                            FROM src.results r
+                            JOIN src.payloads p ON p.payload_id = r.payload_id
+                            JOIN src.wafs sw  ON sw.waf_id = r.waf_id
+                            JOIN main.wafs mw ON mw.WAF_Name = sw.WAF_Name AND mw.DestinationURL = sw.DestinationURL
+                            WHERE r.run_id = ?
+                            GROUP BY mw.waf_id, p.DataSetType, p.TestName
+                        """, (run_id, src_run))
+                        log.info(f"Merged {cur.rowcount} results from {path} (machine {machine})")
+            finally:
+                c.execute("DETACH DATABASE src")
+    finally:
+        c.close()
+    return merged
+
+
+def prune_runs(keep: int, db_path=DB_PATH) -> int:
+    """
+    Delete all but the latest `keep` run groups: their runs, results and
+    counts, then the bodies no result refers to any more, and VACUUM so the
+    file shrinks. Payloads and the verdict cache are kept: payload text is
+    stored once per corpus version, and later runs refer to it.
+    Returns the number of runs deleted.
+    """
+    if keep < 1:
+        raise ValueError("keep at least one run group")
+    size_before = db_path.stat().st_size if db_path.exists() else 0
+    c = connect(db_path)
+    try:
+        row = c.execute("SELECT run_group FROM runs GROUP BY run_group ORDER BY run_group DESC LIMIT 1 OFFSET ?",
+                        (keep - 1,)).fetchone()
+        if row is None:
+            log.info(f"Prune: at most {keep} run groups in {db_path}, nothing to delete")
+            return 0
+        old = "SELECT run_id FROM runs WHERE run_group < ?"
+        with c:
+            results = c.execute(f"DELETE FROM results WHERE run_id IN ({old})", row).rowcount
+            c.execute(f"DELETE FROM result_counts WHERE run_id IN ({old})", row)
+            runs = c.execute("DELETE FROM runs WHERE run_group < ?", row).rowcount
+            bodies = c.execute("""
+                DELETE FROM bodies WHERE body_id NOT IN (SELECT body_id FROM results WHERE body_id IS NOT NULL)
+            """).rowcount
+        c.execute("VACUUM")
+    finally:
+        c.close()
+    size_after = db_path.stat().st_size
+    log.info(f"Prune: deleted {runs} runs ({results} results, {bodies} bodies), kept {keep} run groups; "
+             f"{db_path} {size_before / 1e6:.1f} -> {size_after / 1e6:.1f} MB")
+    return runs
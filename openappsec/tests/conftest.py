@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# config.py creates ~/waf_compare and opens its DB on import: keep that out of the real home
+os.environ["HOME"] = tempfile.mkdtemp(prefix="waf_compare_tests_")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
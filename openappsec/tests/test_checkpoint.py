@@ -0,0 +1,31 @@
+from checkpoint import CompletedPairs
+
+TEST = ("Legitimate", "t")
+
+
+def test_done_and_range_done():
+    completed = CompletedPairs()
+    for i in range(3, 42):
+        completed.add(TEST, 1, i)
+    completed.add(TEST, 1, 3)
+    assert completed.total == 39
+    assert completed.done(TEST, 1, 3) and completed.done(TEST, 1, 41)
+    assert not completed.done(TEST, 1, 2) and not completed.done(TEST, 1, 42) and not completed.done(TEST, 2, 3)
+    # Partial bytes at both ends, whole bytes in between
+    assert completed.range_done(TEST, 1, 3, 42)
+    assert completed.range_done(TEST, 1, 5, 6)
+    assert completed.range_done(TEST, 1, 8, 40)
+    assert not completed.range_done(TEST, 1, 2, 42)
+    assert not completed.range_done(TEST, 1, 3, 43)
+    assert not completed.range_done(TEST, 1, 40, 48)
+    assert not completed.range_done(TEST, 2, 3, 4)
+
+
+def test_range_done_finds_a_gap_in_whole_bytes():
+    completed = CompletedPairs()
+    for i in range(64):
+        if i != 20:
+            completed.add(TEST, 1, i)
+    assert not completed.range_done(TEST, 1, 0, 64)
+    assert not completed.range_done(TEST, 1, 16, 24)
+    assert completed.range_done(TEST, 1, 0, 20) and completed.range_done(TEST, 1, 21, 64)
@@ -0,0 +1,40 @@
+import json
+
+from corpus import compile_corpus, normalize_headers, open_corpus
+from manifest import iter_payloads_at, manifest_key, refresh_manifest
+from storage import payload_id
+
+PAYLOADS = [
+    {"method": "GET", "url": "/a", "headers": {"X-Count": 3, "X-Flag": True, "X-Name": "é"}},
+    {"method": "POST", "url": "/b", "headers": {"Content-Length": 0, "X-Ratio": 1.5}, "data": {"q": "1"}},
+    {"method": "GET", "url": "/c", "headers": None, "data": "text"},
+    {"method": "GET", "url": "/d"},
+]
+
+
+def ids(payloads):
+    return [payload_id("Malicious", "t", i, str(p["method"]), str(p["url"]),
+                       normalize_headers(p.get("headers")), p.get("data"))
+            for i, p in enumerate(payloads)]
+
+
+def test_corpus_and_json_payloads_get_the_same_ids(tmp_path):
+    test_file = tmp_path / "Malicious" / "t.json"
+    test_file.parent.mkdir()
+    test_file.write_text(json.dumps(PAYLOADS), encoding="utf-8")
+    manifest = refresh_manifest([test_file], tmp_path / "manifest.idx")
+    entry = manifest[manifest_key(test_file)]
+    corpus_path = tmp_path / "corpus.bin"
+    assert compile_corpus([test_file], manifest, corpus_path) == len(PAYLOADS)
+
+    corpus = open_corpus(manifest, [manifest_key(test_file)], corpus_path)
+    records = list(corpus.iter_file(manifest_key(test_file)))
+    assert records[0].headers == {"X-Count": "3", "X-Flag": "True", "X-Name": "é"}
+    assert ids(records) == ids(list(iter_payloads_at(test_file, entry["offsets"])))
+    del records
+    corpus.close()
+
+
+def test_normalize_headers():
+    assert normalize_headers(None) == {} and normalize_headers({}) == {}
+    assert normalize_headers({1: 2, "a": "b"}) == {"1": "2", "a": "b"}
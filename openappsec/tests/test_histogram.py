@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from histogram import LatencyHistogram
+
+
+def test_buckets_cover_values_contiguously():
+    h = LatencyHistogram(bits=4)
+    previous_high = 0
+    for index in range(200):
+        low, high = h.bucket_range(index)
+        assert low == previous_high and high > low
+        assert h.bucket_index(low) == index and h.bucket_index(high - 1) == index
+        previous_high = high
+
+
+@pytest.mark.parametrize("value", [0, 1, 255, 256, 257, 1000, 65_535, 65_536, 10**6, 10**9 + 7])
+def test_bucket_width_bounds_relative_error(value):
+    h = LatencyHistogram()
+    low, high = h.bucket_range(h.bucket_index(value))
+    assert low <= value < high
+    assert high - low <= max(1, value / 2 ** (h.bits - 1))
+
+
+def test_percentiles_within_bucket_precision():
+    rng = random.Random(1)
+    values = sorted(int(rng.lognormvariate(8, 1.5)) for _ in range(20_000))
+    h = LatencyHistogram()
+    h.record_all(values + [None])
+    assert h.total == len(values)
+    for q in (1, 50, 90, 99, 99.9):
+        exact = values[max(0, int(-(-len(values) * q // 100)) - 1)]
+        assert h.percentile(q) == pytest.approx(exact, rel=1 / 2 ** (h.bits - 1), abs=1)
+    assert h.percentile(0) == values[0] and h.percentile(100) == values[-1]
+
+
+def test_small_values_are_exact_and_clamped():
+    h = LatencyHistogram()
+    for v in (5, 5, 7, 9):
+        h.record(v)
+    h.record(-3)        # clamped to 0
+    assert [h.percentile(q) for q in (20, 40, 60, 80, 100)] == [0, 5, 5, 7, 9]
+    assert LatencyHistogram().percentile(50) is None
+    single = LatencyHistogram()
+    single.record(123_456)
+    assert single.percentile(50) == 123_456      # bucket midpoint clamped to the observed range
+
+
+def test_merge_equals_recording_everything_and_round_trips():
+    rng = random.Random(2)
+    values = [rng.randrange(1, 5_000_000) for _ in range(5000)]
+    whole, parts = LatencyHistogram(), [LatencyHistogram() for _ in range(3)]
+    whole.record_all(values)
+    for i, v in enumerate(values):
+        parts[i % 3].record(v)
+    merged = LatencyHistogram().merge(parts[0]).merge(parts[1]).merge(parts[2])
+    assert merged.to_dict() == whole.to_dict() and merged.total == whole.total
+    loaded = LatencyHistogram.loads(merged.dumps())
+    assert [loaded.percentile(q) for q in (50, 99)] == [whole.percentile(q) for q in (50, 99)]
+    with pytest.raises(ValueError):
+        whole.merge(LatencyHistogram(bits=6))
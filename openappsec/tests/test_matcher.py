@@ -0,0 +1,37 @@
+from matcher import BlockMatcher, learn_signature
+
+NORMAL = b"<html><head><title>Shop</title></head><body><h1>Welcome to the shop</h1></body></html>"
+
+
+def block_page(incident: str, when: str, title: str = "") -> bytes:
+    return (f"<html><head>{title}</head><body><h2>Sorry, you have been blocked</h2>\n"
+            f"<p>The request was rejected by the security policy of this site. Incident {incident} at {when} "
+            f"from 203.0.113.7</p></body></html>").encode()
+
+
+def test_signature_ignores_per_request_values():
+    first = learn_signature(block_page("8f3a2c9e41d07b56", "2026-10-18 09:12:44"), NORMAL)
+    second = learn_signature(block_page("0c11fe92aa7e4d13", "2026-10-18 09:13:02"), NORMAL)
+    assert first == second
+    assert first.startswith("The request was rejected") and len(first) <= 64
+    assert BlockMatcher([first]).search(block_page("ffff0000ffff0000", "2027-01-01 00:00:00")) is not None
+
+
+def test_title_is_preferred_and_cut_at_ids():
+    page = block_page("1", "now", title="<title>Attack Detected - Ref #48213</title>")
+    assert learn_signature(page, NORMAL) == "Attack Detected - Ref #"
+    # A title the normal page shares is not distinctive
+    assert learn_signature(block_page("1", "now", title="<title>Shop</title>"), NORMAL).startswith("The request")
+
+
+def test_no_signature_when_nothing_distinctive():
+    assert learn_signature(b"<html><title>Shop</title><h1>Welcome to the shop</h1>12345678</html>", NORMAL) is None
+
+
+def test_scanner_finds_phrases_across_chunks():
+    matcher = BlockMatcher(["Access denied", "Request blocked by"])
+    scan = matcher.scanner()
+    assert not scan.feed(b"<html>... Acc")
+    assert scan.feed(b"ess denied ...")
+    assert matcher.search(b"Request blocked by x") == b"Request blocked by"
+    assert matcher.phrases[0] == b"Request blocked by"      # recent matches move to the front
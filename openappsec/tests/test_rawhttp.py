@@ -0,0 +1,84 @@
+import asyncio
+
+from rawhttp import RawHTTPClient
+from templates import RequestTemplate
+
+GET = RequestTemplate.build("GET", "/x", {}, None)
+
+
+async def serve(responses, batch=1):
+    """
+    Server answering requests with responses in order; it reads batch requests
+    before answering them, and a None after a response closes the connection.
+    Returns (client, number of accepted connections (a one-item list), server).
+    """
+    responses = list(responses)
+    accepted = [0]
+
+    async def handle(reader, writer):
+        accepted[0] += 1
+        try:
+            while responses:
+                for _ in range(batch):
+                    await reader.readuntil(b"\r\n\r\n")
+                for _ in range(batch):
+                    writer.write(responses.pop(0))
+                await writer.drain()
+                if responses and responses[0] is None:
+                    responses.pop(0)
+                    return
+        except asyncio.IncompleteReadError:
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    return RawHTTPClient(f"http://127.0.0.1:{port}", max_connections=1, pipeline=batch), accepted, server
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_chunked_body_keeps_connection():
+    async def main():
+        client, accepted, server = await serve([
+            b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"5;ext=1\r\nhello\r\n6\r\n world\r\n0\r\nX-Trailer: 1\r\n\r\n",
+            b"HTTP/1.1 403 Forbidden\r\nContent-Length: 7\r\n\r\nblocked",
+        ])
+        async with server:
+            statuses = [await client.status(GET), await client.status(GET)]
+            await client.aclose()
+        return statuses, accepted[0]
+
+    assert run(main()) == ([200, 403], 1)
+
+
+def test_close_delimited_body_opens_new_connection():
+    async def main():
+        client, accepted, server = await serve([b"HTTP/1.1 200 OK\r\n\r\nuntil the end", None,
+                                                b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"])
+        async with server:
+            statuses = [await client.status(GET), await client.status(GET)]
+            await client.aclose()
+        return statuses, accepted[0]
+
+    assert run(main()) == ([200, 404], 2)
+
+
+def test_pipelined_responses_arrive_in_order():
+    async def main():
+        client, accepted, server = await serve([
+            b"HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok",
+            b"HTTP/1.1 403 Forbidden\r\nTransfer-Encoding: chunked\r\n\r\n3\r\nno!\r\n0\r\n\r\n",
+            b"HTTP/1.1 204 No Content\r\n\r\n",
+        ], batch=3)
+        async with server:
+            # The server answers only once all three requests are on the one connection
+            statuses = await asyncio.gather(*(client.status(GET) for _ in range(3)))
+            await client.aclose()
+        return statuses, accepted[0]
+
+    assert run(main()) == ([200, 403, 204], 1)
@@ -0,0 +1,105 @@
+import asyncio
+from pathlib import PurePath
+
+import pytest
+
+import storage
+from checkpoint import CompletedPairs
+from runner import Wafs
+import sources
+
+N = 20
+PAYLOADS = [{"method": "GET", "url": f"/item/{i}"} for i in range(N)]
+
+
+def plan():
+    source = sources.TestSource(PurePath("Legitimate/resume.json"), "resume", N,
+                                lambda start=0, stop=None: iter(PAYLOADS[start:stop]), splittable=True)
+    return sources.SourcePlan([source])
+
+
+async def http_server(gate: asyncio.Event = None):
+    """Keep-alive server answering 200 to everything; with a gate, only once it is set."""
+    async def handle(reader, writer):
+        try:
+            while True:
+                await reader.readuntil(b"\r\n\r\n")
+                if gate is not None:
+                    await gate.wait()
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "waf_comparison.db"
+    storage.ensure_results_table(db_path=path)
+    return path
+
+
+def flush(rows, db):
+    c = storage.connect(db)
+    try:
+        storage.flush_to_db(rows, c)
+    finally:
+        c.close()
+
+
+def test_resume_after_paced_feeder_ran_ahead(db, monkeypatch):
+    # "Slow" shares the unpaced feeder, whose window of one request never gets an answer
+    # before the interruption; "Paced" has a feeder of its own and finishes meanwhile.
+    monkeypatch.setenv("ASYNC_MAX_INFLIGHT", "2")
+    monkeypatch.setenv("TARGET_RPS_BY_WAF", "Paced=5000")
+    monkeypatch.setenv("LATENCY_TRACE", "false")
+
+    async def main():
+        gate = asyncio.Event()
+        slow_server, slow_url = await http_server(gate)
+        paced_server, paced_url = await http_server()
+        wafs = {"Slow": slow_url, "Paced": paced_url}
+        waf_ids = storage.register_wafs(wafs, db_path=db)
+        run_id = storage.start_run("m", "v1", db_path=db)
+
+        async def drive(completed, interrupt):
+            runner = Wafs(wafs)
+            run = {"run_id": run_id, "waf_ids": waf_ids, "write_payloads": True,
+                   "completed": completed, "verdicts": None}
+            rows = []
+            async with runner._http_clients(check=False, warm=False) as http:
+                task = asyncio.create_task(runner._drive(plan(), None, run, rows.append, lambda n: None, http))
+                if interrupt:
+                    while sum(1 for tag, _ in rows if tag == storage.RESULT_ROW) < N:
+                        await asyncio.sleep(0.01)
+                    task.cancel()
+                    rows = list(rows)   # what the writer had committed when the run was interrupted
+                await asyncio.gather(task, return_exceptions=True)
+            return rows
+
+        async with slow_server, paced_server:
+            rows = await drive(None, interrupt=True)
+            assert {r.waf_id for tag, r in rows if tag == storage.RESULT_ROW} == {waf_ids[paced_url]}
+            flush(rows, db)
+            completed = CompletedPairs.load(run_id, db_path=db)
+            assert completed.total == N
+            gate.set()
+            flush(await drive(completed, interrupt=False), db)
+        return run_id
+
+    run_id = asyncio.run(asyncio.wait_for(main(), 30))
+
+    c = storage.connect(db)
+    try:
+        counts = c.execute("""
+            SELECT waf_id, COUNT(*), COUNT(DISTINCT payload_id) FROM results WHERE run_id = ? GROUP BY waf_id
+        """, (run_id,)).fetchall()
+    finally:
+        c.close()
+    assert sorted(n for _, n, _ in counts) == [N, N]
+    assert all(n == distinct for _, n, distinct in counts)
@@ -0,0 +1,53 @@
+import random
+from collections import Counter
+
+from sampling import SmokeSpec, apportion, pick_indices, reservoir_sample, sample_stream
+
+
+def test_apportion_largest_remainder():
+    assert apportion(10, {"a": 1, "b": 1, "c": 1}) == {"a": 4, "b": 3, "c": 3}     # tie to the smaller key
+    assert apportion(10, {"a": 7, "b": 2, "c": 1}) == {"a": 7, "b": 2, "c": 1}
+    assert apportion(7, {"a": 50, "b": 30, "c": 20}) == {"a": 4, "b": 2, "c": 1}
+    for budget in range(0, 40):
+        assert sum(apportion(budget, {"a": 3, "b": 5, "c": 11, "d": 1}).values()) == budget
+
+
+def test_apportion_minimum_and_empty_weights():
+    assert apportion(10, {"big": 1000, "small": 1, "tiny": 1}, minimum=1) == {"big": 8, "small": 1, "tiny": 1}
+    # Not enough budget for the minimum of every key: plain proportional split
+    assert apportion(2, {"big": 1000, "small": 1, "tiny": 1}, minimum=1) == {"big": 2, "small": 0, "tiny": 0}
+    assert apportion(5, {"a": 0, "b": 2}) == {"a": 0, "b": 5}
+    assert apportion(5, {"a": 0}) == {"a": 0}
+    assert apportion(0, {"a": 1}) == {"a": 0}
+
+
+def test_reservoir_sample_keeps_indices():
+    items = [f"payload {i}" for i in range(1000)]
+    sample = reservoir_sample(iter(items), 50, random.Random(3))
+    assert len(sample) == 50
+    assert [i for i, _ in sample] == sorted({i for i, _ in sample})
+    assert all(items[i] == item for i, item in sample)
+    assert sample == reservoir_sample(iter(items), 50, random.Random(3))
+    # Short streams are taken whole
+    assert reservoir_sample(iter(items[:5]), 10, random.Random(3)) == list(enumerate(items[:5]))
+    assert reservoir_sample(iter(items), 0, random.Random(3)) == []
+
+
+def test_reservoir_sample_is_uniform():
+    rng = random.Random(7)
+    trials, n, k = 4000, 40, 5
+    seen = Counter(i for _ in range(trials) for i, _ in reservoir_sample(range(n), k, rng))
+    expected = trials * k / n
+    assert set(seen) == set(range(n))
+    assert all(abs(c - expected) < 0.2 * expected for c in seen.values())
+
+
+def test_sample_stream_and_pick_indices():
+    spec = SmokeSpec(per_file=4, seed=5)
+    picked = sample_stream(iter("abcdefghij"), 4, spec, "Legitimate/t.json")
+    assert [item for _, item in picked] == ["abcdefghij"[i] for i, _ in picked]
+    assert list(sample_stream(iter("abcdefghij"), 3, spec._replace(shuffle=False), "k")) == \
+        [(0, "a"), (1, "b"), (2, "c")]
+    assert pick_indices(10, 3, spec._replace(shuffle=False), "k") == [0, 1, 2]
+    assert pick_indices(10, 4, spec, "k") == pick_indices(10, 4, spec, "k")
+    assert pick_indices(3, 10, spec, "k") == [0, 1, 2]
@@ -0,0 +1,203 @@
+import zlib
+
+import pytest
+
+import storage
+from storage import PAYLOAD_ROW, RESULT_ROW, ResultRecord
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = tmp_path / "waf_comparison.db"
+    storage.ensure_results_table(db_path=path)
+    return path
+
+
+def payload_row(index, dataset_type="Legitimate", test_name="t"):
+    row = (dataset_type, test_name, index, "GET", f"http://x/{index}", "{}", "")
+    return PAYLOAD_ROW, (storage.payload_id(*row), *row)
+
+
+def result_row(run_id, waf_id, pid, blocked=0, status=200, body=None, dataset_type="Legitimate", test_name="t"):
+    return RESULT_ROW, ResultRecord(run_id, pid, waf_id, status, blocked, 1000, None, 500, None,
+                                    (dataset_type, test_name), body)
+
+
+def test_view_returns_stored_body_text(db):
+    waf_id = storage.register_wafs({"WAF": "http://waf"}, db_path=db)["http://waf"]
+    run_id = storage.start_run("m", "v1", db_path=db)
+    bodies = ["<html>Request blocked – id 42</html>", "ok", None]
+    rows = [payload_row(i) for i in range(len(bodies))]
+    rows += [result_row(run_id, waf_id, r[1][0], body=b) for r, b in zip(rows, bodies)]
+    c = storage.connect(db)
+    try:
+        storage.flush_to_db(rows, c)
+        got = c.execute(
+            "SELECT url, response_body, response_body_z FROM waf_comparison ORDER BY url"
+        ).fetchall()
+    finally:
+        c.close()
+    assert [body for _, body, _ in got] == bodies
+    assert [z and zlib.decompress(z).decode() for _, _, z in got] == bodies
+
+
+def test_prune_runs_keeps_latest_groups(db):
+    waf_id = storage.register_wafs({"WAF": "http://waf"}, db_path=db)["http://waf"]
+    rows = [payload_row(0)]
+    pid = rows[0][1][0]
+    first = storage.start_run("m", "v1", db_path=db)
+    second = storage.start_run("m", "v1", db_path=db)
+    merged = storage.start_run("agent", "v1", db_path=db, run_group=second)
+    c = storage.connect(db)
+    try:
+        storage.flush_to_db(rows + [result_row(first, waf_id, pid, body="old page"),
+                                    result_row(second, waf_id, pid, body="new page"),
+                                    result_row(merged, waf_id, pid, body="new page")], c)
+    finally:
+        c.close()
+
+    assert storage.prune_runs(1, db_path=db) == 1
+    assert storage.prune_runs(1, db_path=db) == 0
+    c = storage.connect(db)
+    try:
+        assert [r[0] for r in c.execute("SELECT run_id FROM results ORDER BY run_id")] == [second, merged]
+        assert [r[0] for r in c.execute("SELECT DISTINCT run_id FROM result_counts")] == [second, merged]
+        assert [storage.body_text(r[0]) for r in c.execute("SELECT body FROM bodies")] == ["new page"]
+        assert c.execute("SELECT COUNT(*) FROM payloads").fetchone()[0] == 1
+    finally:
+        c.close()
+    with pytest.raises(ValueError):
+        storage.prune_runs(0, db_path=db)
+
+
+def test_target_rps_column_is_renamed(tmp_path):
+    path = tmp_path / "old.db"
+    c = storage.connect(path)
+    with c:
+        c.execute("CREATE TABLE results (run_id INTEGER NOT NULL, payload_id INTEGER NOT NULL, waf_id INTEGER NOT NULL, "
+                  "status INTEGER NOT NULL, blocked INTEGER NOT NULL, latency_us INTEGER, target_rps INTEGER)")
+        c.execute("INSERT INTO results VALUES (1, 2, 3, 200, 0, 1000, 450)")
+    c.close()
+    storage.ensure_results_table(db_path=path)
+    c = storage.connect(path)
+    try:
+        columns = [row[1] for row in c.execute("PRAGMA table_info(results)")]
+        assert "target_rps" not in columns
+        assert c.execute("SELECT achieved_rps, body_id FROM results").fetchall() == [(450, None)]
+    finally:
+        c.close()
+
+
+def test_baseline_wide_table_is_kept_as_legacy(tmp_path):
+    path = tmp_path / "baseline.db"
+    c = storage.connect(path)
+    with c:
+        c.execute("""
+            CREATE TABLE waf_comparison (method TEXT, url TEXT, headers TEXT, data TEXT, machineName TEXT,
+              DestinationURL TEXT, WAF_Name TEXT, DateTime TEXT, TestName TEXT, DataSetType TEXT,
+              response_status_code INTEGER, isBlocked INTEGER, response_body TEXT)
+        """)
+        c.execute("INSERT INTO waf_comparison VALUES ('GET', '/', '{}', '', 'm', 'http://waf', 'WAF', 'now', "
+                  "'t', 'Legitimate', 200, 0, 'page')")
+    c.close()
+
+    storage.ensure_results_table(db_path=path)
+    c = storage.connect(path)
+    try:
+        kinds = dict(c.execute("SELECT name, type FROM sqlite_master WHERE name LIKE 'waf_%'"))
+        assert kinds == {"waf_comparison_legacy": "table", "waf_comparison": "view", "waf_counts": "view",
+                         "wafs": "table"}
+        assert c.execute("SELECT url, response_body FROM waf_comparison_legacy").fetchall() == [("/", "page")]
+        assert c.execute("SELECT COUNT(*) FROM waf_comparison").fetchone()[0] == 0
+    finally:
+        c.close()
+
+    # A fresh start drops the old table instead
+    path.unlink()
+    c = storage.connect(path)
+    with c:
+        c.execute("CREATE TABLE waf_comparison (method TEXT, url TEXT)")
+    c.close()
+    storage.ensure_results_table(fresh=True, db_path=path)
+    c = storage.connect(path)
+    try:
+        assert c.execute("SELECT type FROM sqlite_master WHERE name = 'waf_comparison'").fetchone() == ("view",)
+        assert c.execute("SELECT 1 FROM sqlite_master WHERE name = 'waf_comparison_legacy'").fetchone() is None
+    finally:
+        c.close()
+
+
+def test_flush_to_db_adds_up_counts(db):
+    waf_id = storage.register_wafs({"WAF": "http://waf"}, db_path=db)["http://waf"]
+    run_id = storage.start_run("m", "v1", db_path=db)
+    payloads = [payload_row(i) for i in range(4)]
+    pids = [row[1][0] for row in payloads]
+    c = storage.connect(db)
+    try:
+        # Payload rows of every batch (and feeder) are inserted once
+        assert storage.flush_to_db(payloads + [result_row(run_id, waf_id, pids[0], blocked=1, status=403, body="no"),
+                                               result_row(run_id, waf_id, pids[1])], c) == 2
+        assert storage.flush_to_db(payloads + [result_row(run_id, waf_id, pids[2], blocked=1, status=403, body="no"),
+                                               result_row(run_id, waf_id, pids[3], status=0)], c) == 2
+        assert storage.flush_to_db([], c) == 0
+        assert c.execute("SELECT COUNT(*) FROM payloads").fetchone()[0] == 4
+        assert c.execute("SELECT COUNT(*) FROM bodies").fetchone()[0] == 1
+        assert c.execute("SELECT blocked, passed, failed FROM result_counts").fetchall() == [(2, 1, 1)]
+        assert c.execute("SELECT WAF_Name, blocked, passed, failed FROM waf_counts").fetchall() == [("WAF", 2, 1, 1)]
+    finally:
+        c.close()
+
+
+def agent_file(path, wafs, machine, blocked):
+    """Results file of one agent: every payload sent to every WAF, with the given verdict."""
+    storage.ensure_results_table(db_path=path)
+    waf_ids = storage.register_wafs(wafs, db_path=path)
+    run_id = storage.start_run(machine, "v1", db_path=path)
+    payloads = [payload_row(i) for i in range(3)]
+    rows = payloads + [result_row(run_id, waf_id, row[1][0], blocked=blocked, status=403 if blocked else 200)
+                       for row in payloads for waf_id in waf_ids.values()]
+    c = storage.connect(path)
+    try:
+        storage.flush_to_db(rows, c)
+    finally:
+        c.close()
+    storage.finish_run(run_id, db_path=path)
+    return path
+
+
+def test_merge_results(db, tmp_path):
+    # The agents registered the WAFs in different orders, so their waf_ids differ
+    a = agent_file(tmp_path / "a.db", {"A": "http://a", "B": "http://b"}, "agent-a", blocked=1)
+    b = agent_file(tmp_path / "b.db", {"B": "http://b", "A": "http://a"}, "agent-b", blocked=0)
+    assert storage.merge_results([a, b], into=db) == 12
+
+    c = storage.connect(db)
+    try:
+        runs = c.execute("SELECT machineName, run_group, finished IS NOT NULL FROM runs ORDER BY run_id").fetchall()
+        assert [r[0] for r in runs] == ["agent-a", "agent-b"] and len({r[1] for r in runs}) == 1
+        assert all(r[2] for r in runs)
+        assert c.execute("SELECT COUNT(*) FROM payloads").fetchone()[0] == 3
+        counts = c.execute("SELECT WAF_Name, blocked, passed FROM waf_counts ORDER BY WAF_Name").fetchall()
+        assert counts == [("A", 3, 3), ("B", 3, 3)]
+        per_machine = c.execute("""
+            SELECT machineName, WAF_Name, SUM(isBlocked), COUNT(*) FROM waf_comparison
+            GROUP BY machineName, WAF_Name ORDER BY machineName, WAF_Name
+        """).fetchall()
+        assert per_machine == [("agent-a", "A", 3, 3), ("agent-a", "B", 3, 3),
+                               ("agent-b", "A", 0, 3), ("agent-b", "B", 0, 3)]
+    finally:
+        c.close()
+
+    # append joins the latest run group; without it the merged runs replace what the views show
+    assert storage.merge_results([a], into=db, append=True) == 6
+    c = storage.connect(db)
+    try:
+        assert c.execute("SELECT COUNT(*) FROM waf_comparison").fetchone()[0] == 18
+    finally:
+        c.close()
+    assert storage.merge_results([b], into=db) == 6
+    c = storage.connect(db)
+    try:
+        assert c.execute("SELECT COUNT(*), SUM(isBlocked) FROM waf_comparison").fetchone() == (6, 0)
+    finally:
+        c.close()
@@ -0,0 +1,78 @@
+import pytest
+
+import storage
+from runner import Wafs
+from storage import PAYLOAD_ROW, RESULT_ROW, ResultRecord
+from verdicts import VerdictCache, detection_fingerprint, parse_fingerprints
+
+WAFS = {"A": "http://a", "B": "http://b"}
+
+
+def test_parse_fingerprints(tmp_path):
+    policy = tmp_path / "policy.tf"
+    policy.write_text("rule 1")
+    fingerprints = parse_fingerprints(WAFS, f" A = @{policy} ; B=v3;;")
+    assert fingerprints["http://b"] == "v3"
+    assert fingerprints["http://a"].startswith("sha256:")
+    policy.write_text("rule 2")
+    assert parse_fingerprints(WAFS, f"A=@{policy}")["http://a"] != fingerprints["http://a"]
+    assert parse_fingerprints(WAFS, "A=;B=") == {}
+    with pytest.raises(ValueError):
+        parse_fingerprints(WAFS, "C=v1")
+
+
+def test_detection_settings_are_part_of_the_key(monkeypatch):
+    runner = Wafs(dict(WAFS))
+    base = detection_fingerprint("v3", runner.detection_settings("http://a"))
+    assert base.startswith("v3+detection:")
+    assert detection_fingerprint("v3", dict(reversed(runner.detection_settings("http://a").items()))) == base
+    assert detection_fingerprint("v4", runner.detection_settings("http://a")) != base
+
+    runner.block_signatures["http://a"] = ["Blocked by A"]
+    assert detection_fingerprint("v3", runner.detection_settings("http://a")) != base
+    assert detection_fingerprint("v3", runner.detection_settings("http://b")) == base   # only A learned one
+    for name, value in (("BLOCK_STATUS", "403"), ("BLOCK_PHRASES", "denied"),
+                        ("FAST_BLOCK_DETECTION", "false"), ("PEEK_BYTES", "128")):
+        monkeypatch.setenv(name, value)
+        assert detection_fingerprint("v3", Wafs(dict(WAFS)).detection_settings("http://a")) != base
+        monkeypatch.delenv(name)
+
+
+def test_store_load_get(tmp_path):
+    db = tmp_path / "waf_comparison.db"
+    storage.ensure_results_table(db_path=db)
+    waf_ids = storage.register_wafs(WAFS, db_path=db)
+    run_id = storage.start_run("m", "v1", db_path=db)
+    pids, rows = [], []
+    for i in range(4):
+        payload = ("Malicious", "t", i, "GET", f"/{i}", "{}", "")
+        pids.append(storage.payload_id(*payload))
+        rows.append((PAYLOAD_ROW, (pids[-1], *payload)))
+
+    def result(waf, pid, status, blocked, latency_us=1000):
+        return RESULT_ROW, ResultRecord(run_id, pid, waf_ids[WAFS[waf]], status, blocked, latency_us,
+                                        None, None, None, ("Malicious", "t"), None)
+
+    rows += [result("A", pids[0], 403, 1), result("A", pids[1], 200, 0),
+             result("A", pids[2], 0, 0),                         # failed: not cached
+             result("A", pids[3], 403, 1, latency_us=None),      # from the cache already: not stored again
+             result("B", pids[0], 200, 0)]
+    c = storage.connect(db)
+    try:
+        storage.flush_to_db(rows, c)
+    finally:
+        c.close()
+
+    key = detection_fingerprint("v3", {"block_status": [403]})
+    assert VerdictCache({WAFS["A"]: key}).store(run_id, waf_ids, db_path=db) == 2
+
+    cache = VerdictCache.load({WAFS["A"]: key}, db_path=db)
+    assert cache.total == 2
+    assert cache.get(WAFS["A"], pids[0]) == (403, 1)
+    assert cache.get(WAFS["A"], pids[1]) == (200, 0)
+    assert cache.get(WAFS["A"], pids[2]) is None and cache.get(WAFS["A"], pids[3]) is None
+    assert cache.get(WAFS["B"], pids[0]) is None            # B has no fingerprint
+    # Other detection settings (or policy) miss everything
+    other = detection_fingerprint("v3", {"block_status": [403, 406]})
+    assert VerdictCache.load({WAFS["A"]: other}, db_path=db).total == 0
+    assert VerdictCache.load({WAFS["B"]: key}, db_path=db).total == 0
@@ -0,0 +1,120 @@
+# verdicts.py
+"""
+Verdict cache for incremental re-runs after WAF policy changes.
+
+A WAF's answer to a payload depends on the payload and the WAF's config, so
+results can be reused as long as neither changed. Each WAF in
+WAF_FINGERPRINTS gets a user-supplied config fingerprint:
+
+    WAF_FINGERPRINTS="AAP WAF=@../akamai_cdn_aap/aap.tf;BunkerWeb WAF=policy-v3"
+
+("@path" stands for a hash of that file's contents). `blocked` also depends
+on how the runner recognizes a block (BLOCK_STATUS, the block phrases, the
+WAF's learned block page signature, FAST_BLOCK_DETECTION, PEEK_BYTES), so
+the key is the fingerprint extended by a hash of those settings
+(detection_fingerprint): changing them misses the cache like a policy
+change. The verdicts table keeps status and blocked per (WAF endpoint,
+fingerprint, payload_id); payload_id is a hash of the payload and its place
+in the corpus (see storage.payload_id), so an edited payload misses. At the start of a run the verdicts of every
+fingerprinted WAF are loaded into sorted arrays (about 12 bytes per payload,
+cheap to pickle to workers); the runner then writes a result row from the
+cache for every hit, like the pairs a resumed run skips, and sends only the
+misses. The answered results (status != 0) of the run are stored back under
+its fingerprints, so after a policy change of one WAF only that WAF is sent
+the corpus again. Cached rows have no latency and no response body.
+WAFs without a fingerprint are always sent everything.
+"""
+import hashlib
+import json
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from config import DB_PATH
+from helper import log
+from storage import connect
+
+
+def parse_fingerprints(wafs: dict, spec: str) -> dict:
+    """{WAF URL: fingerprint} of WAF_FINGERPRINTS; "@path" is replaced by a hash of the file."""
+    fingerprints = {}
+    for part in spec.split(";"):
+        if "=" not in part:
+            continue
+        name, value = (s.strip() for s in part.split("=", 1))
+        if name not in wafs:
+            raise ValueError(f"WAF_FINGERPRINTS names an unknown WAF: {name!r}")
+        if value.startswith("@"):
+            path = Path(value[1:]).expanduser()
+            value = "sha256:" + hashlib.sha256(path.read_bytes()).hexdigest()[:16]
+        if value:
+            fingerprints[wafs[name]] = value
+    return fingerprints
+
+
+def detection_fingerprint(fingerprint: str, detection: dict) -> str:
+    """fingerprint extended by a hash of the block detection settings its verdicts are judged by."""
+    digest = hashlib.sha256(json.dumps(detection, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{fingerprint}+detection:{digest}"
+
+
+class VerdictCache:
+    """Cached (status, blocked) per payload_id for each fingerprinted WAF URL."""
+
+    def __init__(self, fingerprints: dict):
+        self.fingerprints = fingerprints
+        self._ids = {}          # url -> array('q') of payload_ids, sorted
+        self._verdicts = {}     # url -> array('i') of status * 2 + blocked, same order
+
+    def get(self, url: str, pid: int):
+        """(status, blocked) cached for this WAF and payload, or None."""
+        ids = self._ids.get(url)
+        if not ids:
+            return None
+        i = bisect_left(ids, pid)
+        if i == len(ids) or ids[i] != pid:
+            return None
+        v = self._verdicts[url][i]
+        return v >> 1, v & 1
+
+    @property
+    def total(self) -> int:
+        return sum(len(ids) for ids in self._ids.values())
+
+    @classmethod
+    def load(cls, fingerprints: dict, db_path=DB_PATH) -> "VerdictCache":
+        cache = cls(fingerprints)
+        c = connect(db_path)
+        try:
+            for url, fingerprint in fingerprints.items():
+                ids, verdicts = array("q"), array("i")
+                for pid, status, blocked in c.execute("""
+                    SELECT payload_id, status, blocked FROM verdicts
+                    WHERE endpoint = ? AND fingerprint = ? ORDER BY payload_id
+                """, (url, fingerprint)):
+                    ids.append(pid)
+                    verdicts.append(status * 2 + (1 if blocked else 0))
+                cache._ids[url], cache._verdicts[url] = ids, verdicts
+                log.info(f"Verdict cache of {url} ({fingerprint}): {len(ids)} payloads")
+        finally:
+            c.close()
+        return cache
+
+    def store(self, run_id: int, waf_ids: dict, db_path=DB_PATH) -> int:
+        """
+        Save the answered results a run sent (rows from the cache have no
+        latency) under the fingerprints; returns the rows written.
+        """
+        c = connect(db_path)
+        stored = 0
+        try:
+            with c:
+                for url, fingerprint in self.fingerprints.items():
+                    stored += c.execute("""
+                        INSERT OR REPLACE INTO verdicts (endpoint, fingerprint, payload_id, status, blocked)
+                        SELECT ?, ?, payload_id, status, blocked FROM results
+                        WHERE run_id = ? AND waf_id = ? AND status != 0 AND latency_us IS NOT NULL
+                    """, (url, fingerprint, run_id, waf_ids[url])).rowcount
+        finally:
+            c.close()
+        return stored